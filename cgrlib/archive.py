@@ -0,0 +1,457 @@
+# archive.py
+#
+# Append-only capture archive for the CGR-101 USB oscilloscope
+#
+# An archive is a directory holding:
+#
+#   archive.cfg      -- Archive format description (ConfigObj format)
+#   chunk_NNNNN.dat  -- Fixed-size capture records (see record_dtype)
+#   index.dat        -- One index_dtype entry per capture
+#
+# Captures are only ever appended.  The capture data is written
+# before its index entry, so a reader that only trusts the index never
+# sees a partially written capture.  Every record has the same size,
+# so readers can memory-map the chunk files and reach any capture
+# without loading anything else.
+
+import logging  # The python logging module
+import os # For basic file I/O
+import time # For capture timestamps
+import zlib # For calibration checksums
+
+import numpy
+from configobj import ConfigObj # For writing and reading the archive config
+
+# create logger
+module_logger = logging.getLogger('root.archive')
+module_logger.setLevel(logging.DEBUG)
+
+# Global variables
+archive_version = 1 # Increment when record_dtype or index_dtype change
+capture_points = 1024 # Samples per channel in one capture
+chunk_records = 4096 # Captures per chunk file (about 17MB)
+configname = 'archive.cfg'
+indexname = 'index.dat'
+
+"""Specify the capture record.
+
+The raw data is stored exactly as it comes back from
+utils.get_uncal_triggered_data or utils.get_uncal_forced_data:
+data[0] is channel A, data[1] is channel B.  The trigger fields mirror
+the trigger dictionary (see utils.get_trig_dict).
+
+"""
+record_dtype = numpy.dtype([
+    ('seq', '<u8'), # Sequence number, starting from 0
+    ('timestamp', '<f8'), # Capture time (seconds since the epoch)
+    ('rate', '<f8'), # Actual sample rate (Hz)
+    ('triglev', '<f8'), # Trigger level (V)
+    ('calid', '<u4'), # Calibration checksum (see get_cal_id)
+    ('trigpts', '<u2'), # Points acquired after trigger
+    ('trigsrc', '<u1'), # Trigger source
+    ('trigpol', '<u1'), # Trigger polarity
+    ('gain', '<u1', (2,)), # [Channel A gain, Channel B gain]
+    ('reserved', '<u1', (6,)), # Pads the header to 48 bytes
+    ('data', '<u2', (2, capture_points)) # Raw ADC counts
+])
+
+"""Specify the index entry.
+
+There is one entry for every capture, in sequence order.  The offset
+is the byte offset of the capture record inside its chunk file.
+
+"""
+index_dtype = numpy.dtype([
+    ('seq', '<u8'),
+    ('timestamp', '<f8'),
+    ('chunk', '<u4'),
+    ('reserved', '<u4'),
+    ('offset', '<u8')
+])
+
+
+def get_cal_id(caldict):
+    """Return a 32-bit checksum identifying a calibration dictionary.
+
+    Captures store this checksum instead of the calibration itself.
+    Two captures with the same checksum were taken with the same
+    calibration factors.
+
+    Arguments:
+      caldict -- Dictionary of calibration constants.  See
+                 utils.caldict_default for the keys.
+    """
+    calstr = ''
+    for key in sorted(caldict):
+        calstr += key + '=' + repr(caldict[key]) + ';'
+    return zlib.crc32(calstr.encode('ascii')) & 0xffffffff
+
+
+def get_chunk_name(directory, chunknum):
+    """Return the path of a chunk file
+
+    Arguments:
+      directory -- The archive directory
+      chunknum -- Chunk number (0, 1, 2, ...)
+    """
+    return os.path.join(directory, 'chunk_' + '{:05d}'.format(chunknum) +
+                        '.dat')
+
+
+def get_record_trigdict(record):
+    """Return the trigger dictionary stored with a capture record.
+
+    See utils.get_trig_dict for the dictionary keys.
+
+    Arguments:
+      record -- A single record_dtype capture record
+    """
+    trigdict = {}
+    trigdict['trigsrc'] = int(record['trigsrc'])
+    trigdict['triglev'] = float(record['triglev'])
+    trigdict['trigpol'] = int(record['trigpol'])
+    trigdict['trigpts'] = int(record['trigpts'])
+    return trigdict
+
+
+def get_cal_volts(records, caldict):
+    """Return calibrated voltages for a block of capture records.
+
+    This is utils.get_cal_data applied to every record at once, using
+    the gain settings stored with each record.  Returns an N x 2 x
+    1024 float array.
+
+    Arguments:
+      records -- Array of record_dtype capture records
+      caldict -- Dictionary of calibration constants.  See
+                 utils.caldict_default for the keys.
+    """
+    slopes = numpy.empty((len(records), 2))
+    offsets = numpy.empty((len(records), 2))
+    gains = records['gain']
+    for channum, channame in enumerate(['chA', 'chB']):
+        for gainval, gainname in [(0, '1x'), (1, '10x')]:
+            selected = (gains[:, channum] == gainval)
+            slopes[selected, channum] = caldict[
+                channame + '_' + gainname + '_slope']
+            offsets[selected, channum] = caldict[
+                channame + '_' + gainname + '_offset']
+    return ((511 - (records['data'] + offsets[:, :, numpy.newaxis])) *
+            slopes[:, :, numpy.newaxis])
+
+
+def init_archive(directory):
+    """Create an empty archive and return its configuration object.
+
+    Arguments:
+      directory -- The archive directory.  It will be created if it
+                   doesn't exist.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    config = ConfigObj()
+    config.filename = os.path.join(directory, configname)
+    config.initial_comment = [
+        'Capture archive written by cgrlib.  Do not edit.',
+        ' ']
+    config['version'] = archive_version
+    config['points'] = capture_points
+    config['chunk_records'] = chunk_records
+    module_logger.info('Creating capture archive in ' + directory)
+    config.write()
+    # Create the empty index
+    open(os.path.join(directory, indexname), 'ab').close()
+    return config
+
+
+def load_archive_config(directory):
+    """Return the configuration object of an existing archive.
+
+    Raises IOError if the directory doesn't hold a compatible archive.
+
+    Arguments:
+      directory -- The archive directory
+    """
+    config = ConfigObj(os.path.join(directory, configname), file_error=True)
+    if int(config['version']) != archive_version:
+        raise IOError('Archive ' + directory + ' has version ' +
+                      str(config['version']) + ', expected ' +
+                      str(archive_version))
+    if int(config['points']) != capture_points:
+        raise IOError('Archive ' + directory + ' stores ' +
+                      str(config['points']) + ' points per channel')
+    return config
+
+
+def read_index(directory):
+    """Return the archive index as a memory-mapped array.
+
+    An empty archive returns an empty (not memory-mapped) array, since
+    zero-length files can't be mapped.  A trailing partial entry left
+    by an interrupted write is ignored.
+
+    Arguments:
+      directory -- The archive directory
+    """
+    indexfile = os.path.join(directory, indexname)
+    entries = os.path.getsize(indexfile) // index_dtype.itemsize
+    if entries == 0:
+        return numpy.zeros(0, dtype=index_dtype)
+    return numpy.memmap(indexfile, dtype=index_dtype, mode='r',
+                        shape=(entries,))
+
+
+class ArchiveWriter(object):
+    """Appends captures to an archive.
+
+    Only one writer should have an archive open at a time.  Readers
+    can have it open while it's being written.
+
+    Arguments:
+      directory -- The archive directory.  A new archive is created if
+                   the directory doesn't hold one.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            self.config = load_archive_config(directory)
+        except IOError:
+            self.config = init_archive(directory)
+        self.chunk_records = int(self.config['chunk_records'])
+        index = read_index(directory)
+        if len(index) == 0:
+            self.nextseq = 0
+            self.chunknum = 0
+            self.chunkcount = 0
+        else:
+            self.nextseq = int(index[-1]['seq']) + 1
+            self.chunknum = int(index[-1]['chunk'])
+            self.chunkcount = int(numpy.sum(index['chunk'] == self.chunknum))
+        del index
+        # Drop any partial index entry left by an interrupted write
+        indexfile = os.path.join(directory, indexname)
+        indexsize = os.path.getsize(indexfile)
+        if indexsize % index_dtype.itemsize:
+            module_logger.warning('Truncating partial entry in ' + indexfile)
+            with open(indexfile, 'r+b') as fout:
+                fout.truncate(indexsize - (indexsize % index_dtype.itemsize))
+        self.indexfile = open(indexfile, 'ab')
+        self.chunkfile = None
+        module_logger.debug('Opened archive ' + directory + ' at sequence ' +
+                            str(self.nextseq))
+
+    def open_chunk(self, chunknum):
+        """Open a chunk file for appending and return the file object.
+
+        Readers find records by dividing offsets by the record size,
+        so a partial record left by an interrupted write would
+        misalign every record after it.  It's removed before anything
+        else is written.
+
+        Arguments:
+          chunknum -- Chunk number
+        """
+        chunkfile = get_chunk_name(self.directory, chunknum)
+        if os.path.exists(chunkfile):
+            chunksize = os.path.getsize(chunkfile)
+            if chunksize % record_dtype.itemsize:
+                module_logger.warning('Truncating partial record in ' +
+                                      chunkfile)
+                with open(chunkfile, 'r+b') as fout:
+                    fout.truncate(chunksize -
+                                  (chunksize % record_dtype.itemsize))
+        return open(chunkfile, 'ab')
+
+    def append(self, rawdata, rate, trigdict, gainlist, calid,
+               timestamp=None):
+        """Append one capture and return its sequence number.
+
+        Arguments:
+          rawdata -- Uncalibrated data downloaded from the CGR-101:
+                     [Channel A data, Channel B data]
+          rate -- Actual sample rate (Hz)
+          trigdict -- Dictionary of trigger settings (see
+                      utils.get_trig_dict)
+          gainlist -- [Channel A gain, Channel B gain]
+          calid -- Calibration checksum (see get_cal_id)
+          timestamp -- Capture time in seconds since the epoch.  The
+                       current time is used if this is None.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        if self.chunkcount >= self.chunk_records:
+            # This chunk is full.  Start a new one.
+            self.chunknum += 1
+            self.chunkcount = 0
+            if self.chunkfile is not None:
+                self.chunkfile.close()
+                self.chunkfile = None
+        if self.chunkfile is None:
+            self.chunkfile = self.open_chunk(self.chunknum)
+        record = numpy.zeros(1, dtype=record_dtype)
+        record['seq'] = self.nextseq
+        record['timestamp'] = timestamp
+        record['rate'] = rate
+        record['triglev'] = trigdict['triglev']
+        record['calid'] = calid
+        record['trigpts'] = trigdict['trigpts']
+        record['trigsrc'] = trigdict['trigsrc']
+        record['trigpol'] = trigdict['trigpol']
+        record['gain'] = gainlist
+        record['data'] = rawdata
+        # Append mode always writes at the end, so the current end of
+        # the file is where this record will land.  A whole record
+        # orphaned by an interrupted write is just skipped over, and
+        # open_chunk() removed any partial one.
+        self.chunkfile.seek(0, os.SEEK_END)
+        offset = self.chunkfile.tell()
+        record.tofile(self.chunkfile)
+        self.chunkfile.flush()
+        entry = numpy.zeros(1, dtype=index_dtype)
+        entry['seq'] = self.nextseq
+        entry['timestamp'] = timestamp
+        entry['chunk'] = self.chunknum
+        entry['offset'] = offset
+        entry.tofile(self.indexfile)
+        self.indexfile.flush()
+        self.chunkcount += 1
+        self.nextseq += 1
+        return self.nextseq - 1
+
+    def close(self):
+        """Close the chunk and index files."""
+        if self.chunkfile is not None:
+            self.chunkfile.close()
+            self.chunkfile = None
+        self.indexfile.close()
+
+
+class ArchiveReader(object):
+    """Random access to the captures in an archive.
+
+    Captures are addressed by their position in the index (0 is the
+    oldest capture).  Chunk files are memory-mapped, so reading a
+    capture only touches the pages holding that capture.
+
+    Arguments:
+      directory -- The archive directory
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.config = load_archive_config(directory)
+        self.chunkmaps = {} # Chunk number : memory-mapped records
+        self.refresh()
+
+    def refresh(self):
+        """Pick up captures appended since the archive was opened."""
+        self.index = read_index(self.directory)
+        # Mapped chunks may have grown.  Map them again when needed.
+        self.chunkmaps = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_chunk(self, chunknum):
+        """Return the memory-mapped records of a chunk file.
+
+        Arguments:
+          chunknum -- Chunk number
+        """
+        if not chunknum in self.chunkmaps:
+            chunkfile = get_chunk_name(self.directory, chunknum)
+            records = os.path.getsize(chunkfile) // record_dtype.itemsize
+            self.chunkmaps[chunknum] = numpy.memmap(
+                chunkfile, dtype=record_dtype, mode='r', shape=(records,)
+            )
+        return self.chunkmaps[chunknum]
+
+    def __getitem__(self, position):
+        """Return the capture record at an index position."""
+        entry = self.index[position]
+        chunk = self.get_chunk(int(entry['chunk']))
+        return chunk[int(entry['offset']) // record_dtype.itemsize]
+
+    def find_seq(self, seq):
+        """Return the index position of a sequence number.
+
+        Raises KeyError if the sequence number isn't in the archive.
+
+        Arguments:
+          seq -- Capture sequence number
+        """
+        if len(self.index) > 0:
+            # Sequence numbers are normally contiguous, so the
+            # position can be computed directly.
+            position = seq - int(self.index[0]['seq'])
+            if (0 <= position < len(self.index) and
+                int(self.index[position]['seq']) == seq):
+                return position
+            position = int(numpy.searchsorted(self.index['seq'], seq))
+            if (position < len(self.index) and
+                int(self.index[position]['seq']) == seq):
+                return position
+        raise KeyError('Sequence number ' + str(seq) + ' not in archive')
+
+    def get_seq(self, seq):
+        """Return the capture record with a sequence number.
+
+        Arguments:
+          seq -- Capture sequence number
+        """
+        return self[self.find_seq(seq)]
+
+    def find_time(self, start=None, stop=None):
+        """Return the [first, last + 1) index positions in a time range.
+
+        Arguments:
+          start -- Earliest capture time (seconds since the epoch).
+                   None means the start of the archive.
+          stop -- Capture times must be earlier than this.  None means
+                  the end of the archive.
+        """
+        timestamps = self.index['timestamp']
+        if start is None:
+            first = 0
+        else:
+            first = int(numpy.searchsorted(timestamps, start, 'left'))
+        if stop is None:
+            last = len(self.index)
+        else:
+            last = int(numpy.searchsorted(timestamps, stop, 'left'))
+        return (first, max(first, last))
+
+    def iter_blocks(self, first=0, last=None, blocksize=256):
+        """Yield (position, records) blocks of consecutive captures.
+
+        Each block is a view into one memory-mapped chunk file, so
+        blocks never span chunks and hold at most blocksize records.
+
+        Arguments:
+          first -- First index position
+          last -- One past the last index position (None for the end)
+          blocksize -- Maximum number of records per block
+        """
+        if last is None:
+            last = len(self.index)
+        position = first
+        while position < last:
+            entry = self.index[position]
+            chunknum = int(entry['chunk'])
+            start = int(entry['offset']) // record_dtype.itemsize
+            count = 1
+            # Extend the block while the next captures are stored
+            # right after this one in the same chunk.
+            while (position + count < last and count < blocksize):
+                nextentry = self.index[position + count]
+                if (int(nextentry['chunk']) != chunknum or
+                    int(nextentry['offset']) // record_dtype.itemsize !=
+                    start + count):
+                    break
+                count += 1
+            yield (position, self.get_chunk(chunknum)[start:start + count])
+            position += count
+
+    def close(self):
+        """Release the memory maps."""
+        self.chunkmaps = {}
+        self.index = None
@@ -0,0 +1,292 @@
+# codec.py
+#
+# Compact storage for raw CGR-101 samples
+#
+# The CGR-101's ADC returns 10-bit codes centered on 511, but they
+# arrive as 16-bit words.  This module packs four codes into five
+# bytes, and can optionally delta-encode and compress them for slowly
+# varying signals.  Everything is done with whole-array numpy
+# operations, so a block of many captures is encoded in one call.
+#
+# Encoded blobs start with a header:
+#
+#   magic (4 bytes)     'C10P'
+#   version (1 byte)
+#   flags (1 byte)      bit 0 set for delta encoding
+#   compressor (1 byte) 0 -- none, 1 -- zlib, 2 -- lzma
+#   ndim (1 byte)       Number of dimensions of the code array
+#   dims (4 bytes each) Shape of the code array
+#
+# ...followed by the (possibly compressed) sample payload.
+#
+# write_block() and read_blocks() store a series of blobs in one file,
+# each preceded by its length (4 bytes), so captures can be packed a
+# block at a time.
+
+import logging  # The python logging module
+import struct # For packing headers
+import zlib # For compression
+
+import numpy
+
+try:
+    import lzma # Python 3, or the backports.lzma package
+except ImportError:
+    lzma = None
+
+# create logger
+module_logger = logging.getLogger('root.codec')
+module_logger.setLevel(logging.DEBUG)
+
+# Global variables
+magic = 'C10P'.encode('ascii')
+codec_version = 1
+codebits = 10
+codemax = 2**codebits - 1 # Largest code the ADC can return
+codecenter = 511 # Code corresponding to 0V
+compressors = {None: 0, 'zlib': 1, 'lzma': 2}
+
+header_format = '<4sBBBB' # Magic, version, flags, compressor, ndim
+delta_flag = 1
+
+
+def check_codes(codes):
+    """Raise ValueError unless codes holds integer codes (0 to 1023)
+
+    Arguments:
+      codes -- Numpy array of codes
+    """
+    if codes.size and not numpy.issubdtype(codes.dtype, numpy.integer):
+        raise ValueError('Codes must be integers, not ' + str(codes.dtype))
+    if codes.size and (codes.min() < 0 or codes.max() > codemax):
+        raise ValueError('Codes must be between 0 and ' + str(codemax))
+
+
+def pack10(codes):
+    """Return 10-bit codes packed four to every five bytes.
+
+    The code count is padded up to a multiple of four with zeros.  Use
+    unpack10 with the original count to get the codes back.
+
+    Arguments:
+      codes -- Array-like of integer codes (0 to 1023)
+    """
+    codes = numpy.asarray(codes).ravel()
+    check_codes(codes)
+    padded = numpy.zeros(-(-codes.size // 4) * 4, dtype=numpy.uint64)
+    padded[:codes.size] = codes
+    quads = padded.reshape(-1, 4)
+    # Each group of four codes becomes one 40-bit word
+    words = ((quads[:, 0] << numpy.uint64(30)) |
+             (quads[:, 1] << numpy.uint64(20)) |
+             (quads[:, 2] << numpy.uint64(10)) |
+             quads[:, 3])
+    shifts = numpy.array([32, 24, 16, 8, 0], dtype=numpy.uint64)
+    packed = (words[:, numpy.newaxis] >> shifts) & numpy.uint64(0xff)
+    return packed.astype(numpy.uint8).ravel()
+
+
+def unpack10(packed, count):
+    """Return the uint16 codes from an array packed by pack10.
+
+    Arguments:
+      packed -- uint8 array (or byte string) from pack10
+      count -- Number of codes that were packed
+    """
+    if not isinstance(packed, numpy.ndarray):
+        packed = numpy.frombuffer(packed, dtype=numpy.uint8)
+    quints = packed.reshape(-1, 5).astype(numpy.uint64)
+    words = ((quints[:, 0] << numpy.uint64(32)) |
+             (quints[:, 1] << numpy.uint64(24)) |
+             (quints[:, 2] << numpy.uint64(16)) |
+             (quints[:, 3] << numpy.uint64(8)) |
+             quints[:, 4])
+    shifts = numpy.array([30, 20, 10, 0], dtype=numpy.uint64)
+    codes = (words[:, numpy.newaxis] >> shifts) & numpy.uint64(codemax)
+    return codes.astype(numpy.uint16).ravel()[:count]
+
+
+def delta_encode(codes):
+    """Return zigzag-mapped sample-to-sample differences.
+
+    Differences are taken along the last axis, with the first sample
+    of every trace referenced to codecenter.  They are wrapped modulo
+    1024 and zigzag mapped (0, -1, 1, -2, ... become 0, 1, 2, 3, ...),
+    so small changes in either direction give small 10-bit values.
+
+    Raises ValueError for codes that aren't integers from 0 to 1023,
+    or a single code without a time axis.
+
+    Arguments:
+      codes -- Integer array of codes.  The last axis is time.
+    """
+    codes = numpy.asarray(codes)
+    if codes.ndim < 1:
+        raise ValueError('Delta encoding needs at least one dimension')
+    check_codes(codes)
+    codes = codes.astype(numpy.int32)
+    previous = numpy.empty_like(codes)
+    previous[..., 0] = codecenter
+    previous[..., 1:] = codes[..., :-1]
+    # Wrap into [-512, 511]
+    deltas = (codes - previous + 512) % 1024 - 512
+    zigzag = numpy.where(deltas >= 0, 2 * deltas, -2 * deltas - 1)
+    return zigzag.astype(numpy.uint16)
+
+
+def delta_decode(zigzag):
+    """Return the codes from an array made by delta_encode.
+
+    Arguments:
+      zigzag -- Integer array from delta_encode
+    """
+    zigzag = numpy.asarray(zigzag).astype(numpy.int32)
+    deltas = numpy.where(zigzag % 2 == 0, zigzag // 2, -(zigzag + 1) // 2)
+    codes = (codecenter + numpy.cumsum(deltas, axis=-1)) % 1024
+    return codes.astype(numpy.uint16)
+
+
+def split_planes(values):
+    """Return 10-bit values as a byte-aligned plane layout.
+
+    The low eight bits of every value come first, followed by the high
+    two bits packed four values to a byte.  This is the same size as
+    pack10, but keeps the low bytes aligned so compressors see the
+    repetition in slowly varying data.
+
+    Arguments:
+      values -- Flat integer array of 10-bit values
+    """
+    values = numpy.asarray(values).ravel().astype(numpy.uint16)
+    lowplane = (values & 0xff).astype(numpy.uint8)
+    highbits = numpy.zeros(-(-values.size // 4) * 4, dtype=numpy.uint8)
+    highbits[:values.size] = values >> 8
+    quads = highbits.reshape(-1, 4)
+    highplane = ((quads[:, 0] << 6) | (quads[:, 1] << 4) |
+                 (quads[:, 2] << 2) | quads[:, 3]).astype(numpy.uint8)
+    return numpy.concatenate((lowplane, highplane))
+
+
+def join_planes(planes, count):
+    """Return the 10-bit values from an array made by split_planes.
+
+    Arguments:
+      planes -- uint8 array from split_planes
+      count -- Number of values
+    """
+    lowplane = planes[:count].astype(numpy.uint16)
+    highplane = planes[count:]
+    shifts = numpy.array([6, 4, 2, 0], dtype=numpy.uint8)
+    highbits = ((highplane[:, numpy.newaxis] >> shifts) & 0x3).ravel()
+    return lowplane | (highbits[:count].astype(numpy.uint16) << 8)
+
+
+def encode(codes, delta=False, compression=None, level=6):
+    """Return raw ADC codes encoded as a byte string.
+
+    Raises ValueError if the codes aren't integers from 0 to 1023.
+
+    Arguments:
+      codes -- Integer array of codes (0 to 1023) of any shape.  A
+               single capture is 2 x 1024, and a block of captures is
+               N x 2 x 1024.
+      delta -- Delta encode along the last (time) axis before packing
+      compression -- None, 'zlib' or 'lzma'
+      level -- Compression level (0-9)
+    """
+    if not compression in compressors:
+        raise ValueError('Unknown compression ' + str(compression))
+    if compression == 'lzma' and lzma is None:
+        raise ValueError('lzma compression needs the lzma module')
+    codes = numpy.asarray(codes)
+    # Delta encoding wraps modulo 1024, so it would hide bad codes
+    check_codes(codes)
+    flags = 0
+    if delta:
+        flags |= delta_flag
+    if codes.size == 0:
+        payload = b''
+    elif delta:
+        payload = split_planes(delta_encode(codes)).tostring()
+    else:
+        payload = pack10(codes).tostring()
+    if compression == 'zlib':
+        payload = zlib.compress(payload, level)
+    elif compression == 'lzma':
+        payload = lzma.compress(payload, preset=level)
+    header = struct.pack(header_format, magic, codec_version, flags,
+                         compressors[compression], codes.ndim)
+    header += struct.pack('<' + 'I' * codes.ndim, *codes.shape)
+    return header + payload
+
+
+def decode(blob):
+    """Return the uint16 code array from a byte string made by encode.
+
+    Arguments:
+      blob -- Encoded byte string
+    """
+    headsize = struct.calcsize(header_format)
+    (blobmagic, version, flags, compressor, ndim) = struct.unpack(
+        header_format, blob[:headsize]
+    )
+    if blobmagic != magic or version != codec_version:
+        raise ValueError('Not a version ' + str(codec_version) +
+                         ' packed sample blob')
+    dimsize = struct.calcsize('<' + 'I' * ndim)
+    shape = struct.unpack('<' + 'I' * ndim, blob[headsize:headsize + dimsize])
+    payload = blob[headsize + dimsize:]
+    if compressor == compressors['zlib']:
+        payload = zlib.decompress(payload)
+    elif compressor == compressors['lzma']:
+        if lzma is None:
+            raise ValueError('lzma decompression needs the lzma module')
+        payload = lzma.decompress(payload)
+    count = int(numpy.prod(shape))
+    if count == 0:
+        return numpy.zeros(shape, dtype=numpy.uint16)
+    packed = numpy.frombuffer(payload, dtype=numpy.uint8)
+    if flags & delta_flag:
+        codes = delta_decode(join_planes(packed, count).reshape(shape))
+    else:
+        codes = unpack10(packed, count).reshape(shape)
+    return codes
+
+
+def write_block(fout, codes, delta=True, compression='zlib', level=6):
+    """Encode a block of codes and append it to a file.
+
+    The blob is preceded by its length, so read_blocks() can find the
+    blocks again.
+
+    Arguments:
+      fout -- File object opened for binary writing
+      codes -- Integer array of codes (see encode)
+      delta -- Delta encode along the last (time) axis before packing
+      compression -- None, 'zlib' or 'lzma'
+      level -- Compression level (0-9)
+    """
+    blob = encode(codes, delta, compression, level)
+    fout.write(struct.pack('<I', len(blob)))
+    fout.write(blob)
+
+
+def read_blocks(fin):
+    """Yield the code arrays stored in a file by write_block().
+
+    Raises ValueError if the file ends partway through a block.
+
+    Arguments:
+      fin -- File object opened for binary reading
+    """
+    while True:
+        lengthbytes = fin.read(4)
+        if not lengthbytes:
+            return
+        if len(lengthbytes) < 4:
+            raise ValueError('Packed file ends inside a block length')
+        length = struct.unpack('<I', lengthbytes)[0]
+        blob = fin.read(length)
+        if len(blob) < length:
+            raise ValueError('Packed file ends inside a block')
+        yield decode(blob)
@@ -0,0 +1,458 @@
+# fitting.py
+#
+# Equivalent circuit fitting for impedance sweeps
+#
+# Each model gives its complex impedance and the impedance's derivative
+# with respect to every parameter, as functions of the angular
+# frequency.  Both are vectorized over the sweep's frequencies.
+#
+# Fits minimize the impedance error relative to the measured magnitude,
+#
+#   r = (Z_model - Z_measured) / |Z_measured|
+#
+# with the real and imaginary parts stacked into one residual vector,
+# so every point counts the same from milliohms to megohms.  The
+# parameters are fitted as their logarithms, which keeps them positive
+# and makes parameters of very different sizes equally easy to move.
+# The Levenberg-Marquardt iteration uses the analytic Jacobians.
+#
+# fit_batch() fits many sweeps with a pool of processes.
+
+import collections # For ordered parameter lists
+import logging  # The python logging module
+import multiprocessing # For batch fits
+
+import numpy
+
+# create logger
+module_logger = logging.getLogger('root.fitting')
+module_logger.setLevel(logging.DEBUG)
+
+# Global variables
+max_iterations = 200 # Levenberg-Marquardt iterations per fit
+tolerance = 1e-10 # Stop when the cost improves by less than this fraction
+max_damping = 1e12 # Give up when the damping has to grow past this
+
+
+class Model(object):
+    """An equivalent circuit.
+
+    Arguments:
+      name -- Model name
+      description -- Circuit description
+      parameters -- List of parameter names
+      impedance -- Called with (parameter array, angular frequencies).
+                   Returns the complex impedance at each frequency.
+      jacobian -- Called like impedance.  Returns a frequencies x
+                  parameters array of complex derivatives.
+      guess -- Called with (angular frequencies, complex impedances).
+               Returns a starting parameter array.
+    """
+    def __init__(self, name, description, parameters, impedance, jacobian,
+                 guess):
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+        self.impedance = impedance
+        self.jacobian = jacobian
+        self.guess = guess
+
+
+def get_positive(values, default=1.0):
+    """Return the median of the positive finite values, or default
+
+    Arguments:
+      values -- numpy array
+    """
+    values = values[numpy.isfinite(values) & (values > 0)]
+    if len(values) == 0:
+        return default
+    return float(numpy.median(values))
+
+
+# ------------------------------ Models --------------------------------
+
+def series_rc_impedance(params, omega):
+    """Return the impedance of R in series with C"""
+    (resistance, capacitance) = params
+    return resistance + 1 / (1j * omega * capacitance)
+
+def series_rc_jacobian(params, omega):
+    """Return dZ/d[R, C] for R in series with C"""
+    (resistance, capacitance) = params
+    return numpy.column_stack([
+        numpy.ones(len(omega), dtype=complex),
+        -1 / (1j * omega * capacitance**2)])
+
+def series_rc_guess(omega, z):
+    """Return starting [R, C] values for R in series with C"""
+    return numpy.array([get_positive(z.real),
+                        get_positive(-1 / (omega * z.imag), 1e-6)])
+
+
+def parallel_rc_impedance(params, omega):
+    """Return the impedance of R in parallel with C"""
+    (resistance, capacitance) = params
+    return 1 / (1 / resistance + 1j * omega * capacitance)
+
+def parallel_rc_jacobian(params, omega):
+    """Return dZ/d[R, C] for R in parallel with C"""
+    (resistance, capacitance) = params
+    z = parallel_rc_impedance(params, omega)
+    # dZ/dp = -Z**2 dY/dp
+    return -z[:, numpy.newaxis]**2 * numpy.column_stack([
+        -numpy.ones(len(omega)) / resistance**2,
+        1j * omega])
+
+def parallel_rc_guess(omega, z):
+    """Return starting [R, C] values for R in parallel with C"""
+    admittance = 1 / z
+    return numpy.array([get_positive(1 / admittance.real),
+                        get_positive(admittance.imag / omega, 1e-6)])
+
+
+def series_rl_impedance(params, omega):
+    """Return the impedance of R in series with L"""
+    (resistance, inductance) = params
+    return resistance + 1j * omega * inductance
+
+def series_rl_jacobian(params, omega):
+    """Return dZ/d[R, L] for R in series with L"""
+    return numpy.column_stack([
+        numpy.ones(len(omega), dtype=complex),
+        1j * omega])
+
+def series_rl_guess(omega, z):
+    """Return starting [R, L] values for R in series with L"""
+    return numpy.array([get_positive(z.real),
+                        get_positive(z.imag / omega, 1e-3)])
+
+
+def parallel_rl_impedance(params, omega):
+    """Return the impedance of R in parallel with L"""
+    (resistance, inductance) = params
+    return 1 / (1 / resistance + 1 / (1j * omega * inductance))
+
+def parallel_rl_jacobian(params, omega):
+    """Return dZ/d[R, L] for R in parallel with L"""
+    (resistance, inductance) = params
+    z = parallel_rl_impedance(params, omega)
+    return -z[:, numpy.newaxis]**2 * numpy.column_stack([
+        -numpy.ones(len(omega)) / resistance**2,
+        -1 / (1j * omega * inductance**2)])
+
+def parallel_rl_guess(omega, z):
+    """Return starting [R, L] values for R in parallel with L"""
+    admittance = 1 / z
+    return numpy.array([get_positive(1 / admittance.real),
+                        get_positive(-1 / (omega * admittance.imag), 1e-3)])
+
+
+def series_rlc_impedance(params, omega):
+    """Return the impedance of R, L and C in series"""
+    (resistance, inductance, capacitance) = params
+    return (resistance + 1j * omega * inductance +
+            1 / (1j * omega * capacitance))
+
+def series_rlc_jacobian(params, omega):
+    """Return dZ/d[R, L, C] for R, L and C in series"""
+    (resistance, inductance, capacitance) = params
+    return numpy.column_stack([
+        numpy.ones(len(omega), dtype=complex),
+        1j * omega,
+        -1 / (1j * omega * capacitance**2)])
+
+def series_rlc_guess(omega, z):
+    """Return starting [R, L, C] values for R, L and C in series"""
+    # The capacitor dominates the reactance at the lowest frequency,
+    # the inductor at the highest
+    low = numpy.argmin(omega)
+    high = numpy.argmax(omega)
+    return numpy.array([
+        get_positive(z.real),
+        get_positive(numpy.array([z[high].imag / omega[high]]), 1e-3),
+        get_positive(numpy.array([-1 / (omega[low] * z[low].imag)]), 1e-6)])
+
+
+def parallel_rlc_impedance(params, omega):
+    """Return the impedance of R, L and C in parallel"""
+    (resistance, inductance, capacitance) = params
+    return 1 / (1 / resistance + 1j * omega * capacitance +
+                1 / (1j * omega * inductance))
+
+def parallel_rlc_jacobian(params, omega):
+    """Return dZ/d[R, L, C] for R, L and C in parallel"""
+    (resistance, inductance, capacitance) = params
+    z = parallel_rlc_impedance(params, omega)
+    return -z[:, numpy.newaxis]**2 * numpy.column_stack([
+        -numpy.ones(len(omega)) / resistance**2,
+        -1 / (1j * omega * inductance**2),
+        1j * omega])
+
+def parallel_rlc_guess(omega, z):
+    """Return starting [R, L, C] values for R, L and C in parallel"""
+    admittance = 1 / z
+    # The inductor dominates the susceptance at the lowest frequency,
+    # the capacitor at the highest
+    low = numpy.argmin(omega)
+    high = numpy.argmax(omega)
+    return numpy.array([
+        get_positive(1 / admittance.real),
+        get_positive(numpy.array([-1 / (omega[low] * admittance[low].imag)]),
+                     1e-3),
+        get_positive(numpy.array([admittance[high].imag / omega[high]]),
+                     1e-6)])
+
+
+def r_cpe_impedance(params, omega):
+    """Return the impedance of R in series with a constant phase element"""
+    (resistance, q, n) = params
+    return resistance + 1 / (q * (1j * omega)**n)
+
+def r_cpe_jacobian(params, omega):
+    """Return dZ/d[R, Q, n] for R in series with a CPE"""
+    (resistance, q, n) = params
+    cpe = 1 / (q * (1j * omega)**n)
+    return numpy.column_stack([
+        numpy.ones(len(omega), dtype=complex),
+        -cpe / q,
+        -cpe * numpy.log(1j * omega)])
+
+def r_cpe_guess(omega, z):
+    """Return starting [R, Q, n] values for R in series with a CPE"""
+    return numpy.array([get_positive(z.real),
+                        get_positive(-1 / (omega * z.imag), 1e-6), 0.9])
+
+
+def randles_impedance(params, omega):
+    """Return the impedance of a Randles cell"""
+    (rs, rct, cdl, sigma) = params
+    faradaic = rct + sigma * (1 - 1j) / numpy.sqrt(omega)
+    return rs + 1 / (1j * omega * cdl + 1 / faradaic)
+
+def randles_jacobian(params, omega):
+    """Return dZ/d[Rs, Rct, Cdl, sigma] for a Randles cell"""
+    (rs, rct, cdl, sigma) = params
+    warburg = (1 - 1j) / numpy.sqrt(omega)
+    faradaic = rct + sigma * warburg
+    parallel = 1 / (1j * omega * cdl + 1 / faradaic)
+    # Derivatives of the parallel part through its admittance
+    through_faradaic = parallel**2 / faradaic**2
+    return numpy.column_stack([
+        numpy.ones(len(omega), dtype=complex),
+        through_faradaic,
+        -parallel**2 * 1j * omega,
+        through_faradaic * warburg])
+
+def randles_guess(omega, z):
+    """Return starting [Rs, Rct, Cdl, sigma] values for a Randles cell"""
+    high = numpy.argmax(omega)
+    rs = get_positive(numpy.array([z[high].real]), 1.0)
+    rct = get_positive(numpy.array([z.real.max() - rs]), rs)
+    # The semicircle's peak is at omega = 1 / (Rct Cdl)
+    peak = numpy.argmin(z.imag)
+    cdl = 1 / (omega[peak] * rct)
+    return numpy.array([rs, rct, cdl, rct * numpy.sqrt(omega.min()) * 1e-2])
+
+
+"""Specify the available models.
+
+This dictionary is where the model names used on the command line are
+defined.  If you add a model, register it here.
+
+"""
+models = collections.OrderedDict((model.name, model) for model in [
+    Model('series_rc', 'R in series with C', ['R', 'C'],
+          series_rc_impedance, series_rc_jacobian, series_rc_guess),
+    Model('parallel_rc', 'R in parallel with C', ['R', 'C'],
+          parallel_rc_impedance, parallel_rc_jacobian, parallel_rc_guess),
+    Model('series_rl', 'R in series with L', ['R', 'L'],
+          series_rl_impedance, series_rl_jacobian, series_rl_guess),
+    Model('parallel_rl', 'R in parallel with L', ['R', 'L'],
+          parallel_rl_impedance, parallel_rl_jacobian, parallel_rl_guess),
+    Model('series_rlc', 'R, L and C in series', ['R', 'L', 'C'],
+          series_rlc_impedance, series_rlc_jacobian, series_rlc_guess),
+    Model('parallel_rlc', 'R, L and C in parallel', ['R', 'L', 'C'],
+          parallel_rlc_impedance, parallel_rlc_jacobian,
+          parallel_rlc_guess),
+    Model('r_cpe', 'R in series with a constant phase element ' +
+          '1/(Q (jw)^n)', ['R', 'Q', 'n'],
+          r_cpe_impedance, r_cpe_jacobian, r_cpe_guess),
+    Model('randles', 'Rs in series with Cdl parallel to Rct and a ' +
+          'Warburg element sigma (1-j)/sqrt(w)', ['Rs', 'Rct', 'Cdl', 'sigma'],
+          randles_impedance, randles_jacobian, randles_guess)
+])
+
+# ----------------------------- Fitting --------------------------------
+
+def get_residuals(model, logparams, omega, measured, scale):
+    """Return (residual vector, Jacobian) for log parameters
+
+    Arguments:
+      model -- Model object
+      logparams -- Logarithms of the parameters
+      omega -- Angular frequencies
+      measured -- Complex measured impedances
+      scale -- Magnitude each point's error is divided by
+    """
+    params = numpy.exp(logparams)
+    error = (model.impedance(params, omega) - measured) / scale
+    # d/d(log p) = p d/dp
+    jacobian = (model.jacobian(params, omega) * params /
+                scale[:, numpy.newaxis])
+    return (numpy.concatenate([error.real, error.imag]),
+            numpy.concatenate([jacobian.real, jacobian.imag]))
+
+
+def fit(name, frequencies, impedances, initial=None):
+    """Fit a model to an impedance sweep.
+
+    Returns a dictionary of:
+      model -- Model name
+      parameters -- Ordered dictionary of (parameter name) : value
+      errors -- Ordered dictionary of (parameter name) : relative
+                standard error, or nan if it can't be estimated
+      rms -- Rms error of the fit relative to |Z|
+      aic -- Akaike information criterion, for comparing models
+      iterations -- Levenberg-Marquardt iterations
+      converged -- False if the fit stopped before converging
+
+    Arguments:
+      name -- Model name (a key of models)
+      frequencies -- Frequencies (Hz)
+      impedances -- Complex impedances, or [real, imaginary] lists
+      initial -- Starting parameter values, or None to guess them
+    """
+    if not name in models:
+        raise ValueError('Unknown model ' + str(name))
+    model = models[name]
+    omega = 2 * numpy.pi * numpy.asarray(frequencies, dtype=float)
+    if len(omega) < len(model.parameters):
+        raise ValueError('Fitting ' + name + ' needs at least ' +
+                         str(len(model.parameters)) + ' points')
+    measured = numpy.asarray(impedances)
+    if not numpy.iscomplexobj(measured):
+        measured = measured[:, 0] + 1j * measured[:, 1]
+    scale = numpy.maximum(numpy.abs(measured), numpy.finfo(float).tiny)
+    if initial is None:
+        initial = model.guess(omega, measured)
+    logparams = numpy.log(numpy.abs(numpy.asarray(initial, dtype=float)))
+    # Trial steps can overflow.  They just fail to lower the cost.
+    with numpy.errstate(all='ignore'):
+        (residuals, jacobian) = get_residuals(model, logparams, omega,
+                                              measured, scale)
+        cost = numpy.dot(residuals, residuals)
+        damping = 1e-3
+        converged = False
+        for iteration in range(1, max_iterations + 1):
+            normal = numpy.dot(jacobian.T, jacobian)
+            gradient = numpy.dot(jacobian.T, residuals)
+            improved = False
+            while damping < max_damping:
+                damped = normal + damping * numpy.diag(numpy.diag(normal) +
+                                                       1e-12)
+                try:
+                    step = numpy.linalg.solve(damped, -gradient)
+                except numpy.linalg.LinAlgError:
+                    damping *= 10
+                    continue
+                trial = logparams + step
+                (trialres, trialjac) = get_residuals(model, trial, omega,
+                                                     measured, scale)
+                trialcost = numpy.dot(trialres, trialres)
+                if numpy.isfinite(trialcost) and trialcost <= cost:
+                    improved = True
+                    break
+                damping *= 10
+            if not improved:
+                # No step downhill, so this is as good as it gets
+                converged = True
+                break
+            change = cost - trialcost
+            (logparams, residuals, jacobian, cost) = (trial, trialres,
+                                                      trialjac, trialcost)
+            damping = max(damping / 10, 1e-12)
+            if (change <= tolerance * cost or cost < 1e-30 or
+                numpy.max(numpy.abs(step)) < 1e-12):
+                converged = True
+                break
+        points = len(residuals)
+        dof = max(points - len(model.parameters), 1)
+        try:
+            # Errors of the log parameters are relative errors
+            covariance = (numpy.linalg.inv(numpy.dot(jacobian.T, jacobian)) *
+                          cost / dof)
+            errors = numpy.sqrt(numpy.abs(numpy.diag(covariance)))
+        except numpy.linalg.LinAlgError:
+            errors = numpy.nan * numpy.ones(len(model.parameters))
+        params = numpy.exp(logparams)
+    if not converged:
+        module_logger.warning('The %s fit did not converge in %d iterations',
+                              name, max_iterations)
+    return {'model': name,
+            'parameters': collections.OrderedDict(
+                zip(model.parameters, [float(value) for value in params])),
+            'errors': collections.OrderedDict(
+                zip(model.parameters, [float(value) for value in errors])),
+            'rms': float(numpy.sqrt(cost / points)),
+            'aic': float(points * numpy.log(max(cost / points,
+                                                numpy.finfo(float).tiny)) +
+                         2 * len(model.parameters)),
+            'iterations': iteration,
+            'converged': converged}
+
+
+def fit_best(frequencies, impedances, names=None):
+    """Fit several models and return the fit with the lowest AIC
+
+    Arguments:
+      frequencies -- Frequencies (Hz)
+      impedances -- Complex impedances, or [real, imaginary] lists
+      names -- Model names to try, or None for all of them
+    """
+    if names is None:
+        names = list(models)
+    fits = [fit(name, frequencies, impedances) for name in names
+            if len(frequencies) >= len(models[name].parameters)]
+    if not fits:
+        raise ValueError('Not enough points to fit any model')
+    return min(fits, key=lambda result: result['aic'])
+
+
+def fit_job(job):
+    """Fit one (model name, frequencies, impedances) job for fit_batch
+
+    The model name 'best' uses fit_best.  Returns the fit dictionary,
+    or {'model', 'error'} if the fit failed.
+
+    Arguments:
+      job -- (model name, frequencies, impedances) tuple
+    """
+    (name, frequencies, impedances) = job
+    try:
+        if name == 'best':
+            return fit_best(frequencies, impedances)
+        return fit(name, frequencies, impedances)
+    except (ValueError, FloatingPointError) as ex:
+        return {'model': name, 'error': str(ex)}
+
+
+def fit_batch(jobs, processes=None, chunksize=16):
+    """Fit many sweeps, using a pool of processes.
+
+    Returns the fit_job() results in the order of the jobs.
+
+    Arguments:
+      jobs -- List of (model name, frequencies, impedances) tuples
+      processes -- Worker processes.  None uses one per CPU, and 1 fits
+                   in this process.
+      chunksize -- Jobs sent to a worker at a time
+    """
+    if processes == 1 or len(jobs) < 2:
+        return [fit_job(job) for job in jobs]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(fit_job, jobs, chunksize)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,179 @@
+# fixture.py
+#
+# Open/short/load compensation for impedance fixtures
+#
+# The leads and fixture between the CGR-101 and the impedance under
+# test add their own series impedance and shunt admittance.  Measuring
+# three standards in the fixture characterizes them:
+#
+#   open -- Nothing connected (Zo measured)
+#   short -- A short across the terminals (Zs measured)
+#   load -- A known impedance Zl (Zlm measured)
+#
+# A measured impedance Zm is then corrected with
+#
+#   Z = Zl (Zo - Zlm)(Zm - Zs) / ((Zlm - Zs)(Zo - Zm))
+#
+# Without a load measurement the load factor Zl (Zo - Zlm) / (Zlm - Zs)
+# is replaced by Zo - Zs, which is open/short compensation.  Without an
+# open measurement Zo is taken as infinite, which leaves Z = Zm - Zs
+# for a short alone.
+#
+# Each standard is measured by a cgr-imp sweep (cgr-imp --fixture-cal
+# open|short|load), so it has its own list of frequencies.  Standards
+# are interpolated to the measured frequencies, linearly in log
+# frequency, and held at their end values outside the range they were
+# measured over.
+#
+# A fixture's table is saved in Python's pickle format, one file per
+# fixture.  Tables are cached after they're read, and only read again
+# when the file changes.
+
+from datetime import datetime # For dating standards
+import logging  # The python logging module
+import os # For file modification times
+import pickle # For writing and reading fixture tables
+import threading # Tables can be read outside the main thread
+
+import numpy
+
+# create logger
+module_logger = logging.getLogger('root.fixture')
+module_logger.setLevel(logging.DEBUG)
+
+# Global variables
+standards = ['open', 'short', 'load']
+
+table_cache = {} # {filename : (modification time, table)}
+cache_lock = threading.Lock()
+
+
+def new_table():
+    """Return a fixture table with no standards measured
+
+    The table is a dictionary with an entry for each standard, None
+    until it's measured.  A measured standard is a dictionary of:
+      frequencies -- Sorted frequencies (Hz)
+      impedances -- Complex impedance measured at each frequency
+      date -- When it was measured (string)
+    The load standard also has:
+      standard -- The load's known complex impedance (Ohms)
+    """
+    return dict((name, None) for name in standards)
+
+
+def load_table(filename):
+    """Return the fixture table in a file, or None if there isn't one
+
+    Arguments:
+      filename -- Fixture table file name
+    """
+    try:
+        mtime = os.path.getmtime(filename)
+    except OSError:
+        return None
+    with cache_lock:
+        cached = table_cache.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    module_logger.info('Loading fixture compensation from %s', filename)
+    with open(filename, 'rb') as fin:
+        table = pickle.load(fin)
+    for name in standards:
+        table.setdefault(name, None)
+    with cache_lock:
+        table_cache[filename] = (mtime, table)
+    return table
+
+
+def save_table(filename, table):
+    """Write a fixture table
+
+    Arguments:
+      filename -- Fixture table file name
+      table -- Table from new_table() or load_table()
+    """
+    module_logger.info('Writing fixture compensation to %s', filename)
+    with open(filename, 'wb') as fout:
+        pickle.dump(table, fout)
+    with cache_lock:
+        table_cache.pop(filename, None)
+
+
+def set_standard(table, name, frequencies, impedances, standard=None):
+    """Store a standard's measurement in a table
+
+    Arguments:
+      table -- Table from new_table() or load_table()
+      name -- 'open', 'short' or 'load'
+      frequencies -- Measured frequencies (Hz), in any order
+      impedances -- Complex impedances, or [real, imaginary] lists
+      standard -- Known complex impedance of the load standard (Ohms)
+    """
+    if name not in standards:
+        raise ValueError('Unknown fixture standard ' + str(name))
+    if name == 'load' and standard is None:
+        raise ValueError('The load standard needs its known impedance')
+    impedances = [complex(z[0], z[1]) if not isinstance(z, complex) else z
+                  for z in impedances]
+    order = numpy.argsort(frequencies)
+    entry = {'frequencies': numpy.asarray(frequencies, dtype=float)[order],
+             'impedances': numpy.asarray(impedances, dtype=complex)[order],
+             'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    if name == 'load':
+        entry['standard'] = complex(standard)
+    table[name] = entry
+
+
+def get_description(table):
+    """Return a string saying which standards are in a table and when
+    they were measured
+
+    Arguments:
+      table -- Table from new_table() or load_table()
+    """
+    measured = [name + ' ' + table[name]['date'] for name in standards
+                if table[name] is not None]
+    return ', '.join(measured) or 'none'
+
+
+def interpolate(entry, frequencies):
+    """Return a standard's impedances at some frequencies
+
+    Arguments:
+      entry -- A measured standard from a table
+      frequencies -- Numpy array of frequencies (Hz)
+    """
+    logfreqs = numpy.log(entry['frequencies'])
+    points = numpy.log(frequencies)
+    impedances = entry['impedances']
+    return (numpy.interp(points, logfreqs, impedances.real) +
+            1j * numpy.interp(points, logfreqs, impedances.imag))
+
+
+def correct(table, frequencies, impedances):
+    """Return compensated impedances
+
+    Returns a complex numpy array shaped like frequencies.
+
+    Arguments:
+      table -- Table from new_table() or load_table()
+      frequencies -- Frequency (Hz) or numpy array of them
+      impedances -- Complex measured impedance at each frequency
+    """
+    frequencies = numpy.asarray(frequencies, dtype=float)
+    measured = numpy.asarray(impedances, dtype=complex)
+    if table['short'] is None:
+        zshort = numpy.zeros(frequencies.shape, dtype=complex)
+    else:
+        zshort = interpolate(table['short'], frequencies)
+    if table['open'] is None:
+        return measured - zshort
+    zopen = interpolate(table['open'], frequencies)
+    if table['load'] is None:
+        factor = zopen - zshort
+    else:
+        zload = interpolate(table['load'], frequencies)
+        factor = (table['load']['standard'] * (zopen - zload) /
+                  (zload - zshort))
+    return factor * (measured - zshort) / (zopen - measured)
@@ -0,0 +1,146 @@
+# gplot.py
+#
+# A persistent gnuplot process fed with binary data
+#
+# gnuplot-py writes every data set to a text temporary file that
+# gnuplot then has to parse.  GnuplotPipe instead keeps one gnuplot
+# process open and sends data inline, as raw little-endian doubles,
+# over its stdin pipe.  The plot command for a set of traces is built
+# once and reused, so redrawing a frame is one short command followed
+# by one binary block.
+
+import logging  # The python logging module
+import subprocess # For running gnuplot
+
+import numpy
+
+# create logger
+module_logger = logging.getLogger('root.gplot')
+module_logger.setLevel(logging.DEBUG)
+
+# Global variables
+gnuplot_command = 'gnuplot' # The gnuplot executable
+default_term = 'x11' # The display terminal
+
+
+def get_plot_command(points, titles, style='lines'):
+    """Return a plot command reading binary x,y traces from stdin.
+
+    Each trace is read as a record of points (x, y) pairs of
+    little-endian float64 values.
+
+    Arguments:
+      points -- Number of points in each trace
+      titles -- List of trace titles
+      style -- gnuplot plotting style for every trace
+    """
+    items = []
+    for title in titles:
+        items.append("'-' binary record=" + str(points) +
+                     " format='%float64%float64' endian=little" +
+                     " using 1:2 title '" + title.replace("'", "''") +
+                     "' with " + style)
+    return 'plot ' + ', '.join(items)
+
+
+def get_plot_data(xdata, ydata_list):
+    """Return the binary block for a list of traces sharing x values
+
+    Arguments:
+      xdata -- List of x values
+      ydata_list -- List of y value lists, one per trace
+    """
+    xarray = numpy.asarray(xdata, dtype='<f8')
+    blocks = []
+    for ydata in ydata_list:
+        pairs = numpy.empty((len(xarray), 2), dtype='<f8')
+        pairs[:, 0] = xarray
+        pairs[:, 1] = ydata
+        blocks.append(pairs.tostring())
+    return ''.encode('ascii').join(blocks)
+
+
+class GnuplotPipe(object):
+    """A gnuplot process driven through its stdin pipe.
+
+    Instances can be called with a gnuplot command, like gnuplot-py's
+    Gnuplot objects.  'replot' resends the last plot and its data,
+    since gnuplot can't re-read inline data by itself.
+
+    Arguments:
+      debug -- Set to 1 to log every command sent to gnuplot
+    """
+    def __init__(self, debug=0):
+        self.debug = debug
+        try:
+            self.process = subprocess.Popen([gnuplot_command],
+                                            stdin=subprocess.PIPE)
+        except OSError:
+            module_logger.error('Could not start ' + gnuplot_command)
+            raise
+        self.plotkey = None # (points, titles, style) of the cached command
+        self.plotcmd = None # The cached plot command
+        self.plotdata = None # Binary data for the last plot
+
+    def write(self, data):
+        """Write a command or data block to gnuplot's stdin
+
+        Arguments:
+          data -- String to write
+        """
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+
+    def __call__(self, cmd):
+        """Send a gnuplot command.
+
+        Arguments:
+          cmd -- Command string without a trailing newline
+        """
+        if cmd.strip() == 'replot' and self.plotcmd is not None:
+            self.replot()
+            return
+        if self.debug:
+            module_logger.debug('gnuplot> ' + cmd)
+        self.write(cmd + '\n')
+
+    def xlabel(self, label):
+        """Set the x axis label"""
+        self('set xlabel "' + label + '"')
+
+    def ylabel(self, label):
+        """Set the y axis label"""
+        self('set ylabel "' + label + '"')
+
+    def plot_traces(self, xdata, ydata_list, titles, style='lines'):
+        """Plot one or more traces sharing the same x values.
+
+        Arguments:
+          xdata -- List of x values
+          ydata_list -- List of y value lists, one per trace
+          titles -- List of trace titles
+          style -- gnuplot plotting style for every trace
+        """
+        plotkey = (len(xdata), tuple(titles), style)
+        if plotkey != self.plotkey:
+            # Only rebuild the command when the traces change shape
+            self.plotkey = plotkey
+            self.plotcmd = get_plot_command(len(xdata), titles, style)
+            if self.debug:
+                module_logger.debug('gnuplot> ' + self.plotcmd)
+        self.plotdata = get_plot_data(xdata, ydata_list)
+        self.replot()
+
+    def replot(self):
+        """Draw the last plot again with its data."""
+        self.write(self.plotcmd + '\n')
+        self.write(self.plotdata)
+
+    def close(self):
+        """Quit gnuplot."""
+        try:
+            self.write('quit\n')
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.process.wait()
@@ -0,0 +1,39 @@
+# lazy.py
+#
+# Deferred imports for the cgrlib tools
+#
+# numpy, gnuplot and the modules that need them take a noticeable
+# time to import.  The tools only need them once they start working,
+# not to print --help or to be imported by another program.  A
+# LazyModule stands in for a module and imports it the first time one
+# of its attributes is used.
+
+import importlib # For importing modules by name
+
+
+class LazyModule(object):
+    """A module that is imported when it's first used.
+
+    Arguments:
+      name -- Full module name, like 'numpy' or 'cgrlib.archive'
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        """Import the module (once) and return it"""
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        if self._module is None:
+            return '<lazy module ' + repr(self._name) + ' (not loaded)>'
+        return repr(self._module)
@@ -0,0 +1,315 @@
+# lockin.py
+#
+# Lock-in (homodyne) demodulation for the cgrlib tools
+#
+# A capture is demodulated by multiplying it with a reference sine and
+# cosine at the lock-in frequency and averaging.  The reference for a
+# (frequency, sample rate, length) is stored as one complex phasor
+# array,
+#
+#   reference = sin(2 pi f t) + j cos(2 pi f t)
+#
+# so both channels' in-phase and quadrature parts come from a single
+# matrix product.  References are kept in a least-recently-used cache,
+# so averages and repeated sweeps at the same settings don't rebuild
+# them.
+#
+# analyze() demodulates a bank of frequencies at once: the drive
+# frequency, its harmonics, and bins halfway between the harmonics,
+# where there should be nothing but noise.  The noise bins give a
+# signal-to-noise ratio for every harmonic without another capture.
+#
+# Captures can also be averaged as phasors instead of traces: each
+# capture is demodulated, shifted with shift_phasors() so channel A's
+# fundamental has zero phase, and the phasors averaged.  The captures
+# then don't have to start at the same point of the waveform.
+# analyze_phasors() gives analyze()'s results from the averaged bank.
+
+import collections # For the reference cache
+import logging  # The python logging module
+import threading # Demodulation can run outside the main thread
+
+import numpy
+
+# create logger
+module_logger = logging.getLogger('root.lockin')
+module_logger.setLevel(logging.DEBUG)
+
+# Global variables
+cache_size = 64 # Arrays kept.  A 1024-point reference takes 16 kB.
+
+reference_cache = collections.OrderedDict() # {key : array}
+cache_lock = threading.Lock()
+cache_hits = 0
+cache_misses = 0
+
+
+def cache_get(key):
+    """Return a cached array and mark it recently used, or None
+
+    Arguments:
+      key -- Cache key
+    """
+    global cache_hits, cache_misses
+    with cache_lock:
+        value = reference_cache.pop(key, None)
+        if value is None:
+            cache_misses += 1
+            return None
+        # Move it to the most recently used end
+        reference_cache[key] = value
+        cache_hits += 1
+        return value
+
+
+def cache_put(key, value):
+    """Cache an array, dropping the least recently used ones if needed
+
+    Arguments:
+      key -- Cache key
+      value -- numpy array.  It's made read-only, since it's shared.
+    """
+    value.flags.writeable = False
+    with cache_lock:
+        reference_cache[key] = value
+        while len(reference_cache) > cache_size:
+            reference_cache.popitem(last=False)
+
+
+def get_reference(frequency, rate, length):
+    """Return the complex reference phasors sin(wt) + j cos(wt)
+
+    Arguments:
+      frequency -- Lock-in frequency in Hz
+      rate -- Sample rate in Hz
+      length -- Number of samples
+    """
+    key = (float(frequency), float(rate), int(length))
+    reference = cache_get(key)
+    if reference is None:
+        phase = 2 * numpy.pi * key[0] * (numpy.arange(key[2]) * (1.0/key[1]))
+        reference = numpy.sin(phase) + 1j * numpy.cos(phase)
+        cache_put(key, reference)
+    return reference
+
+
+def get_window(length):
+    """Return a 4-term Blackman-Harris window
+
+    Its sidelobes are below -92 dB, so a strong tone doesn't leak into
+    bins more than 4 bins (rate/length Hz each) away from it.
+
+    Arguments:
+      length -- Number of samples
+    """
+    key = ('window', int(length))
+    window = cache_get(key)
+    if window is None:
+        phase = 2 * numpy.pi * numpy.arange(length) / float(length)
+        window = (0.35875 - 0.48829 * numpy.cos(phase) +
+                  0.14128 * numpy.cos(2 * phase) -
+                  0.01168 * numpy.cos(3 * phase))
+        cache_put(key, window)
+    return window
+
+
+def get_bank(frequencies, rate, length):
+    """Return the windowed references for many frequencies
+
+    Returns a length x frequencies complex matrix.  Each column is a
+    reference from get_reference, multiplied by the window and scaled
+    so a tone exactly at the column's frequency gives the same phasor
+    demodulate() would.
+
+    Arguments:
+      frequencies -- List of frequencies in Hz
+      rate -- Sample rate in Hz
+      length -- Number of samples
+    """
+    key = ('bank', tuple(float(frequency) for frequency in frequencies),
+           float(rate), int(length))
+    bank = cache_get(key)
+    if bank is None:
+        window = get_window(length)
+        bank = numpy.empty((length, len(frequencies)), dtype=complex)
+        for (column, frequency) in enumerate(frequencies):
+            bank[:, column] = get_reference(frequency, rate, length)
+        bank *= (window / window.sum())[:, numpy.newaxis]
+        cache_put(key, bank)
+    return bank
+
+
+def clear_cache():
+    """Forget all cached references and the hit counts."""
+    global cache_hits, cache_misses
+    with cache_lock:
+        reference_cache.clear()
+        cache_hits = 0
+        cache_misses = 0
+
+
+def get_cache_info():
+    """Return {'hits', 'misses', 'size', 'maxsize'} for the cache"""
+    with cache_lock:
+        return {'hits': cache_hits, 'misses': cache_misses,
+                'size': len(reference_cache), 'maxsize': cache_size}
+
+
+def demodulate(frequency, rate, voltdata):
+    """Return the complex amplitude of every channel at one frequency
+
+    Each channel's mean is removed first.  For a channel carrying
+    A sin(2 pi f t + phi), the result is (A/2) exp(j phi): the real
+    part is the in-phase (sine) amplitude and the imaginary part the
+    quadrature (cosine) amplitude.
+
+    Arguments:
+      frequency -- Lock-in frequency in Hz
+      rate -- Sample rate in Hz
+      voltdata -- Channels x samples array or list of voltages
+    """
+    voltdata = numpy.asarray(voltdata, dtype=float)
+    length = voltdata.shape[-1]
+    reference = get_reference(frequency, rate, length)
+    centered = voltdata - voltdata.mean(axis=-1)[..., numpy.newaxis]
+    return numpy.dot(centered, reference) / length
+
+
+def reconstruct(frequency, rate, phasors, length, offsets=None):
+    """Return the sine waves described by complex amplitudes
+
+    This is the inverse of demodulate: a phasor (A/2) exp(j phi)
+    becomes A sin(2 pi f t + phi).
+
+    Arguments:
+      frequency -- Frequency in Hz
+      rate -- Sample rate in Hz
+      phasors -- Complex amplitude of every channel from demodulate
+      length -- Number of samples
+      offsets -- Mean to add back to every channel, or None
+    """
+    reference = get_reference(frequency, rate, length)
+    phasors = numpy.asarray(phasors)[..., numpy.newaxis]
+    waves = 2 * (reference.real * phasors.real +
+                 reference.imag * phasors.imag)
+    if offsets is not None:
+        waves += numpy.asarray(offsets, dtype=float)[..., numpy.newaxis]
+    return waves
+
+
+def demodulate_bins(frequencies, rate, voltdata):
+    """Return the windowed complex amplitude of every channel at many
+    frequencies
+
+    Returns a channels x frequencies complex array, with the same
+    scaling as demodulate().
+
+    Arguments:
+      frequencies -- List of frequencies in Hz
+      rate -- Sample rate in Hz
+      voltdata -- Channels x samples array or list of voltages
+    """
+    voltdata = numpy.asarray(voltdata, dtype=float)
+    bank = get_bank(frequencies, rate, voltdata.shape[-1])
+    centered = voltdata - voltdata.mean(axis=-1)[..., numpy.newaxis]
+    return numpy.dot(centered, bank)
+
+
+def get_bins(frequency, rate, harmonics):
+    """Return (harmonic frequencies, noise frequencies) below Nyquist
+
+    The harmonic frequencies are the fundamental and up to harmonics
+    multiples of it.  There's a noise frequency halfway between each
+    pair of harmonics, plus one halfway between DC and the
+    fundamental.
+
+    Arguments:
+      frequency -- Fundamental frequency in Hz
+      rate -- Sample rate in Hz
+      harmonics -- Number of harmonics above the fundamental
+    """
+    nyquist = rate / 2.0
+    tones = [frequency * number for number in range(1, harmonics + 2)
+             if frequency * number < nyquist]
+    noise = [frequency * (number + 0.5) for number in range(len(tones))
+             if frequency * (number + 0.5) < nyquist]
+    return (tones, noise)
+
+
+def shift_phasors(frequency, frequencies, phasors, phase):
+    """Return phasors for a capture shifted in time
+
+    The shift moves a tone at frequency by phase radians, and a tone
+    at any other frequency in proportion to that frequency.
+
+    Arguments:
+      frequency -- Frequency the shift is given for (Hz)
+      frequencies -- Frequency of every column of phasors (Hz)
+      phasors -- Channels x frequencies complex amplitudes
+      phase -- Phase shift at frequency (radians)
+    """
+    ratios = numpy.asarray(frequencies, dtype=float) / frequency
+    return numpy.asarray(phasors) * numpy.exp(1j * phase * ratios)
+
+
+def analyze(frequency, rate, voltdata, harmonics=3):
+    """Return the fundamental, harmonics and noise of every channel
+
+    The noise bins have to be at least 4 bins (rate/length Hz) away
+    from the tones to stay clear of their leakage.  That needs at
+    least 8 cycles of the fundamental in the capture.
+
+    Returns a dictionary:
+      frequencies -- Fundamental and harmonic frequencies (Hz)
+      phasors -- Channels x frequencies complex amplitudes
+      amplitudes -- Channels x frequencies peak amplitudes
+      phases -- Channels x frequencies phases in radians
+      noise -- Peak amplitude equivalent of the rms noise bin level
+               for every channel
+      snr -- Channels x frequencies signal-to-noise ratios in dB
+      thd -- Total harmonic distortion of every channel (harmonic
+             amplitudes relative to the fundamental)
+
+    Arguments:
+      frequency -- Fundamental frequency in Hz
+      rate -- Sample rate in Hz
+      voltdata -- Channels x samples array or list of voltages
+      harmonics -- Number of harmonics above the fundamental
+    """
+    (tones, noisebins) = get_bins(frequency, rate, harmonics)
+    phasors = demodulate_bins(tones + noisebins, rate, voltdata)
+    return analyze_phasors(frequency, rate, phasors, harmonics)
+
+
+def analyze_phasors(frequency, rate, phasors, harmonics=3):
+    """Return analyze()'s dictionary for phasors already demodulated
+
+    Arguments:
+      frequency -- Fundamental frequency in Hz
+      rate -- Sample rate in Hz
+      phasors -- Channels x bins complex amplitudes from
+                 demodulate_bins() at the tones followed by the noise
+                 frequencies from get_bins(), or an average of them
+      harmonics -- Number of harmonics above the fundamental
+    """
+    (tones, noisebins) = get_bins(frequency, rate, harmonics)
+    phasors = numpy.asarray(phasors)
+    tonephasors = phasors[:, :len(tones)]
+    amplitudes = 2 * numpy.abs(tonephasors)
+    noise = 2 * numpy.sqrt(numpy.mean(
+        numpy.abs(phasors[:, len(tones):])**2, axis=1))
+    # Noise bins can come out exactly zero for synthetic data
+    floor = numpy.maximum(noise, numpy.finfo(float).tiny)
+    snr = 20 * numpy.log10(
+        numpy.maximum(amplitudes, numpy.finfo(float).tiny) /
+        floor[:, numpy.newaxis])
+    harmonic_power = numpy.sum(amplitudes[:, 1:]**2, axis=1)
+    thd = numpy.sqrt(harmonic_power) / numpy.maximum(
+        amplitudes[:, 0], numpy.finfo(float).tiny)
+    return {'frequencies': numpy.array(tones),
+            'phasors': tonephasors,
+            'amplitudes': amplitudes,
+            'phases': numpy.angle(tonephasors),
+            'noise': noise,
+            'snr': snr,
+            'thd': thd}
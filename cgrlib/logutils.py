@@ -0,0 +1,269 @@
+# logutils.py
+#
+# Logging configuration shared by the cgrlib tools
+#
+# Writing a log message to the terminal and to cgrlog.log takes much
+# longer than building it.  The root application logger only gets a
+# QueueHandler, which puts records on a queue and returns.  A
+# QueueListener thread takes records off the queue and hands them to
+# the console and file handlers, so the acquisition loop never waits
+# on disk or terminal I/O.
+#
+# Python 3.2 added QueueHandler and QueueListener to logging.handlers.
+# The versions here work the same way and also run on Python 2.
+
+import atexit # For flushing queued messages at exit
+import logging  # The python logging module
+import threading # For the listener thread
+import time # For rate limiting
+try:
+    import queue # Python 3
+except ImportError:
+    import Queue as queue # Python 2
+
+# Handlers added by init_logging, so a second call can replace them
+installed_handlers = []
+
+# The listener started by init_logging
+installed_listener = None
+
+# Rate limiting.  Each debug or info message (counted by its format
+# string) is written at most rate_limit_count times in rate_limit_interval
+# seconds.  Warnings and worse are never limited.
+rate_limit_count = 10
+rate_limit_interval = 10.0
+
+# Argument types that can't change after a message is queued
+immutable_types = (str, int, float, bool, type(None))
+try:
+    immutable_types += (unicode, long) # Python 2
+except NameError:
+    pass
+
+
+class RateLimitFilter(logging.Filter):
+    """Drops repetitive debug and info messages.
+
+    Messages are grouped by their format string, so per-capture
+    messages like logger.debug('Got %d bytes', count) count as one
+    message no matter what the arguments are.  When a group is
+    allowed through again, its message says how many were dropped.
+
+    Arguments:
+      count -- Messages allowed per group in each interval (default
+               rate_limit_count)
+      interval -- Interval length in seconds (default
+                  rate_limit_interval)
+    """
+    def __init__(self, count=None, interval=None):
+        logging.Filter.__init__(self)
+        if count is None:
+            count = rate_limit_count
+        if interval is None:
+            interval = rate_limit_interval
+        self.count = count
+        self.interval = interval
+        # {(logger name, format string) : [interval start, passed, dropped]}
+        self.groups = {}
+        self.dropped = 0 # Total messages dropped
+        self.lastprune = time.time() # When expired groups were removed
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        now = time.time()
+        if now - self.lastprune >= self.interval:
+            # Forget groups whose interval has ended, so messages that
+            # never repeat don't pile up
+            self.groups = dict((oldkey, group) for (oldkey, group)
+                               in self.groups.items()
+                               if now - group[0] < self.interval)
+            self.lastprune = now
+        group = self.groups.get(key)
+        if group is None or now - group[0] >= self.interval:
+            dropped = 0
+            if group is not None:
+                dropped = group[2]
+            self.groups[key] = [now, 1, 0]
+            if dropped:
+                record.msg = (record.getMessage() + ' (' + str(dropped) +
+                              ' similar messages suppressed)')
+                record.args = None
+            return True
+        if group[1] < self.count:
+            group[1] += 1
+            return True
+        group[2] += 1
+        self.dropped += 1
+        return False
+
+
+class QueueHandler(logging.Handler):
+    """Puts log records on a queue for a QueueListener to handle.
+
+    Arguments:
+      logqueue -- The queue shared with the listener
+    """
+    def __init__(self, logqueue):
+        logging.Handler.__init__(self)
+        self.queue = logqueue
+
+    def prepare(self, record):
+        """Return the record to put on the queue.
+
+        Messages are normally formatted by the listener thread.  If an
+        argument could change before then (a list, say), the message
+        is formatted now.
+        """
+        if record.args:
+            args = record.args
+            if isinstance(args, dict):
+                args = args.values()
+            for arg in args:
+                if not isinstance(arg, immutable_types):
+                    record.msg = record.getMessage()
+                    record.args = None
+                    break
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """Hands records from a queue to handlers in a background thread.
+
+    Each handler's own level is respected.
+
+    Arguments:
+      logqueue -- The queue shared with a QueueHandler
+      handlers -- Handlers that write the records
+    """
+    _sentinel = None
+
+    def __init__(self, logqueue, *handlers):
+        self.queue = logqueue
+        self.handlers = handlers
+        self.thread = None
+
+    def start(self):
+        """Start the listener thread."""
+        self.thread = threading.Thread(target=self.run, name='logging')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is self._sentinel:
+                break
+            self.handle(record)
+
+    def stop(self):
+        """Handle the records still on the queue and stop the thread."""
+        if self.thread is not None:
+            self.queue.put_nowait(self._sentinel)
+            self.thread.join()
+            self.thread = None
+
+
+def get_queue_depth():
+    """Return the number of log records waiting to be written"""
+    if installed_listener is None:
+        return 0
+    return installed_listener.queue.qsize()
+
+
+def stop_logging():
+    """Write out queued messages and stop the listener thread.
+
+    This runs automatically at exit.
+    """
+    global installed_listener
+    if installed_listener is not None:
+        installed_listener.stop()
+        installed_listener = None
+
+
+def init_logging(logfile):
+    """Set up queued console and file logging for the root application
+    logger.
+
+    Colored output goes to the console and plain output goes to the
+    logfile.  Both handlers start at the DEBUG level -- use the tools'
+    init_logger() to apply the levels from a configuration file.
+    They're driven by a listener thread; the logger itself only has a
+    rate-limited QueueHandler.  Calling this again replaces the
+    handlers from the last call.
+
+    Returns (console handler, file handler).
+
+    Arguments:
+      logfile -- Name of the log file.  New messages are appended.
+    """
+    # colorlog is only needed once a tool actually starts logging
+    from colorlog import ColoredFormatter
+
+    # create logger
+    logger = logging.getLogger('root')
+    logger.setLevel(logging.DEBUG)
+    stop_logging()
+    for handler in installed_handlers:
+        logger.removeHandler(handler)
+        handler.close()
+    del installed_handlers[:]
+
+    # create console handler (ch) and set level to debug
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+
+    # create file handler and set level to debug
+    fh = logging.FileHandler(logfile,mode='a',encoding=None,delay=False)
+    fh.setLevel(logging.DEBUG)
+
+    color_formatter = ColoredFormatter(
+        '[ %(log_color)s%(levelname)-8s%(reset)s] %(message)s',
+        datefmt=None,
+        reset=True,
+        log_colors={
+            'DEBUG':    'cyan',
+            'INFO':     'green',
+            'WARNING':  'yellow',
+            'ERROR':    'red',
+            'CRITICAL': 'red',
+        }
+    )
+
+    plain_formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - [ %(levelname)s ] - %(message)s',
+        '%Y-%m-%d %H:%M:%S'
+    )
+
+    # Colored output goes to the console
+    ch.setFormatter(color_formatter)
+
+    # Plain output goes to the file
+    fh.setFormatter(plain_formatter)
+
+    # The logger only queues records.  The listener thread writes them.
+    logqueue = queue.Queue()
+    qh = QueueHandler(logqueue)
+    qh.addFilter(RateLimitFilter())
+    logger.addHandler(qh)
+    global installed_listener
+    installed_listener = QueueListener(logqueue, ch, fh)
+    installed_listener.start()
+    installed_handlers.extend([qh, ch, fh])
+    return (ch, fh)
+
+
+atexit.register(stop_logging)
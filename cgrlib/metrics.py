@@ -0,0 +1,271 @@
+# metrics.py
+#
+# Counters and gauges for long-running acquisitions
+#
+# The capture path counts what it does (captures, serial bytes,
+# timeouts, bad frames...) in this module.  A MetricsExporter thread
+# periodically writes the values to a Prometheus textfile -- the
+# format read by node_exporter's textfile collector -- and optionally
+# to a JSON status file.  Both files are replaced atomically, so a
+# reader never sees a partly written file.
+
+import json # For the status file
+import logging  # The python logging module
+import threading # For the exporter thread
+import time # For rates and timestamps
+
+# create logger
+module_logger = logging.getLogger('root.metrics')
+module_logger.setLevel(logging.DEBUG)
+
+"""Specify the metrics.
+
+Each entry is name : (type, help text).  Counters only go up.  Gauges
+are set to the latest value, or read from a function registered with
+register_gauge() when the files are written.  The re-arm metrics are
+kept for each unit, with a unit label (see get_unit_name).
+
+"""
+descriptions = {
+    'cgr_captures_total':
+    ('counter', 'Captures transferred from the CGR-101'),
+    'cgr_capture_rate':
+    ('gauge', 'Captures per second over the last export interval'),
+    'cgr_trigger_timeouts_total':
+    ('counter', 'Serial reads that timed out while waiting for a trigger'),
+    'cgr_short_frames_total':
+    ('counter', 'Captures that returned fewer than 4096 data bytes'),
+    'cgr_corrupt_frames_total':
+    ('counter', 'Captures whose data could not be decoded'),
+    'cgr_rearm_seconds':
+    ('gauge', 'Dead time between a unit\'s last capture and re-arming it'),
+    'cgr_rearm_seconds_total':
+    ('counter', 'Total dead time between a unit\'s captures and re-arming'),
+    'cgr_serial_bytes_in_total':
+    ('counter', 'Bytes read from the CGR-101'),
+    'cgr_serial_bytes_out_total':
+    ('counter', 'Bytes written to the CGR-101'),
+    'cgr_log_queue_depth':
+    ('gauge', 'Log records waiting for the log writer thread'),
+    'cgr_plot_queue_depth':
+    ('gauge', 'Plot frames waiting for the render thread'),
+    'cgr_plot_frames_drawn_total':
+    ('counter', 'Plot frames drawn'),
+    'cgr_plot_frames_dropped_total':
+    ('counter', 'Plot frames replaced before they could be drawn'),
+    'cgr_sweep_queue_depth':
+    ('gauge', 'Acquired sweep points waiting for analysis')
+}
+
+values = {} # {metric name : value}
+gauge_functions = {} # {metric name : function returning the value}
+values_lock = threading.Lock()
+last_capture_end = {} # {unit : time.time() when its last capture finished}
+
+
+def increment(name, amount=1):
+    """Add to a counter
+
+    Arguments:
+      name -- Metric name (a key of descriptions)
+      amount -- Amount to add
+    """
+    with values_lock:
+        values[name] = values.get(name, 0) + amount
+
+
+def set_gauge(name, value):
+    """Set a gauge
+
+    Arguments:
+      name -- Metric name (a key of descriptions)
+      value -- New value
+    """
+    with values_lock:
+        values[name] = value
+
+
+def register_gauge(name, function):
+    """Read a gauge from a function each time the metrics are written
+
+    Arguments:
+      name -- Metric name (a key of descriptions)
+      function -- Called with no arguments.  Returns the gauge value.
+    """
+    with values_lock:
+        gauge_functions[name] = function
+
+
+def unregister_gauge(name):
+    """Stop reading a gauge from its function
+
+    Arguments:
+      name -- Metric name
+    """
+    with values_lock:
+        gauge_functions.pop(name, None)
+
+
+def get_unit_name(name, unit):
+    """Return a metric name with a unit label
+
+    Arguments:
+      name -- Metric name (a key of descriptions)
+      unit -- Unit name, like its serial port, or None for no label
+    """
+    if unit is None:
+        return name
+    return name + '{unit="' + str(unit) + '"}'
+
+
+def get_base_name(name):
+    """Return a metric name without its labels
+
+    Arguments:
+      name -- Metric name, possibly from get_unit_name
+    """
+    return name.split('{')[0]
+
+
+def capture_armed(unit=None):
+    """Record that a unit was armed for a capture.
+
+    The time since the unit's last capture finished is its re-arm dead
+    time.  Units sweeping in parallel are timed separately.
+
+    Arguments:
+      unit -- Unit name, like its serial port
+    """
+    with values_lock:
+        lastend = last_capture_end.get(unit)
+    if lastend is not None:
+        deadtime = time.time() - lastend
+        set_gauge(get_unit_name('cgr_rearm_seconds', unit), deadtime)
+        increment(get_unit_name('cgr_rearm_seconds_total', unit), deadtime)
+
+
+def capture_done(unit=None):
+    """Record that a capture was transferred from a unit.
+
+    Arguments:
+      unit -- Unit name, like its serial port
+    """
+    with values_lock:
+        last_capture_end[unit] = time.time()
+    increment('cgr_captures_total')
+
+
+def reset():
+    """Forget all values."""
+    with values_lock:
+        values.clear()
+        last_capture_end.clear()
+
+
+def get_values():
+    """Return {metric name : value}, including function gauges"""
+    with values_lock:
+        snapshot = dict(values)
+        functions = dict(gauge_functions)
+    for name in functions:
+        try:
+            snapshot[name] = functions[name]()
+        except Exception as ex:
+            module_logger.warning('Could not read gauge %s: %s', name, ex)
+    return snapshot
+
+
+def format_textfile(snapshot):
+    """Return metrics in the Prometheus text exposition format
+
+    Arguments:
+      snapshot -- {metric name : value}
+    """
+    lines = []
+    lastbase = None
+    # Every labelled value of a metric has to follow its HELP and TYPE
+    for name in sorted(snapshot, key=lambda name: (get_base_name(name),
+                                                   name)):
+        base = get_base_name(name)
+        if base != lastbase:
+            (metrictype, helptext) = descriptions.get(base,
+                                                      ('untyped', base))
+            lines.append('# HELP ' + base + ' ' + helptext)
+            lines.append('# TYPE ' + base + ' ' + metrictype)
+            lastbase = base
+        lines.append(name + ' ' + repr(float(snapshot[name])))
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(filename, snapshot):
+    """Write metrics to a Prometheus textfile atomically.
+
+    Arguments:
+      filename -- Output file name.  node_exporter only reads files
+                  ending in .prom.
+      snapshot -- {metric name : value}
+    """
+    from cgrlib import writers
+    with writers.atomic_open(filename, 'w') as fout:
+        fout.write(format_textfile(snapshot))
+
+
+def write_status(filename, snapshot):
+    """Write metrics to a JSON status file atomically.
+
+    Arguments:
+      filename -- Output file name
+      snapshot -- {metric name : value}
+    """
+    from cgrlib import writers
+    with writers.atomic_open(filename, 'w') as fout:
+        json.dump({'timestamp': time.time(), 'metrics': snapshot}, fout,
+                  indent=2, sort_keys=True)
+
+
+class MetricsExporter(threading.Thread):
+    """Writes the metrics every interval seconds.
+
+    Arguments:
+      textfile -- Prometheus textfile name, or None
+      statusfile -- JSON status file name, or None
+      interval -- Seconds between writes
+    """
+    def __init__(self, textfile=None, statusfile=None, interval=10.0):
+        threading.Thread.__init__(self, name='metrics')
+        self.daemon = True
+        self.textfile = textfile
+        self.statusfile = statusfile
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.lastcount = None # Captures at the last write
+        self.lasttime = None # Time of the last write
+
+    def write(self):
+        """Update the capture rate and write the files now."""
+        now = time.time()
+        count = get_values().get('cgr_captures_total', 0)
+        if self.lasttime is not None and now > self.lasttime:
+            set_gauge('cgr_capture_rate',
+                      (count - self.lastcount) / (now - self.lasttime))
+        self.lastcount = count
+        self.lasttime = now
+        snapshot = get_values()
+        try:
+            if self.textfile:
+                write_textfile(self.textfile, snapshot)
+            if self.statusfile:
+                write_status(self.statusfile, snapshot)
+        except (IOError, OSError) as ex:
+            module_logger.warning('Could not write metrics: %s', ex)
+
+    def run(self):
+        self.write()
+        while not self.stopping.wait(self.interval):
+            self.write()
+
+    def finish(self):
+        """Write the files one last time and stop the thread."""
+        self.stopping.set()
+        self.join()
+        self.write()
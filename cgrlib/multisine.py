@@ -0,0 +1,142 @@
+# multisine.py
+#
+# Broadband impedance measurement with a multisine
+#
+# The CGR-101's waveform generator plays a 256-sample table once per
+# period of its set frequency f0.  A table holding the sum of sines at
+# harmonics k * f0 excites all of those frequencies at once, so one
+# capture measures the impedance at every tone.
+#
+# The capture is made coherent: the sample rate is one of the 16
+# hardware rates, and f0 is set so exactly `cycles` periods fit in the
+# 1024-sample capture.  Tone k then falls exactly on FFT bin
+# k * cycles, with no leakage, and the bins between the tones only hold
+# noise.  With cycles a multiple of 5, f0 is an exact multiple of the
+# generator's frequency resolution (25 MHz / 2**28) for every sample
+# rate.
+#
+# The tone phases follow Schroeder's formula, which keeps the crest
+# factor low so the 8-bit table and the amplitude limit are used well.
+
+import numpy
+
+# Global variables
+table_length = 256 # Samples in the arbitrary waveform table
+capture_points = 1024 # Samples in each channel of a capture
+cycles = 5 # Periods of f0 in each capture
+highest_tone = 64 # Highest harmonic of f0.  This leaves 4 table
+                  # samples per period.
+
+
+def get_tones(count):
+    """Return up to count log-spaced harmonic numbers from 1 to
+    highest_tone
+
+    Arguments:
+      count -- Number of tones wanted
+    """
+    tones = numpy.unique(numpy.round(
+        numpy.logspace(0, numpy.log10(highest_tone), count)).astype(int))
+    return [int(tone) for tone in tones]
+
+
+def get_table(tones):
+    """Return (table, crest factor) for a multisine
+
+    The table is a list of table_length values from 0 to 255.  The
+    crest factor is the peak to rms ratio of the multisine.
+
+    Arguments:
+      tones -- Harmonic numbers to excite
+    """
+    phase = 2 * numpy.pi * numpy.arange(table_length) / table_length
+    wave = numpy.zeros(table_length)
+    tonecount = len(tones)
+    for (number, tone) in enumerate(tones):
+        # Schroeder phases
+        offset = -numpy.pi * number * (number + 1) / tonecount
+        wave += numpy.cos(tone * phase + offset)
+    crest = numpy.max(numpy.abs(wave)) / numpy.sqrt(numpy.mean(wave**2))
+    wave /= numpy.max(numpy.abs(wave))
+    table = numpy.round(127.5 + 127.5 * wave).astype(int)
+    return ([int(value) for value in table], crest)
+
+
+def get_sine_table():
+    """Return the single sine table cgr-gen loads"""
+    return [int(round(127 + 127*numpy.sin(samplenum * 2*numpy.pi/255)))
+            for samplenum in range(table_length)]
+
+
+def get_bands(start, stop, tones):
+    """Return the measurements needed to cover a frequency range
+
+    Each band is a dictionary of:
+      ratebits -- Sample rate setting (see utils.get_samplebits)
+      rate -- Sample rate (Hz)
+      fundamental -- Generator frequency f0 (Hz)
+      tones -- Harmonic numbers measured in this band
+
+    Bands start with the lowest frequencies.  A tone is only measured
+    in the first band that reaches it.
+
+    Arguments:
+      start -- Lowest frequency (Hz)
+      stop -- Highest frequency (Hz)
+      tones -- Harmonic numbers in the table
+    """
+    choices = []
+    for ratebits in range(2**4):
+        rate = 20e6 / 2**ratebits
+        choices.append((ratebits, rate, cycles * rate / capture_points))
+    # Lowest fundamental first
+    choices.sort(key=lambda choice: choice[2])
+    bands = []
+    covered = 0 # Highest frequency measured so far
+    while covered < stop:
+        if covered < start:
+            lowest = start
+        else:
+            lowest = covered * (1 + 1e-9)
+        # The highest fundamental that still reaches the lowest
+        # frequency needed, or the lowest fundamental there is
+        usable = [choice for choice in choices
+                  if choice[2] * tones[0] <= lowest] or choices[:1]
+        (ratebits, rate, fundamental) = usable[-1]
+        bandtones = [tone for tone in tones
+                     if lowest <= tone * fundamental <= stop]
+        if bandtones:
+            bands.append({'ratebits': ratebits, 'rate': rate,
+                          'fundamental': fundamental, 'tones': bandtones})
+        reach = fundamental * tones[-1]
+        if reach <= covered:
+            break # Faster rates can't go any higher
+        covered = reach
+    return bands
+
+
+def analyze(voltdata, tones):
+    """Return the channel ratio and signal-to-noise ratios at each tone
+
+    Returns (ratios, snr).  ratios is a complex array of channel A /
+    channel B at each tone.  snr is a channels x tones array of
+    power ratios (not dB) between each tone and the rms of the two
+    bins on either side of it.
+
+    Arguments:
+      voltdata -- 2 x capture_points array or list of voltages
+      tones -- Harmonic numbers to measure
+    """
+    voltdata = numpy.asarray(voltdata, dtype=float)
+    centered = voltdata - voltdata.mean(axis=1)[:, numpy.newaxis]
+    spectra = numpy.fft.rfft(centered, axis=1)
+    bins = numpy.array(tones) * cycles
+    signal = spectra[:, bins]
+    noisebins = numpy.concatenate([bins - 2, bins - 1, bins + 1, bins + 2])
+    noisebins = numpy.clip(noisebins, 1, spectra.shape[1] - 1)
+    noise = numpy.abs(spectra[:, noisebins]).reshape(2, 4, len(bins))**2
+    noisepower = numpy.maximum(noise.mean(axis=1), numpy.finfo(float).tiny)
+    snr = numpy.abs(signal)**2 / noisepower
+    ratios = signal[0] / numpy.where(signal[1] == 0, numpy.finfo(float).tiny,
+                                     signal[1])
+    return (ratios, snr)
@@ -0,0 +1,235 @@
+# query.py
+#
+# Parallel queries over the captures in a capture archive
+#
+# A query reduces every capture to one number (its minimum, peak to
+# peak voltage, ...), then either groups those numbers into time
+# buckets or lists the captures where the number exceeds a threshold.
+# The archive is split into work units of consecutive captures, and
+# each unit is reduced by a worker process.  Workers return small
+# partial results that are merged here.
+
+import logging  # The python logging module
+import multiprocessing # For the worker pool
+
+import numpy
+
+from cgrlib import archive
+
+# create logger
+module_logger = logging.getLogger('root.query')
+module_logger.setLevel(logging.DEBUG)
+
+# Global variables
+unit_captures = 4096 # Captures handed to a worker at a time
+block_captures = 256 # Captures calibrated at a time inside a worker
+
+"""Specify the per-capture reductions.
+
+Each function takes an N x 1024 array of voltages (or counts) and a
+threshold, and returns N values.  If you want to add another
+statistic, this is the place to do it.
+
+"""
+def get_min(values, threshold):
+    return values.min(axis=1)
+
+def get_max(values, threshold):
+    return values.max(axis=1)
+
+def get_mean(values, threshold):
+    return values.mean(axis=1)
+
+def get_rms(values, threshold):
+    return numpy.sqrt(numpy.mean(values**2, axis=1))
+
+def get_vpp(values, threshold):
+    return values.max(axis=1) - values.min(axis=1)
+
+def get_crossings(values, threshold):
+    """Count rising crossings of the threshold in each capture"""
+    above = values >= threshold
+    return numpy.sum(above[:, 1:] & ~above[:, :-1], axis=1).astype(float)
+
+statistics = {
+    'min': get_min,
+    'max': get_max,
+    'mean': get_mean,
+    'rms': get_rms,
+    'vpp': get_vpp,
+    'crossings': get_crossings
+}
+
+"""Specify how bucketed values are combined.
+
+Workers keep [count, sum, min, max] for every bucket, which is enough
+to merge partial buckets and compute any of these.
+
+"""
+aggregates = ['count', 'sum', 'mean', 'min', 'max']
+
+
+def get_work_units(reader, first, last, captures=None):
+    """Return [(first, last), ...] index ranges covering [first, last)
+
+    Arguments:
+      reader -- archive.ArchiveReader
+      first -- First index position
+      last -- One past the last index position
+      captures -- Captures per work unit (default unit_captures)
+    """
+    if captures is None:
+        captures = unit_captures
+    units = []
+    for start in range(first, last, captures):
+        units.append((start, min(start + captures, last)))
+    return units
+
+
+def reduce_unit(task):
+    """Reduce one work unit.  This runs in a worker process.
+
+    Returns a dictionary with:
+      'buckets' -- {bucket start time : [count, sum, min, max]}
+      'matches' -- [(seq, timestamp, value), ...] for captures whose
+                   value is above the 'above' threshold
+
+    Arguments:
+      task -- Dictionary with the keys:
+              'directory' -- Archive directory
+              'first', 'last' -- Index range of the unit
+              'caldict' -- Calibration dictionary, or None for counts
+              'channel' -- 0 for channel A, 1 for channel B
+              'stat' -- A key of statistics
+              'threshold' -- Threshold used by the crossings statistic
+              'bucket' -- Bucket width in seconds, or None
+              'above' -- Report captures above this value, or None
+    """
+    reader = archive.ArchiveReader(task['directory'])
+    statfunc = statistics[task['stat']]
+    buckets = {}
+    matches = []
+    for (position, records) in reader.iter_blocks(task['first'],
+                                                  task['last'],
+                                                  block_captures):
+        if task['caldict'] is None:
+            values = records['data'][:, task['channel'], :].astype(float)
+        else:
+            values = archive.get_cal_volts(
+                records, task['caldict'])[:, task['channel'], :]
+        results = statfunc(values, task['threshold'])
+        timestamps = numpy.array(records['timestamp'])
+        if task['bucket']:
+            starts = numpy.floor(timestamps / task['bucket']) * task['bucket']
+            for start in numpy.unique(starts):
+                selected = results[starts == start]
+                merge_bucket(buckets, float(start),
+                             [len(selected), float(numpy.sum(selected)),
+                              float(numpy.min(selected)),
+                              float(numpy.max(selected))])
+        if task['above'] is not None:
+            for index in numpy.nonzero(results > task['above'])[0]:
+                matches.append((int(records['seq'][index]),
+                                float(timestamps[index]),
+                                float(results[index])))
+    reader.close()
+    return {'buckets': buckets, 'matches': matches}
+
+
+def merge_bucket(buckets, start, partial):
+    """Merge a partial [count, sum, min, max] into a bucket dictionary
+
+    Arguments:
+      buckets -- {bucket start time : [count, sum, min, max]}
+      start -- Bucket start time
+      partial -- [count, sum, min, max] to merge in
+    """
+    if not start in buckets:
+        buckets[start] = list(partial)
+    else:
+        bucket = buckets[start]
+        bucket[0] += partial[0]
+        bucket[1] += partial[1]
+        bucket[2] = min(bucket[2], partial[2])
+        bucket[3] = max(bucket[3], partial[3])
+
+
+def get_aggregate(bucket, aggregate):
+    """Return one aggregate of a [count, sum, min, max] bucket
+
+    Arguments:
+      bucket -- [count, sum, min, max]
+      aggregate -- One of aggregates
+    """
+    if aggregate == 'count':
+        return bucket[0]
+    elif aggregate == 'sum':
+        return bucket[1]
+    elif aggregate == 'mean':
+        return bucket[1] / bucket[0]
+    elif aggregate == 'min':
+        return bucket[2]
+    elif aggregate == 'max':
+        return bucket[3]
+    raise ValueError('Unknown aggregate ' + str(aggregate))
+
+
+def run_query(directory, stat, channel=0, caldict=None, start=None,
+              stop=None, bucket=None, above=None, threshold=0.0,
+              processes=None):
+    """Run a query over an archive and return the merged results.
+
+    Returns a dictionary with:
+      'buckets' -- Time-ordered list of
+                   (bucket start time, [count, sum, min, max])
+      'matches' -- Sequence-ordered list of (seq, timestamp, value)
+      'captures' -- Number of captures examined
+
+    Arguments:
+      directory -- Archive directory
+      stat -- Per-capture statistic (a key of statistics)
+      channel -- 0 for channel A, 1 for channel B
+      caldict -- Calibration dictionary.  None queries raw counts.
+      start -- Earliest capture time (seconds since the epoch) or None
+      stop -- Captures must be earlier than this, or None
+      bucket -- Bucket width in seconds.  None skips bucketing.
+      above -- List captures whose statistic is above this value.
+               None skips the listing.
+      threshold -- Level used by the crossings statistic
+      processes -- Number of worker processes (default: one per CPU).
+                   Use 1 to run in this process.
+    """
+    if not stat in statistics:
+        raise ValueError('Unknown statistic ' + str(stat))
+    reader = archive.ArchiveReader(directory)
+    (first, last) = reader.find_time(start, stop)
+    units = get_work_units(reader, first, last)
+    reader.close()
+    tasks = []
+    for (unitfirst, unitlast) in units:
+        tasks.append({'directory': directory, 'first': unitfirst,
+                      'last': unitlast, 'caldict': caldict,
+                      'channel': channel, 'stat': stat,
+                      'threshold': threshold, 'bucket': bucket,
+                      'above': above})
+    module_logger.debug('Split ' + str(last - first) + ' captures into ' +
+                        str(len(tasks)) + ' work units')
+    if processes == 1 or len(tasks) <= 1:
+        partials = map(reduce_unit, tasks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            partials = pool.map(reduce_unit, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    buckets = {}
+    matches = []
+    for partial in partials:
+        for bucketstart in partial['buckets']:
+            merge_bucket(buckets, bucketstart, partial['buckets'][bucketstart])
+        matches.extend(partial['matches'])
+    matches.sort()
+    return {'buckets': sorted(buckets.items()),
+            'matches': matches,
+            'captures': last - first}
@@ -0,0 +1,190 @@
+# render.py
+#
+# Background plotting for the cgrlib tools
+#
+# Plotting with gnuplot is slow compared to acquiring a capture.  The
+# RenderWorker thread draws frames submitted by the acquisition loop
+# without making the loop wait.  Only the most recent frame is kept:
+# a frame that is replaced before it could be drawn is dropped.
+# Frames are drawn at most once every interval seconds, and plot files
+# (eps, png) are only written when an export is requested.  Headless
+# runs use a NullRenderer, which draws nothing.
+
+import logging  # The python logging module
+import threading # For the render thread
+import time # For limiting the refresh rate
+
+from cgrlib import timing # For timing plots
+from cgrlib import metrics # For frame counters
+
+# create logger
+module_logger = logging.getLogger('root.render')
+module_logger.setLevel(logging.DEBUG)
+
+# Global variables
+min_interval = 0.2 # Minimum seconds between drawn frames
+
+
+def export_plot(plotobj, filename, terminal='x11'):
+    """Write the current plot to a file and return to the display.
+
+    The output terminal is chosen from the file name extension: .png
+    files are written with the png terminal, everything else as color
+    encapsulated postscript.
+
+    Arguments:
+      plotobj -- The gnuplot plot object
+      filename -- Output file name
+      terminal -- The display terminal to restore afterwards
+    """
+    if filename.lower().endswith('.png'):
+        plotobj('set terminal png')
+    else:
+        plotobj('set terminal postscript eps color')
+    plotobj("set output '" + filename + "'")
+    plotobj('replot')
+    plotobj('set output')
+    plotobj('set terminal ' + terminal)
+
+
+class RenderWorker(threading.Thread):
+    """Draws frames in a background thread.
+
+    The plot objects used by drawfunc and exportfunc should only be
+    touched by this thread once it has started.
+
+    Arguments:
+      drawfunc -- Called as drawfunc(*frame) to draw a frame
+      exportfunc -- Called with no arguments to write plot files.
+                    None if there is nothing to export.
+      interval -- Minimum seconds between drawn frames (default
+                  min_interval)
+    """
+    def __init__(self, drawfunc, exportfunc=None, interval=None):
+        threading.Thread.__init__(self, name='render')
+        self.daemon = True
+        self.drawfunc = drawfunc
+        self.exportfunc = exportfunc
+        if interval is None:
+            interval = min_interval
+        self.interval = interval
+        self.condition = threading.Condition()
+        self.frame = None # The frame waiting to be drawn
+        self.export_requested = False
+        self.stopping = False
+        self.lastdraw = 0 # Time the last frame was drawn
+        self.frames_drawn = 0
+        self.frames_dropped = 0
+
+    def submit(self, *frame):
+        """Hand a frame to the worker without waiting for it to be drawn.
+
+        The frame replaces any frame still waiting to be drawn.  Pass
+        copies of lists the caller will keep changing.
+
+        Arguments:
+          frame -- Arguments for drawfunc
+        """
+        with self.condition:
+            if self.frame is not None:
+                self.frames_dropped += 1
+                metrics.increment('cgr_plot_frames_dropped_total')
+            self.frame = frame
+            self.condition.notify()
+
+    def get_queue_depth(self):
+        """Return the number of frames waiting to be drawn (0 or 1)"""
+        with self.condition:
+            return int(self.frame is not None)
+
+    def request_export(self):
+        """Ask the worker to write plot files after its next frame."""
+        with self.condition:
+            self.export_requested = True
+            self.condition.notify()
+
+    def finish(self, export=True):
+        """Draw the last frame, optionally export it, and stop the worker.
+
+        Returns after the worker thread has finished.
+
+        Arguments:
+          export -- Write plot files before stopping
+        """
+        with self.condition:
+            self.stopping = True
+            if export:
+                self.export_requested = True
+            self.condition.notify()
+        self.join()
+        module_logger.debug('Drew ' + str(self.frames_drawn) +
+                            ' frames, dropped ' + str(self.frames_dropped))
+
+    def get_work(self):
+        """Wait for something to do and return (frame, export, stopping)
+
+        The frame is None if there is nothing to draw.  A waiting
+        frame is held back until interval seconds have passed since
+        the last draw, unless the worker is stopping or exporting.
+        """
+        with self.condition:
+            while not (self.stopping or self.export_requested):
+                if self.frame is None:
+                    self.condition.wait()
+                else:
+                    wait = self.lastdraw + self.interval - time.time()
+                    if wait <= 0:
+                        break
+                    self.condition.wait(wait)
+            frame = self.frame
+            self.frame = None
+            export = self.export_requested
+            self.export_requested = False
+            return (frame, export, self.stopping)
+
+    def run(self):
+        drawn = False # Is there a frame on the plot to export?
+        while True:
+            (frame, export, stopping) = self.get_work()
+            try:
+                if frame is not None:
+                    with timing.phase('plot'):
+                        self.drawfunc(*frame)
+                    self.lastdraw = time.time()
+                    self.frames_drawn += 1
+                    metrics.increment('cgr_plot_frames_drawn_total')
+                    drawn = True
+                if export and drawn and self.exportfunc is not None:
+                    with timing.phase('plot export'):
+                        self.exportfunc()
+            except Exception as ex:
+                # Keep drawing later frames if one fails
+                module_logger.error('Plotting failed: ' + str(ex))
+            if stopping:
+                break
+
+
+class NullRenderer(object):
+    """Stands in for a RenderWorker when there is nothing to plot.
+
+    Headless runs use this so the acquisition loop doesn't need to
+    check whether plotting is enabled.
+    """
+    def __init__(self):
+        self.frames_drawn = 0
+        self.frames_dropped = 0
+
+    def start(self):
+        pass
+
+    def submit(self, *frame):
+        pass
+
+    def get_queue_depth(self):
+        return 0
+
+    def request_export(self):
+        pass
+
+    def finish(self, export=True):
+        pass
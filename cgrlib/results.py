@@ -0,0 +1,230 @@
+# results.py
+#
+# Append-only impedance sweep results
+#
+# cgr-imp writes every measured point to a results file as soon as
+# it's done, so an interrupted sweep loses at most the point it was
+# working on.  The file is plain text:
+#
+#   # cgr-imp results
+#   # config <hash of the settings that affect the results>
+#   # columns timestamp requested frequency z_real z_imag ...
+#   <one tab-separated line per point>
+#
+# A sweep can be resumed from the file when the configuration hash
+# matches: points already in the file are loaded instead of measured.
+# A partial last line left by an interrupted write is dropped.
+
+import hashlib # For configuration hashes
+import logging  # The python logging module
+import os # For file sizes and renaming
+import time # For timestamps
+
+# create logger
+module_logger = logging.getLogger('root.results')
+module_logger.setLevel(logging.DEBUG)
+
+# Global variables
+config_sections = ['Sweep', 'Impedance', 'Calibration', 'Inputs']
+
+"""Specify the columns.
+
+Each entry is (name, type).  Numbers are written with repr(), so
+frequencies read back exactly.  Missing values are written as nan.
+
+"""
+columns = [
+    ('timestamp', float), # Seconds since the epoch
+    ('requested', float), # Requested frequency (Hz).  The band's
+                          # fundamental for multisine points.
+    ('frequency', float), # Frequency set by the hardware (Hz)
+    ('z_real', float), # Real part of the impedance (Ohms)
+    ('z_imag', float), # Imaginary part of the impedance (Ohms)
+    ('amplitude_a', float), # Channel A amplitude (Vp)
+    ('amplitude_b', float), # Channel B amplitude (Vp)
+    ('averages', int), # Acquisitions averaged
+    ('stderr', float), # Relative standard error of the impedance
+    ('snr', float), # Signal-to-noise ratio of the weaker channel (dB)
+    ('method', str) # 'sine' or 'multisine'
+]
+
+
+def get_config_hash(config, caldicts, mode):
+    """Return a hash of the settings that affect sweep results
+
+    Arguments:
+      config -- The configuration file object
+      caldicts -- List of calibration dictionaries, one for each unit
+                  taking part in the sweep
+      mode -- String describing any other settings, like the
+              measurement method
+    """
+    settings = []
+    for section in config_sections:
+        for key in sorted(config.get(section, {})):
+            # Values read from a file are strings.  Freshly
+            # initialized ones may not be.
+            settings.append(section + '.' + key + '=' +
+                            str(config[section][key]))
+    for unitnum, caldict in enumerate(caldicts):
+        # The first unit keeps the name a single unit has always had
+        if unitnum == 0:
+            prefix = 'cal.'
+        else:
+            prefix = 'cal' + str(unitnum) + '.'
+        for key in sorted(caldict):
+            settings.append(prefix + key + '=' + repr(caldict[key]))
+    settings.append('mode=' + mode)
+    return hashlib.sha1(';'.join(settings).encode('ascii')).hexdigest()[:16]
+
+
+def parse_line(line):
+    """Return the record dictionary in a results line, or None if the
+    line isn't complete
+
+    Arguments:
+      line -- One line of a results file
+    """
+    fields = line.rstrip('\n').split('\t')
+    if not line.endswith('\n') or len(fields) != len(columns):
+        return None
+    record = {}
+    try:
+        for (name, kind), field in zip(columns, fields):
+            if kind is int:
+                record[name] = int(field)
+            else:
+                record[name] = kind(field)
+    except ValueError:
+        return None
+    return record
+
+
+def read_results(filename):
+    """Return (configuration hash, list of record dictionaries)
+
+    Arguments:
+      filename -- Results file name
+    """
+    confighash = None
+    records = []
+    with open(filename) as fin:
+        for line in fin:
+            if line.startswith('# config '):
+                confighash = line.split()[2]
+            elif line.startswith('#'):
+                continue
+            else:
+                record = parse_line(line)
+                if record is None:
+                    module_logger.warning('Ignoring partial line in %s',
+                                          filename)
+                else:
+                    records.append(record)
+    return (confighash, records)
+
+
+def get_backup_name(filename):
+    """Return a name to keep an old results file under that isn't
+    taken yet: filename_old, then filename_old2, filename_old3...
+
+    Arguments:
+      filename -- Results file name
+    """
+    backup = filename + '_old'
+    number = 1
+    while os.path.exists(backup):
+        number += 1
+        backup = filename + '_old' + str(number)
+    return backup
+
+
+class ResultsFile(object):
+    """Appends sweep points to a results file.
+
+    If resume is set and the file holds results with the same
+    configuration hash, its records are kept and loaded into
+    self.records.  Otherwise an existing file is renamed (see
+    get_backup_name) and a new one is started, so earlier results are
+    never overwritten.
+
+    Arguments:
+      filename -- Results file name
+      confighash -- Hash from get_config_hash
+      resume -- True to continue an existing file
+    """
+    def __init__(self, filename, confighash, resume=False):
+        self.filename = filename
+        self.records = []
+        if os.path.exists(filename):
+            (oldhash, oldrecords) = read_results(filename)
+            if resume and oldhash == confighash:
+                self.records = oldrecords
+                self.truncate_partial()
+                self.fout = open(filename, 'a')
+                module_logger.info('Resuming %s with %d points', filename,
+                                   len(oldrecords))
+                return
+            if resume:
+                module_logger.warning('Settings changed since %s was ' +
+                                      'written.  Starting a new sweep.',
+                                      filename)
+            backup = get_backup_name(filename)
+            os.rename(filename, backup)
+            module_logger.info('Saved old results as %s', backup)
+        self.fout = open(filename, 'w')
+        self.fout.write('# cgr-imp results\n')
+        self.fout.write('# config ' + confighash + '\n')
+        self.fout.write('# columns ' +
+                        ' '.join(name for (name, kind) in columns) + '\n')
+        self.sync()
+
+    def truncate_partial(self):
+        """Remove a partial last line left by an interrupted write."""
+        with open(self.filename, 'r+b') as fout:
+            fout.seek(0, os.SEEK_END)
+            size = fout.tell()
+            if size == 0:
+                return
+            fout.seek(size - 1)
+            if fout.read(1) == b'\n':
+                return
+            fout.seek(0)
+            content = fout.read()
+            fout.truncate(content.rfind(b'\n') + 1)
+
+    def sync(self):
+        """Make sure everything written is on disk."""
+        self.fout.flush()
+        os.fsync(self.fout.fileno())
+
+    def append(self, record):
+        """Write one point and return the record as written
+
+        Arguments:
+          record -- Dictionary with an entry for every column.  A
+                    missing timestamp is the current time, other
+                    missing or None numbers are written as nan (0 for
+                    integers).
+        """
+        record = dict(record)
+        if record.get('timestamp') is None:
+            record['timestamp'] = time.time()
+        fields = []
+        for (name, kind) in columns:
+            value = record.get(name)
+            if value is None:
+                value = 0 if kind is int else float('nan')
+                record[name] = value
+            if kind is str:
+                fields.append(str(value))
+            else:
+                fields.append(repr(kind(value)))
+        self.fout.write('\t'.join(fields) + '\n')
+        self.sync()
+        self.records.append(record)
+        return record
+
+    def close(self):
+        """Close the file."""
+        self.fout.close()
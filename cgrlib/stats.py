@@ -0,0 +1,62 @@
+# stats.py
+#
+# Running statistics for averaging captures
+#
+# RunningStats keeps the mean and variance of a stream of values with
+# Welford's method, so the values themselves never have to be stored.
+# Values can be real or complex numbers, or numpy arrays of them.  For
+# complex values the variance is the mean squared distance from the
+# mean.
+
+import numpy
+
+
+class RunningStats(object):
+    """Mean and variance of a stream of values."""
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None # Sum of squared distances from the mean
+
+    def add(self, value):
+        """Add one value
+
+        Arguments:
+          value -- Number or numpy array.  Arrays must all have the same
+                   shape.
+        """
+        self.count += 1
+        if self.count == 1:
+            self.mean = numpy.array(value)
+            self.m2 = numpy.zeros(self.mean.shape)
+            return
+        delta = value - self.mean
+        self.mean = self.mean + delta / self.count
+        self.m2 = self.m2 + numpy.real(delta * numpy.conj(value - self.mean))
+
+    def get_variance(self):
+        """Return the sample variance, or None with fewer than two
+        values
+        """
+        if self.count < 2:
+            return None
+        return self.m2 / (self.count - 1)
+
+    def get_stderr(self):
+        """Return the standard error of the mean, or None with fewer
+        than two values
+        """
+        variance = self.get_variance()
+        if variance is None:
+            return None
+        return numpy.sqrt(variance / self.count)
+
+    def get_relative_stderr(self):
+        """Return the standard error of the mean relative to the mean's
+        magnitude, or None with fewer than two values
+        """
+        stderr = self.get_stderr()
+        if stderr is None:
+            return None
+        return stderr / numpy.maximum(numpy.abs(self.mean),
+                                      numpy.finfo(float).tiny)
@@ -0,0 +1,409 @@
+# sweep.py
+#
+# Pipelined frequency sweeps
+#
+# A sweep point has two parts: acquiring it (retuning the CGR-101 and
+# capturing) and analysing it (demodulating, logging, queueing plots).
+# run_pipelined() acquires points in a background thread and analyses
+# them in the calling thread, with a short queue in between.  The unit
+# retunes and captures point k+1 while point k is being analysed, so a
+# sweep takes about as long as its acquisitions.
+#
+# Only the acquisition thread talks to the unit during the sweep.
+#
+# run_distributed() does the same with several units, one acquisition
+# thread each.  Every unit starts with its own contiguous share of the
+# points, so it keeps its sample rate for as long as possible.  A unit
+# that runs out takes points from the end of the largest share left
+# (work stealing), so faster units measure more points and all of them
+# finish at about the same time.  Analysis stays in the calling
+# thread.
+#
+# get_plan() works out the hardware settings for every point before a
+# sweep starts: the frequency the generator will really produce, its
+# phase word, the sample rate and the capture time.  Points are
+# ordered so the control register (which holds the sample rate) is
+# only written when the rate changes, and points the generator can't
+# tell apart are measured once.  get_plan_time() estimates how long
+# the sweep will take.
+#
+# get_refinements() picks frequencies to add to a finished sweep, where
+# the impedance changes quickly between neighbouring points.  Sweeping
+# those and refining again resolves a resonance without a dense sweep
+# over the whole range.
+
+import cmath # For impedance phases
+import collections # For the work queue
+import logging  # The python logging module
+import math # For geometric means
+import threading # For the acquisition thread
+import time # For stop timeouts
+
+try:
+    import Queue as queue # Python 2
+except ImportError:
+    import queue
+
+from cgrlib import utils # For the hardware settings
+from cgrlib import timing # For timing queue waits
+from cgrlib import metrics # For the queue depth
+
+# create logger
+module_logger = logging.getLogger('root.sweep')
+module_logger.setLevel(logging.DEBUG)
+
+# Global variables
+default_depth = 2 # Acquired points waiting for analysis
+capture_points = 1024 # Samples in each channel of a capture
+baudrate = 230400 # Serial rate of the CGR-101
+read_timeout = 0.1 # Each capture transfer ends with a serial timeout
+min_refine_ratio = 1.01 # Neighbouring frequencies closer than this
+                        # ratio aren't refined
+stop_timeout = 5 # Seconds to wait for acquisition threads to stop
+
+
+class AcquisitionError(object):
+    """Queue item passing an exception from the acquisition thread.
+
+    Arguments:
+      exception -- The exception raised by the acquire function
+    """
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class AcquisitionThread(threading.Thread):
+    """Calls acquire for every point and queues the results.
+
+    Each queue item is (point, data).  A None item marks the end of the
+    sweep, and an AcquisitionError item an acquisition that failed.
+
+    Arguments:
+      acquire -- Called with each point.  Returns its data.
+      points -- List or iterator of sweep points
+      pointqueue -- Queue for the acquired points
+      name -- Thread name
+    """
+    def __init__(self, acquire, points, pointqueue, name='acquisition'):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.acquire = acquire
+        self.points = points
+        self.pointqueue = pointqueue
+        self.stopping = threading.Event()
+
+    def put(self, item):
+        """Queue an item, waiting for room unless the sweep was stopped.
+        Returns False if it was stopped.
+
+        Arguments:
+          item -- Queue item
+        """
+        while not self.stopping.is_set():
+            try:
+                self.pointqueue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self):
+        for point in self.points:
+            if self.stopping.is_set():
+                return
+            try:
+                data = self.acquire(point)
+            except Exception as ex:
+                module_logger.error('Acquisition failed at %s: %s', point, ex,
+                                    exc_info=True)
+                self.put(AcquisitionError(ex))
+                return
+            if not self.put((point, data)):
+                return
+        self.put(None)
+
+    def stop(self):
+        """Stop after the current acquisition and wait for the thread."""
+        self.stopping.set()
+        self.wait(time.time() + stop_timeout)
+
+    def wait(self, deadline):
+        """Wait for the thread to finish, until a deadline.
+
+        A capture waiting for a trigger that never comes doesn't
+        return, so the wait gives up at the deadline and leaves the
+        (daemon) thread behind.  The joins are short, so Python 2
+        still sees a KeyboardInterrupt.
+
+        Arguments:
+          deadline -- time.time() to give up at
+        """
+        while self.is_alive() and time.time() < deadline:
+            self.join(0.1)
+        if self.is_alive():
+            module_logger.warning('%s thread is still waiting for a ' +
+                                  'capture.  Leaving it behind.', self.name)
+
+
+def get_item(pointqueue):
+    """Return the next queue item.
+
+    Waits in short timeouts, so Python 2 still sees a KeyboardInterrupt.
+
+    Arguments:
+      pointqueue -- Queue of acquired points
+    """
+    while True:
+        try:
+            return pointqueue.get(timeout=0.5)
+        except queue.Empty:
+            pass
+
+
+def run_pipelined(acquire, analyze, points, depth=None):
+    """Acquire and analyse every point of a sweep, overlapping the two.
+
+    acquire runs in a background thread, analyze in the calling thread,
+    both in sweep order.  An exception in either one stops the sweep
+    and is raised here.
+
+    Arguments:
+      acquire -- Called with each point.  Returns its data.
+      analyze -- Called with each point and its data
+      points -- List of sweep points
+      depth -- Acquired points allowed to wait for analysis.  0
+               acquires and analyses each point in turn without a
+               thread.  None uses default_depth.
+    """
+    if depth is None:
+        depth = default_depth
+    if depth <= 0:
+        for point in points:
+            analyze(point, acquire(point))
+        return
+    pointqueue = queue.Queue(maxsize=depth)
+    metrics.register_gauge('cgr_sweep_queue_depth', pointqueue.qsize)
+    acquirer = AcquisitionThread(acquire, points, pointqueue)
+    acquirer.start()
+    try:
+        while True:
+            with timing.phase('analysis wait'):
+                item = get_item(pointqueue)
+            if item is None:
+                break
+            if isinstance(item, AcquisitionError):
+                raise item.exception
+            analyze(item[0], item[1])
+    finally:
+        acquirer.stop()
+        metrics.unregister_gauge('cgr_sweep_queue_depth')
+
+
+class WorkQueue(object):
+    """Sweep points shared between several workers.
+
+    Each worker starts with a contiguous share of the points.  A
+    worker whose share is used up steals from the end of the largest
+    remaining share.
+
+    Arguments:
+      points -- List of sweep points, in the order to measure them
+      workers -- Number of workers
+    """
+    def __init__(self, points, workers):
+        self.lock = threading.Lock()
+        self.shares = []
+        for worker in range(workers):
+            first = len(points) * worker // workers
+            last = len(points) * (worker + 1) // workers
+            self.shares.append(collections.deque(points[first:last]))
+
+    def get(self, worker):
+        """Return the next point for a worker, or None when there are
+        none left
+
+        Arguments:
+          worker -- Worker number
+        """
+        with self.lock:
+            if self.shares[worker]:
+                return self.shares[worker].popleft()
+            victim = max(self.shares, key=len)
+            if not victim:
+                return None
+            module_logger.debug('Worker %d took a point from another ' +
+                                'worker', worker)
+            return victim.pop()
+
+    def iterate(self, worker):
+        """Yield points for a worker until there are none left
+
+        Arguments:
+          worker -- Worker number
+        """
+        while True:
+            point = self.get(worker)
+            if point is None:
+                return
+            yield point
+
+
+def run_distributed(acquires, analyze, points, depth=None):
+    """Acquire points with several units and analyse them all.
+
+    Each acquire function runs in its own thread and gets points from a
+    WorkQueue.  analyze runs in the calling thread, in the order points
+    are acquired.  An exception in any of them stops the sweep and is
+    raised here.  With one acquire function this is run_pipelined().
+
+    Arguments:
+      acquires -- List of acquire functions, one for each unit.  Each
+                  is called with points and returns their data.
+      analyze -- Called with each point and its data
+      points -- List of sweep points
+      depth -- Acquired points allowed to wait for analysis, for each
+               unit.  None uses default_depth.  With several units,
+               each point still has to wait for at least one.
+    """
+    if len(acquires) == 1:
+        run_pipelined(acquires[0], analyze, points, depth)
+        return
+    if depth is None:
+        depth = default_depth
+    work = WorkQueue(points, len(acquires))
+    pointqueue = queue.Queue(maxsize=max(depth, 1) * len(acquires))
+    metrics.register_gauge('cgr_sweep_queue_depth', pointqueue.qsize)
+    acquirers = [AcquisitionThread(acquire, work.iterate(worker), pointqueue,
+                                   'acquisition-' + str(worker))
+                 for (worker, acquire) in enumerate(acquires)]
+    for acquirer in acquirers:
+        acquirer.start()
+    try:
+        running = len(acquirers)
+        while running:
+            with timing.phase('analysis wait'):
+                item = get_item(pointqueue)
+            if item is None:
+                running -= 1
+                continue
+            if isinstance(item, AcquisitionError):
+                raise item.exception
+            analyze(item[0], item[1])
+    finally:
+        for acquirer in acquirers:
+            acquirer.stopping.set()
+        deadline = time.time() + stop_timeout
+        for acquirer in acquirers:
+            acquirer.wait(deadline)
+        metrics.unregister_gauge('cgr_sweep_queue_depth')
+
+
+def get_plan(frequencies, cycles, ratebits=None):
+    """Return the settings for every point of a sweep, in the order to
+    measure them.
+
+    Each step is a dictionary of:
+      frequency -- The requested frequency (Hz)
+      actual -- The frequency the generator will produce (Hz)
+      phasestr -- The generator's phase word
+      ratebits -- Sample rate setting (see utils.get_samplebits)
+      rate -- Sample rate (Hz)
+      capture_time -- Time to fill the capture buffer (s)
+      set_rate -- True if the control register has to be written
+                  before this step
+
+    Steps with the same sample rate are grouped, starting with the
+    rate already set, and ordered by frequency within a group.  Only
+    the first of several frequencies the generator would produce
+    identically is kept.
+
+    Arguments:
+      frequencies -- Requested frequencies (Hz)
+      cycles -- Drive cycles to capture at each frequency
+      ratebits -- Sample rate setting already in the control register,
+                  or None if it isn't known
+    """
+    steps = []
+    phasestrs = set()
+    for frequency in sorted(frequencies):
+        # The generator rounds frequencies down to its resolution
+        actual = int(frequency / utils.fresolution) * utils.fresolution
+        phasestr = utils.get_phasestr(actual)
+        if phasestr in phasestrs:
+            module_logger.debug('Skipping %0.2f Hz, which the generator ' +
+                                'sets like another point', frequency)
+            continue
+        phasestrs.add(phasestr)
+        target_rate = capture_points * actual / float(cycles)
+        [bits, rate] = utils.get_samplebits(target_rate)
+        steps.append({'frequency': frequency, 'actual': actual,
+                      'phasestr': phasestr, 'ratebits': bits, 'rate': rate,
+                      'capture_time': capture_points / rate})
+    # Start with the rate that's already set, then go up in frequency
+    steps.sort(key=lambda step: (step['ratebits'] != ratebits,
+                                 step['rate'], step['frequency']))
+    for step in steps:
+        step['set_rate'] = (step['ratebits'] != ratebits)
+        ratebits = step['ratebits']
+    return steps
+
+
+def get_plan_time(steps, averages):
+    """Return the estimated seconds to measure a planned sweep
+
+    Every command costs the pacing delay utils.cmddelay.  Each capture
+    waits up to one drive period for the trigger, fills the buffer,
+    and transfers 4096 bytes followed by a serial timeout.
+
+    Arguments:
+      steps -- Steps from get_plan()
+      averages -- Captures at each step
+    """
+    transfer_time = (4 * capture_points + 1) * 10.0 / baudrate + read_timeout
+    seconds = 0
+    for step in steps:
+        commands = 1 + int(step['set_rate']) + 2 * averages
+        seconds += commands * utils.cmddelay
+        seconds += averages * (1 / step['actual'] + step['capture_time'] +
+                               transfer_time)
+    return seconds
+
+
+def get_refinements(frequencies, impedances, db_threshold, degree_threshold,
+                    count):
+    """Return frequencies to add between the measured ones.
+
+    A new point goes at the geometric mean of two neighbouring
+    frequencies when |Z| changes by more than db_threshold or the
+    phase by more than degree_threshold between them.  The intervals
+    that exceed their thresholds by the most are refined first.
+
+    Arguments:
+      frequencies -- Measured frequencies (Hz), in any order
+      impedances -- Complex impedance at each frequency, or [real,
+                    imaginary] lists
+      db_threshold -- Largest |Z| change between neighbours (dB)
+      degree_threshold -- Largest phase change between neighbours
+                          (degrees)
+      count -- Most frequencies to return
+    """
+    points = []
+    for (frequency, impedance) in zip(frequencies, impedances):
+        if not isinstance(impedance, complex):
+            impedance = complex(impedance[0], impedance[1])
+        points.append((frequency, impedance))
+    points.sort(key=lambda point: point[0])
+    candidates = []
+    for ((flow, zlow), (fhigh, zhigh)) in zip(points[:-1], points[1:]):
+        if fhigh < flow * min_refine_ratio:
+            continue
+        if abs(zlow) == 0 or abs(zhigh) == 0:
+            continue
+        dbchange = abs(20 * math.log10(abs(zhigh) / abs(zlow)))
+        # Wrap the phase change to +/- 180 degrees
+        degchange = abs(math.degrees(cmath.phase(zhigh / zlow)))
+        score = max(dbchange / db_threshold, degchange / degree_threshold)
+        if score > 1:
+            candidates.append((score, math.sqrt(flow * fhigh)))
+    candidates.sort(reverse=True)
+    return sorted(frequency for (score, frequency) in candidates[:count])
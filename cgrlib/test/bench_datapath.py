@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+
+# bench_datapath.py
+#
+# Microbenchmarks for the capture data path
+#
+# Runs without hardware.  Captures come from the scripted device in
+# fakecgr, with the command pacing delay turned off.  Each benchmark
+# is run repeat times, with enough calls per run to get a measurable
+# time, and the per-call best and median times are reported.
+#
+# Results can be written to a JSON file and compared with an earlier
+# one.  Benchmarks whose median time grew by more than the tolerance
+# are reported as regressions, and the script exits with status 1.
+#
+# Usage:
+#   python -m cgrlib.test.bench_datapath -o baseline.json
+#   (change something)
+#   python -m cgrlib.test.bench_datapath -b baseline.json
+
+import binascii # For decoding frames
+import collections # For the current rotation
+import json # For results files
+import logging
+import os # For paths
+import platform # For describing the machine
+import shutil # For removing the scratch directory
+import struct # For decoding frames
+import sys
+import tempfile # For the scratch directory
+import time # For timing
+import argparse
+
+import numpy
+
+# Create the application logger before importing cgrlib, so the cgrlib
+# module loggers are its children.  Benchmarks shouldn't print log
+# messages.
+logger = logging.getLogger('root')
+logger.addHandler(logging.NullHandler())
+
+from cgrlib import utils
+from cgrlib import lockin
+from cgrlib import stats
+from cgrlib import fitting
+from cgrlib import writers
+from cgrlib.test import fakecgr
+from cgrlib.tools import cgr_imp
+
+# Global variables
+min_run_time = 0.05 # Seconds each timed run should take at least
+
+
+# ------------------------- Benchmark setup ---------------------------
+#
+# Each setup function takes the scratch directory and returns a
+# function of no arguments to time.  If you want to add another
+# benchmark, write a setup function and add it to benchmarks.
+
+def get_test_frame(lastpoint=300):
+    """Return (hex data, lastpoint) for one capture as utils sees it"""
+    codes = fakecgr.get_sine_codes(0)
+    retdata = fakecgr.get_frame(codes, lastpoint)
+    return (binascii.hexlify(retdata)[2:], lastpoint)
+
+
+def setup_decode_int_loop(workdir):
+    """The current decoder: int() on every 4-character slice"""
+    (hexdata, lastpoint) = get_test_frame()
+    return lambda: utils.get_frame_data(hexdata, lastpoint)
+
+
+def setup_decode_struct(workdir):
+    """Alternative decoder: unhexlify once, then struct.unpack"""
+    (hexdata, lastpoint) = get_test_frame()
+    def decode():
+        bothdata = struct.unpack('>2048H', binascii.unhexlify(hexdata))
+        adecdata = collections.deque(bothdata[0::2])
+        adecdata.rotate(1024-lastpoint)
+        bdecdata = collections.deque(bothdata[1::2])
+        bdecdata.rotate(1024-lastpoint)
+        return [list(adecdata),list(bdecdata)]
+    return decode
+
+
+def setup_decode_numpy(workdir):
+    """Alternative decoder: unhexlify once, then numpy.frombuffer"""
+    (hexdata, lastpoint) = get_test_frame()
+    def decode():
+        words = numpy.frombuffer(binascii.unhexlify(hexdata), dtype='>u2')
+        return numpy.roll(words.reshape(1024, 2).T, 1024-lastpoint, axis=1)
+    return decode
+
+
+def setup_rotate_deque(workdir):
+    """The current rotation: a deque per channel"""
+    bothdata = list(range(2048))
+    def rotate():
+        adecdata = collections.deque(bothdata[0::2])
+        adecdata.rotate(724)
+        bdecdata = collections.deque(bothdata[1::2])
+        bdecdata.rotate(724)
+        return [list(adecdata),list(bdecdata)]
+    return rotate
+
+
+def setup_rotate_numpy(workdir):
+    """Alternative rotation: numpy.roll on a 2 x 1024 array"""
+    bothdata = numpy.arange(2048)
+    return lambda: numpy.roll(bothdata.reshape(1024, 2).T, 724, axis=1)
+
+
+def setup_forced_capture(workdir):
+    """utils.get_uncal_forced_data against the fake device"""
+    cgr = fakecgr.FakeCGR()
+    return lambda: utils.get_uncal_forced_data(cgr, 0)
+
+
+def setup_cal_data(workdir):
+    """utils.get_cal_data on one capture"""
+    rawdata = fakecgr.get_sine_codes(0).tolist()
+    caldict = dict(utils.caldict_default)
+    return lambda: utils.get_cal_data(caldict, [0, 0], rawdata)
+
+
+def setup_averaging(workdir):
+    """Running average of 8 captures, as the capture loops do it"""
+    captures = [fakecgr.get_sine_codes(number).tolist()
+                for number in range(8)]
+    def average():
+        for capturenum in range(len(captures)):
+            if capturenum == 0:
+                sumdata = captures[0]
+            else:
+                sumdata = numpy.add(sumdata, captures[capturenum])
+            avgdata = numpy.divide(sumdata, float(capturenum + 1))
+        return avgdata
+    return average
+
+
+def setup_phasor_averaging(workdir):
+    """Phasor average of the same 8 captures, as cgr-imp does it"""
+    captures = [fakecgr.get_sine_codes(number).tolist()
+                for number in range(8)]
+    rate = 100000.0
+    frequency = 1000.0
+    (tones, noise) = lockin.get_bins(frequency, rate, 3)
+    binfreqs = tones + noise
+    def average():
+        phasorstats = stats.RunningStats()
+        binstats = stats.RunningStats()
+        for capture in captures:
+            codes = numpy.asarray(capture, dtype=float)
+            phasors = lockin.demodulate(frequency, rate, codes)
+            reference = numpy.angle(phasors[0])
+            phasorstats.add(phasors * numpy.exp(-1j * reference))
+            bins = lockin.demodulate_bins(binfreqs, rate, codes)
+            binstats.add(lockin.shift_phasors(frequency, binfreqs, bins,
+                                              -reference))
+        return (phasorstats.mean, binstats.mean)
+    return average
+
+
+def setup_fit(workdir):
+    """fitting.fit of a Randles cell to a 40-point sweep"""
+    frequencies = numpy.logspace(1, 5, 40)
+    impedances = fitting.models['randles'].impedance(
+        numpy.array([20.0, 500.0, 1e-6, 30.0]), 2 * numpy.pi * frequencies)
+    return lambda: fitting.fit('randles', frequencies, impedances)
+
+
+def get_imp_inputs():
+    """Return (frequency, timedata, voltdata) for the impedance code"""
+    rate = 100000.0
+    frequency = 1000.0
+    timedata = utils.get_timelist(rate)
+    codes = fakecgr.get_sine_codes(0, frequency=frequency / rate)
+    voltdata = utils.get_cal_data(dict(utils.caldict_default), [0, 0],
+                                  codes.tolist())
+    return (frequency, timedata, voltdata)
+
+
+def setup_sine_vectors(workdir):
+    """cgr_imp.get_sine_vectors on one capture"""
+    (frequency, timedata, voltdata) = get_imp_inputs()
+    return lambda: cgr_imp.get_sine_vectors(frequency, timedata, voltdata)
+
+
+def setup_z_vector(workdir):
+    """cgr_imp.get_z_vector on one capture"""
+    (frequency, timedata, voltdata) = get_imp_inputs()
+    config = {'Impedance': {'resistor': '1000'},
+              'Calibration': {'Rshort': '0'}}
+    return lambda: cgr_imp.get_z_vector(config, frequency, timedata,
+                                        voltdata)
+
+
+def setup_analyze(workdir):
+    """lockin.analyze on one capture, with 3 harmonics"""
+    (frequency, timedata, voltdata) = get_imp_inputs()
+    rate = cgr_imp.get_timelist_rate(timedata)
+    return lambda: lockin.analyze(frequency, rate, voltdata, 3)
+
+
+def get_setup_savedata(fmt):
+    """Return a setup function for writing one capture in a format
+
+    Arguments:
+      fmt -- Output format (see writers.formats)
+    """
+    def setup(workdir):
+        (frequency, timedata, voltdata) = get_imp_inputs()
+        rawdata = fakecgr.get_sine_codes(0)
+        metadata = {'rate': 100000.0, 'averages': 1,
+                    'timestamp': time.time(), 'gain': [0, 0]}
+        filename = os.path.join(workdir, 'capture.' + writers.extensions[fmt])
+        return lambda: writers.write_data(filename, fmt, timedata, voltdata,
+                                          rawdata, metadata)
+    setup.__doc__ = 'writers.write_data in the ' + fmt + ' format'
+    return setup
+
+
+benchmarks = collections.OrderedDict([
+    ('decode_int_loop', setup_decode_int_loop),
+    ('decode_struct', setup_decode_struct),
+    ('decode_numpy', setup_decode_numpy),
+    ('rotate_deque', setup_rotate_deque),
+    ('rotate_numpy', setup_rotate_numpy),
+    ('forced_capture', setup_forced_capture),
+    ('cal_data', setup_cal_data),
+    ('averaging', setup_averaging),
+    ('phasor_averaging', setup_phasor_averaging),
+    ('sine_vectors', setup_sine_vectors),
+    ('z_vector', setup_z_vector),
+    ('analyze', setup_analyze),
+    ('fit', setup_fit)
+])
+for fmt in sorted(writers.formats):
+    benchmarks['savedata_' + fmt] = get_setup_savedata(fmt)
+
+# --------------------- Done with benchmark setup ---------------------
+
+
+def time_function(function, repeat):
+    """Return {'best', 'median', 'loops', 'repeat'} in seconds per call
+
+    Arguments:
+      function -- Function of no arguments to time
+      repeat -- Number of timed runs
+    """
+    loops = 1
+    while True:
+        start = time.time()
+        for loop in range(loops):
+            function()
+        elapsed = time.time() - start
+        if elapsed >= min_run_time:
+            break
+        loops *= 2
+    runs = [elapsed / loops]
+    for run in range(repeat - 1):
+        start = time.time()
+        for loop in range(loops):
+            function()
+        runs.append((time.time() - start) / loops)
+    runs.sort()
+    return {'best': runs[0],
+            'median': runs[len(runs) // 2],
+            'loops': loops,
+            'repeat': repeat}
+
+
+def compare(results, baseline, tolerance):
+    """Add baseline comparisons to results and return regressed names
+
+    Each result gets 'baseline' (the baseline median), 'ratio' (median
+    / baseline median) and 'status': 'slower', 'faster' or 'same'.
+
+    Arguments:
+      results -- {benchmark name : timing dictionary}
+      baseline -- Results dictionary loaded from a baseline file
+      tolerance -- Fractional change allowed before a result is
+                   reported as slower or faster
+    """
+    regressions = []
+    for name in results:
+        if not name in baseline['results']:
+            continue
+        reference = baseline['results'][name]['median']
+        ratio = results[name]['median'] / reference
+        if ratio > 1 + tolerance:
+            status = 'slower'
+            regressions.append(name)
+        elif ratio < 1 / (1 + tolerance):
+            status = 'faster'
+        else:
+            status = 'same'
+        results[name].update({'baseline': reference, 'ratio': ratio,
+                              'status': status})
+    return regressions
+
+
+def format_result(name, result):
+    line = '{:<18} {:>12.1f} {:>12.1f}'.format(
+        name, result['best'] * 1e6, result['median'] * 1e6)
+    if 'ratio' in result:
+        line += '  {:>6.2f}x  {}'.format(result['ratio'], result['status'])
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-o", "--output", default=None,
+                        help="Write results to this JSON file"
+    )
+    parser.add_argument("-b", "--baseline", default=None,
+                        help="Compare with results from this JSON file"
+    )
+    parser.add_argument("-t", "--tolerance", type=float, default=0.2,
+                        help="Fractional slowdown reported as a regression"
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="Timed runs per benchmark"
+    )
+    parser.add_argument("-k", "--select", default=None,
+                        help="Only run benchmarks with this in their name"
+    )
+    args = parser.parse_args(argv)
+    utils.cmddelay = 0 # Drive the fake device at full speed
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fin:
+            baseline = json.load(fin)
+    workdir = tempfile.mkdtemp(prefix='cgrbench')
+    results = collections.OrderedDict()
+    try:
+        for name in benchmarks:
+            if args.select and not args.select in name:
+                continue
+            function = benchmarks[name](workdir)
+            results[name] = time_function(function, args.repeat)
+    finally:
+        shutil.rmtree(workdir)
+    regressions = []
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+    sys.stdout.write('{:<18} {:>12} {:>12}\n'.format(
+        'benchmark', 'best (us)', 'median (us)'))
+    for name in results:
+        sys.stdout.write(format_result(name, results[name]) + '\n')
+    if args.output:
+        report = {'timestamp': time.time(),
+                  'python': platform.python_version(),
+                  'numpy': numpy.__version__,
+                  'machine': platform.platform(),
+                  'results': results}
+        with writers.atomic_open(args.output, 'w') as fout:
+            json.dump(report, fout, indent=2)
+    if regressions:
+        sys.stdout.write('Regressions: ' + ', '.join(regressions) + '\n')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
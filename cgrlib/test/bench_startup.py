@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+# bench_startup.py
+#
+# Startup time benchmark for the cgrlib command-line tools
+#
+# Every console script listed in setup.py is started in a fresh
+# interpreter, inside a scratch directory so configuration and log
+# files don't land in the working tree.  Three times are reported for
+# each entry point:
+#
+#   import -- Importing the tool's module, measured inside the child
+#   help -- Wall time of running the tool with --help
+#   first -- Wall time until the tool is ready to send its first
+#            command.  Tools that talk to the CGR-101 are stopped when
+#            they call utils.get_cgr().  Offline tools are run to
+#            completion against an empty capture archive.
+#
+# The numpy column shows whether --help had to import numpy.
+#
+# Usage: python -m cgrlib.test.bench_startup [-n repeats]
+
+import os # For paths
+import re # For reading entry points out of setup.py
+import shutil # For removing the scratch directory
+import subprocess # For running each tool in a fresh interpreter
+import sys
+import tempfile # For the scratch directory
+import logging # For quieting the archive module
+import time # For wall times
+import argparse
+
+# Code run in the child interpreter.  It prints one line per
+# measurement, like 'import 0.123'.
+child_code = '''
+import os, sys, time
+start = time.time()
+from cgrlib import utils
+def first_command(config):
+    sys.stdout.write('first %f\\n' % (time.time() - start))
+    sys.stdout.flush()
+    os._exit(0)
+utils.get_cgr = first_command
+import importlib
+module = importlib.import_module(sys.argv[1])
+sys.stdout.write('import %f\\n' % (time.time() - start))
+sys.stdout.flush()
+try:
+    getattr(module, sys.argv[2])(sys.argv[3:])
+finally:
+    sys.stdout.write('numpy %d\\n' % ('numpy' in sys.modules))
+    sys.stdout.flush()
+'''
+
+
+def get_entry_points(setupfile):
+    """Return [(script name, module, function), ...] from setup.py
+
+    Arguments:
+      setupfile -- Path to setup.py
+    """
+    entry_points = []
+    with open(setupfile) as fin:
+        text = fin.read()
+    for match in re.finditer(r"'([\w-]+)\s*=\s*([\w.]+):(\w+)'", text):
+        entry_points.append(match.groups())
+    return entry_points
+
+
+def get_first_argv(module, archivedir):
+    """Return the arguments used to time a tool's first command
+
+    Arguments:
+      module -- Module name of the tool
+      archivedir -- Empty capture archive for the offline tools
+    """
+    if module.endswith('_export'):
+        return [archivedir]
+    elif module.endswith('_query'):
+        return [archivedir, '--bucket', '60']
+    return []
+
+
+def run_child(python, module, function, argv, workdir, env):
+    """Run one entry point and return (wall time, {measurement : value})
+
+    Arguments:
+      python -- Python interpreter to use
+      module -- Module name of the tool
+      function -- Entry point function name
+      argv -- Command-line arguments for the tool
+      workdir -- Directory to run in
+      env -- Environment for the child
+    """
+    start = time.time()
+    process = subprocess.Popen(
+        [python, '-c', child_code, module, function] + argv,
+        cwd=workdir, env=env, stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    (out, err) = process.communicate(''.encode('ascii'))
+    wall = time.time() - start
+    results = {}
+    for line in out.decode('ascii', 'replace').splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[0] in ('import', 'first', 'numpy'):
+            results[fields[0]] = float(fields[1])
+    return (wall, results)
+
+
+def median(values):
+    """Return the median of a list of numbers"""
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+def bench_entry_point(python, module, function, workdir, env, repeats):
+    """Return the median import, help and first-command times
+
+    Arguments:
+      python -- Python interpreter to use
+      module -- Module name of the tool
+      function -- Entry point function name
+      workdir -- Scratch directory to run in
+      env -- Environment for the child
+      repeats -- Number of runs to take the median of
+    """
+    argv = get_first_argv(module, os.path.join(workdir, 'archive'))
+    imports = []
+    helps = []
+    firsts = []
+    numpy_loaded = False
+    for run in range(repeats):
+        (wall, results) = run_child(python, module, function, ['--help'],
+                                    workdir, env)
+        helps.append(wall)
+        if 'import' in results:
+            imports.append(results['import'])
+        numpy_loaded = numpy_loaded or bool(results.get('numpy'))
+        (wall, results) = run_child(python, module, function, argv,
+                                    workdir, env)
+        firsts.append(wall)
+    return {'import': median(imports) if imports else None,
+            'help': median(helps),
+            'first': median(firsts),
+            'numpy': numpy_loaded}
+
+
+def format_seconds(value):
+    if value is None:
+        return '     -'
+    return '{:6.3f}'.format(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-n", "--repeat", type=int, default=5,
+                        help="Runs per entry point (the median is reported)"
+    )
+    parser.add_argument("-p", "--python", default=sys.executable,
+                        help="Python interpreter to start the tools with"
+    )
+    args = parser.parse_args(argv)
+    logging.getLogger('root').addHandler(logging.NullHandler())
+    topdir = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    entry_points = get_entry_points(os.path.join(topdir, 'setup.py'))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [topdir] + [path for path in
+                    env.get('PYTHONPATH', '').split(os.pathsep) if path]
+    )
+    workdir = tempfile.mkdtemp(prefix='cgrbench')
+    try:
+        from cgrlib import archive
+        archive.init_archive(os.path.join(workdir, 'archive'))
+        sys.stdout.write('{:<12} {:>6} {:>6} {:>6}  {}\n'.format(
+            'entry point', 'import', 'help', 'first', 'numpy'))
+        for (name, module, function) in entry_points:
+            times = bench_entry_point(args.python, module, function,
+                                      workdir, env, args.repeat)
+            sys.stdout.write('{:<12} {} {} {}  {}\n'.format(
+                name, format_seconds(times['import']),
+                format_seconds(times['help']),
+                format_seconds(times['first']),
+                'yes' if times['numpy'] else 'no'))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+# fakecgr.py
+#
+# A scripted stand-in for a CGR-101 on a serial port
+#
+# FakeCGR has the parts of serial.Serial that cgrlib.utils uses (open,
+# close, read, write) and answers commands the way the unit does:
+#
+#   i -- Identity string
+#   S G -- Arm.  A triggered capture answers with 'A' and the 2-byte
+#          address of the last sample once the trigger arrives.
+#   S D 5 -- Force a trigger
+#   S B -- One header byte and 4096 bytes of interleaved channel A and
+#          B samples (16-bit big-endian words)
+#   S O -- 'O' and the four eeprom offset bytes
+#   S F a b c d -- Write the eeprom offsets
+#
+# Other commands are accepted and ignored.  Set utils.cmddelay to 0 to
+# drive the fake device at full speed.
+
+import collections # For the command history
+
+import numpy
+
+# Global variables
+identity = 'Syscomp CGR-101'
+
+
+def get_sine_codes(capturenum, frequency=0.01, amplitude=200, noise=2.0,
+                   seed=None):
+    """Return a 2 x 1024 array of ADC codes: a sine wave on channel A
+    and the same wave shifted by 90 degrees on channel B.
+
+    Arguments:
+      capturenum -- Capture number, used to pick the noise
+      frequency -- Cycles per sample
+      amplitude -- Peak amplitude in codes
+      noise -- Standard deviation of the added noise in codes
+      seed -- Noise seed.  None uses the capture number.
+    """
+    if seed is None:
+        seed = capturenum
+    generator = numpy.random.RandomState(seed)
+    phase = 2 * numpy.pi * frequency * numpy.arange(1024)
+    codes = numpy.empty((2, 1024))
+    codes[0] = 511 + amplitude * numpy.sin(phase)
+    codes[1] = 511 + amplitude * numpy.cos(phase)
+    codes += generator.normal(0, noise, codes.shape)
+    return numpy.clip(numpy.round(codes), 0, 1023).astype(int)
+
+
+def get_frame(codes, lastpoint=0):
+    """Return an 'S B' reply holding the given samples.
+
+    The unit returns its ring buffer as it is, so the samples are
+    rotated the opposite way utils.get_frame_data rotates them back.
+
+    Arguments:
+      codes -- 2 x 1024 array of ADC codes
+      lastpoint -- Address of the last captured sample
+    """
+    ring = numpy.roll(numpy.asarray(codes), lastpoint - 1024, axis=1)
+    words = numpy.empty(2048, dtype='>u2')
+    words[0::2] = ring[0]
+    words[1::2] = ring[1]
+    return 'B' + words.tostring()
+
+
+class FakeCGR(object):
+    """A scripted CGR-101.
+
+    Arguments:
+      codes_function -- Called with the capture number to get a 2 x
+                        1024 array of ADC codes (default get_sine_codes)
+      trigger_reads -- Empty reads before a triggered capture answers.
+                       Each one looks like a serial timeout.
+      short_every -- Return a short 'S B' reply every this many
+                     captures.  0 never does.
+      eeprom -- The four eeprom offset bytes
+    """
+    def __init__(self, codes_function=None, trigger_reads=0, short_every=0,
+                 eeprom=(0, 0, 0, 0)):
+        if codes_function is None:
+            codes_function = get_sine_codes
+        self.codes_function = codes_function
+        self.trigger_reads = trigger_reads
+        self.short_every = short_every
+        self.eeprom = list(eeprom)
+        self.port = 'fake'
+        self.baudrate = 230400
+        self.timeout = 0.1
+        self.is_open = False
+        self.outbuffer = '' # Bytes waiting to be read
+        self.inbuffer = '' # Partial command
+        self.waiting_reads = 0 # Empty reads left before a trigger
+        self.armed = False
+        self.forced = False
+        self.lastpoint = 0
+        self.captures = 0 # Captures sent
+        self.commands = collections.deque(maxlen=100) # Recent commands
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def isOpen(self):
+        return self.is_open
+
+    def write(self, data):
+        """Receive commands.  Returns the number of bytes written."""
+        self.bytes_written += len(data)
+        self.inbuffer += data
+        while '\n' in self.inbuffer:
+            (line, self.inbuffer) = self.inbuffer.split('\n', 1)
+            self.command(line.strip())
+        return len(data)
+
+    def read(self, size=1):
+        """Return up to size bytes of the unit's replies"""
+        if self.armed and not self.forced:
+            if self.waiting_reads > 0:
+                self.waiting_reads -= 1
+                return ''
+            # The trigger arrived
+            self.armed = False
+            self.lastpoint = (self.captures * 37) % 1024
+            self.outbuffer += ('A' + chr(self.lastpoint >> 8) +
+                               chr(self.lastpoint & 0xff))
+        data = self.outbuffer[:size]
+        self.outbuffer = self.outbuffer[size:]
+        self.bytes_read += len(data)
+        return data
+
+    def command(self, cmd):
+        """Act on one command
+
+        Arguments:
+          cmd -- Command without its terminator
+        """
+        self.commands.append(cmd)
+        if cmd == 'i':
+            self.outbuffer += identity
+        elif cmd == 'S G':
+            self.armed = True
+            self.forced = False
+            self.waiting_reads = self.trigger_reads
+        elif cmd == 'S D 5':
+            self.forced = True
+            self.armed = False
+            self.lastpoint = 0
+        elif cmd == 'S B':
+            codes = self.codes_function(self.captures)
+            frame = get_frame(codes, self.lastpoint)
+            self.captures += 1
+            if self.short_every and self.captures % self.short_every == 0:
+                frame = frame[:len(frame) // 2]
+            self.outbuffer += frame
+        elif cmd == 'S O':
+            self.outbuffer += 'O' + ''.join(chr(value) for value in
+                                            self.eeprom)
+        elif cmd.startswith('S F '):
+            self.eeprom = [int(value) for value in cmd.split()[2:6]]
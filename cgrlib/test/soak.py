@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+
+# soak.py
+#
+# Soak test for long acquisitions
+#
+# Runs the capture -> calibrate -> average -> save path against the
+# scripted device in fakecgr for a long time, with logging going
+# through the same queued handlers the tools use.  Every interval
+# seconds it samples:
+#
+#   rss -- Resident memory of the process
+#   objects -- Top allocators from tracemalloc (Python 3.4 and later),
+#              or counts of live objects by type from the gc module
+#   latency -- Percentiles of the per-capture time in the interval
+#
+# At the end it fits a line to the memory and latency samples taken
+# after the warm-up, and flags the run if either grows by more than
+# the allowed amount over the run.  The report is written as JSON and
+# the script exits with status 1 if anything was flagged.
+#
+# Usage: python -m cgrlib.test.soak -d 14400 -o soak.json
+
+import gc # For object counts
+import json # For the report
+import logging
+import os # For paths
+import resource # For peak memory where /proc isn't available
+import shutil # For removing the scratch directory
+import sys
+import tempfile # For the scratch directory
+import time # For timing
+import argparse
+
+try:
+    import tracemalloc # Python 3.4 and later
+except ImportError:
+    tracemalloc = None
+
+import numpy
+
+# Create the application logger before importing cgrlib, so the cgrlib
+# module loggers are its children.
+logger = logging.getLogger('root')
+
+from cgrlib import utils
+from cgrlib import logutils
+from cgrlib import writers
+from cgrlib.test import fakecgr
+from cgrlib.tools import cgr_imp
+
+# Global variables
+top_count = 10 # Allocators or object types listed in each sample
+
+
+def get_rss():
+    """Return the resident memory of this process in bytes.
+
+    Reads /proc on Linux.  Elsewhere, returns the peak resident memory,
+    which still shows growth.
+    """
+    try:
+        with open('/proc/self/status') as fin:
+            for line in fin:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak # Already in bytes
+    return peak * 1024
+
+
+def get_type_counts():
+    """Return {type name : number of live objects} from the gc module"""
+    counts = {}
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def get_object_sample(first):
+    """Return the largest allocation changes since the first sample.
+
+    Returns (sample, first).  Pass the returned first back in on the
+    next call.
+
+    Arguments:
+      first -- tracemalloc snapshot or type counts from the first
+               sample, or None when taking the first sample
+    """
+    if tracemalloc is not None:
+        snapshot = tracemalloc.take_snapshot()
+        if first is None:
+            first = snapshot
+        sample = []
+        for stat in snapshot.compare_to(first, 'lineno')[:top_count]:
+            frame = stat.traceback[0]
+            sample.append({'where': frame.filename + ':' + str(frame.lineno),
+                           'size': stat.size, 'growth': stat.size_diff,
+                           'count': stat.count})
+        return (sample, first)
+    counts = get_type_counts()
+    if first is None:
+        first = counts
+    growth = []
+    for name in counts:
+        growth.append((counts[name] - first.get(name, 0), name))
+    growth.sort(reverse=True)
+    sample = []
+    for (change, name) in growth[:top_count]:
+        sample.append({'type': name, 'count': counts[name],
+                       'growth': change})
+    return (sample, first)
+
+
+def get_percentiles(values):
+    """Return {'count', 'p50', 'p95', 'p99', 'max'} of a list of values"""
+    if not values:
+        return {'count': 0}
+    ordered = numpy.sort(values)
+    summary = {'count': len(ordered), 'max': float(ordered[-1])}
+    for percent in [50, 95, 99]:
+        summary['p' + str(percent)] = float(
+            numpy.percentile(ordered, percent))
+    return summary
+
+
+def get_trend(times, values):
+    """Return (slope per second, fitted first value) of a least-squares
+    line, or None with fewer than three samples
+
+    Arguments:
+      times -- Sample times in seconds
+      values -- Sample values
+    """
+    if len(times) < 3:
+        return None
+    (slope, intercept) = numpy.polyfit(times, values, 1)
+    return (float(slope), float(intercept + slope * times[0]))
+
+
+def check_growth(name, times, values, allowed):
+    """Return a flag message if a fitted line grows by more than allowed
+
+    The growth is the rise of the fitted line over the samples, as a
+    fraction of its starting value.
+
+    Arguments:
+      name -- What was measured, for the message
+      times -- Sample times in seconds
+      values -- Sample values
+      allowed -- Largest acceptable fractional growth
+    """
+    trend = get_trend(times, values)
+    if trend is None:
+        return None
+    (slope, start) = trend
+    if start <= 0:
+        return None
+    growth = slope * (times[-1] - times[0]) / start
+    if growth > allowed:
+        return (name + ' grew ' + '{:0.1f}'.format(growth * 100) +
+                '% over the run (' + '{:0.3g}'.format(slope * 3600) +
+                ' per hour)')
+    return None
+
+
+def run_capture(cgr, caldict, averages, timedata, filename, fmt,
+                impedance_config):
+    """Run one averaged capture through the tool data path
+
+    Arguments:
+      cgr -- fakecgr.FakeCGR
+      caldict -- Calibration dictionary
+      averages -- Captures per average
+      timedata -- List of sample times
+      filename -- Output file name
+      fmt -- Output format (see writers.formats)
+      impedance_config -- Configuration for cgr_imp.get_z_vector, or
+                          None to skip the impedance calculation
+    """
+    for capturenum in range(averages):
+        tracedata = utils.get_uncal_forced_data(cgr, 0)
+        logger.info('Acquiring trace %d of %d', capturenum + 1, averages)
+        if capturenum == 0:
+            sumdata = tracedata
+        else:
+            sumdata = numpy.add(sumdata, tracedata)
+        avgdata = numpy.divide(sumdata, float(capturenum + 1))
+        voltdata = utils.get_cal_data(caldict, [0, 0],
+                                      [avgdata[0], avgdata[1]])
+    if impedance_config is not None:
+        impedance = cgr_imp.get_z_vector(impedance_config, 1000.0,
+                                         timedata, voltdata)
+        logger.debug('Impedance magnitude is %0.3f Ohms',
+                      cgr_imp.vector_length(impedance))
+    metadata = {'rate': 100000.0, 'averages': averages,
+                'timestamp': time.time(), 'gain': [0, 0]}
+    writers.write_data(filename, fmt, timedata, voltdata, avgdata, metadata)
+
+
+def get_report(samples, warmup, memory_growth, latency_growth):
+    """Return the report dictionary with its flags
+
+    Arguments:
+      samples -- List of sample dictionaries
+      warmup -- Seconds of samples left out of the trend fits
+      memory_growth -- Largest acceptable fractional RSS growth
+      latency_growth -- Largest acceptable fractional p95 growth
+    """
+    settled = [sample for sample in samples
+               if sample['elapsed'] >= warmup and
+               sample['latency']['count'] > 0]
+    times = [sample['elapsed'] for sample in settled]
+    flags = []
+    trends = {}
+    checks = [('rss', [sample['rss'] for sample in settled],
+               memory_growth, 'Resident memory'),
+              ('latency_p95', [sample['latency']['p95']
+                               for sample in settled],
+               latency_growth, 'Capture latency (p95)')]
+    for (key, values, allowed, label) in checks:
+        trend = get_trend(times, values)
+        if trend is not None:
+            trends[key] = {'slope_per_hour': trend[0] * 3600,
+                           'start': trend[1]}
+        flag = check_growth(label, times, values, allowed)
+        if flag:
+            flags.append(flag)
+    if samples and tracemalloc is None:
+        # Object types that grew in every settled sample
+        growing = None
+        for sample in settled:
+            names = set(entry['type'] for entry in sample['objects']
+                        if entry['growth'] > 0)
+            growing = names if growing is None else growing & names
+        for name in sorted(growing or []):
+            counts = [entry['count'] for sample in settled
+                      for entry in sample['objects'] if entry['type'] == name]
+            if len(counts) == len(settled) and counts == sorted(counts) \
+               and counts[-1] > counts[0]:
+                flags.append('Live ' + name + ' objects kept growing (' +
+                             str(counts[0]) + ' to ' + str(counts[-1]) + ')')
+    return {'timestamp': time.time(),
+            'python': sys.version.split()[0],
+            'object_tracking': 'tracemalloc' if tracemalloc else 'gc',
+            'samples': samples,
+            'trends': trends,
+            'flags': flags}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-d", "--duration", type=float, default=3600,
+                        help="Seconds to run"
+    )
+    parser.add_argument("-i", "--interval", type=float, default=60,
+                        help="Seconds between samples"
+    )
+    parser.add_argument("-w", "--warmup", type=float, default=None,
+                        help="Seconds left out of the trend fits " +
+                        "(default: two intervals)"
+    )
+    parser.add_argument("-a", "--averages", type=int, default=4,
+                        help="Captures per average"
+    )
+    parser.add_argument("-f", "--format", default="text",
+                        choices=sorted(writers.formats),
+                        help="Output file format"
+    )
+    parser.add_argument("--impedance", action="store_true",
+                        help="Also calculate an impedance for every average"
+    )
+    parser.add_argument("--memory-growth", type=float, default=0.1,
+                        help="Flag resident memory growing by more than " +
+                        "this fraction"
+    )
+    parser.add_argument("--latency-growth", type=float, default=0.2,
+                        help="Flag p95 capture latency growing by more " +
+                        "than this fraction"
+    )
+    parser.add_argument("-o", "--output", default="soak.json",
+                        help="JSON report file"
+    )
+    args = parser.parse_args(argv)
+    if args.warmup is None:
+        args.warmup = 2 * args.interval
+    workdir = tempfile.mkdtemp(prefix='cgrsoak')
+    (ch, fh) = logutils.init_logging(os.path.join(workdir, 'cgrlog.log'))
+    ch.setLevel(logging.WARNING)
+    utils.cmddelay = 0 # Drive the fake device at full speed
+    if tracemalloc is not None:
+        tracemalloc.start()
+    cgr = fakecgr.FakeCGR()
+    caldict = dict(utils.caldict_default)
+    timedata = utils.get_timelist(100000.0)
+    filename = os.path.join(workdir, 'capture.' +
+                            writers.extensions[args.format])
+    if args.impedance:
+        impedance_config = {'Impedance': {'resistor': '1000'},
+                            'Calibration': {'Rshort': '0'}}
+    else:
+        impedance_config = None
+    samples = []
+    first_objects = None
+    latencies = []
+    captures = 0
+    start = time.time()
+    nextsample = start
+    try:
+        while True:
+            now = time.time()
+            if now >= nextsample:
+                (objects, first_objects) = get_object_sample(first_objects)
+                samples.append({'elapsed': now - start,
+                                'captures': captures,
+                                'rss': get_rss(),
+                                'latency': get_percentiles(latencies),
+                                'objects': objects})
+                sys.stdout.write('{:8.0f} s {:8d} captures {:8.1f} MB\n'.format(
+                    now - start, captures, samples[-1]['rss'] / 1e6))
+                sys.stdout.flush()
+                latencies = []
+                nextsample += args.interval
+                if now - start >= args.duration:
+                    break
+            capturestart = time.time()
+            run_capture(cgr, caldict, args.averages, timedata, filename,
+                        args.format, impedance_config)
+            latencies.append(time.time() - capturestart)
+            captures += 1
+    finally:
+        logutils.stop_logging()
+        shutil.rmtree(workdir)
+    report = get_report(samples, args.warmup, args.memory_growth,
+                        args.latency_growth)
+    with writers.atomic_open(args.output, 'w') as fout:
+        json.dump(report, fout, indent=2)
+    for flag in report['flags']:
+        sys.stdout.write('FLAG: ' + flag + '\n')
+    if report['flags']:
+        sys.exit(1)
+    sys.stdout.write('No growth trends found\n')
+
+
+if __name__ == '__main__':
+    main()
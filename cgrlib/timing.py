@@ -0,0 +1,196 @@
+# timing.py
+#
+# Per-phase timing for the capture path
+#
+# Wrap each phase of a capture in a timer:
+#
+#   with timing.phase('transfer'):
+#       retdata = handle.read(5000)
+#
+# Timers do nothing until enable() is called, so they can stay in the
+# code permanently.  When enabled, every phase keeps its count, total
+# and maximum time, plus a sample of durations for percentiles.
+# Phases can nest -- the time spent in an inner phase is also counted
+# in the outer one.
+
+import atexit # For dumping results at exit
+import json # For dumping results
+import logging  # The python logging module
+import math # For percentile ranks
+import random # For sampling durations
+import threading # Phases are timed from the render thread too
+import time # For the clock
+
+# create logger
+module_logger = logging.getLogger('root.timing')
+module_logger.setLevel(logging.DEBUG)
+
+# Global variables
+enabled = False # Set by enable() and disable()
+max_samples = 10000 # Durations kept per phase for percentiles
+percentiles = [50, 95, 99]
+
+# Use the best clock available.  Python 2 only has time.time().
+clock = getattr(time, 'perf_counter', time.time)
+
+phases = {} # {phase name : PhaseStats}
+phases_lock = threading.Lock()
+
+
+class PhaseStats(object):
+    """Accumulated durations for one phase.
+
+    The count, total and maximum include every duration.  Percentiles
+    come from at most max_samples durations, picked at random once
+    there are more than that (reservoir sampling).
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.samples = []
+
+    def add(self, seconds):
+        """Add one duration
+
+        Arguments:
+          seconds -- Duration of the phase
+        """
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+        if len(self.samples) < max_samples:
+            self.samples.append(seconds)
+        else:
+            index = random.randint(0, self.count - 1)
+            if index < max_samples:
+                self.samples[index] = seconds
+
+    def get_summary(self):
+        """Return a dictionary of count, total, mean, p50, p95, p99 and
+        max.  Times are in seconds.
+        """
+        summary = {'count': self.count,
+                   'total': self.total,
+                   'mean': self.total / self.count,
+                   'max': self.maximum}
+        ordered = sorted(self.samples)
+        for percent in percentiles:
+            # Nearest-rank percentile
+            rank = int(math.ceil(percent / 100.0 * len(ordered))) - 1
+            rank = max(rank, 0)
+            summary['p' + str(percent)] = ordered[rank]
+        return summary
+
+
+class PhaseTimer(object):
+    """Context manager that records how long its block took.
+
+    Arguments:
+      name -- Phase name
+    """
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.name, clock() - self.start)
+        return False
+
+
+class NullTimer(object):
+    """Context manager that does nothing.  Used when timing is off."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+null_timer = NullTimer()
+
+
+def phase(name):
+    """Return a context manager timing one phase
+
+    Arguments:
+      name -- Phase name, like 'transfer' or 'calibration'
+    """
+    if not enabled:
+        return null_timer
+    return PhaseTimer(name)
+
+
+def record(name, seconds):
+    """Add a duration measured some other way
+
+    Arguments:
+      name -- Phase name
+      seconds -- Duration of the phase
+    """
+    with phases_lock:
+        stats = phases.get(name)
+        if stats is None:
+            stats = phases[name] = PhaseStats()
+        stats.add(seconds)
+
+
+def enable():
+    """Start timing phases."""
+    global enabled
+    enabled = True
+
+
+def disable():
+    """Stop timing phases.  Results so far are kept."""
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Forget all results."""
+    with phases_lock:
+        phases.clear()
+
+
+def get_summary():
+    """Return {phase name : summary dictionary} for every timed phase
+
+    See PhaseStats.get_summary for the summary keys.
+    """
+    with phases_lock:
+        summary = {}
+        for name in phases:
+            summary[name] = phases[name].get_summary()
+    return summary
+
+
+def dump(filename):
+    """Write the phase summaries to a JSON file.
+
+    Arguments:
+      filename -- Output file name.  The file is replaced atomically.
+    """
+    from cgrlib import writers
+    results = {'timestamp': time.time(),
+               'phases': get_summary()}
+    with writers.atomic_open(filename, 'w') as fout:
+        json.dump(results, fout, indent=2, sort_keys=True)
+    module_logger.info('Wrote phase timing to %s', filename)
+
+
+def dump_at_exit(filename):
+    """Start timing and write the results when the program exits.
+
+    Arguments:
+      filename -- JSON output file name
+    """
+    enable()
+    atexit.register(dump, filename)
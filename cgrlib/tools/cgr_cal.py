@@ -10,12 +10,15 @@ import sys # For sys.exit()
 
 # -------------------- Configure argument parsing ---------------------
 import argparse
-parser = argparse.ArgumentParser(
-   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-parser.add_argument("-r", "--rcfile" , default="cgr-cal.cfg",
-                    help="Runtime configuration file"
-)
-args = parser.parse_args()
+
+def get_parser():
+    """Returns the command-line argument parser"""
+    parser = argparse.ArgumentParser(
+       formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-r", "--rcfile" , default="cgr-cal.cfg",
+                        help="Runtime configuration file"
+    )
+    return parser
 
 
 # --------------- Done with configuring argument parsing --------------
@@ -24,72 +27,42 @@ args = parser.parse_args()
 
 #------------------------- Configure logging --------------------------
 import logging
-from colorlog import ColoredFormatter
 
-# create logger
+# create logger.  The console and file handlers are attached by
+# logutils.init_logging() when main() runs, so importing this
+# module doesn't open the log file or load colorlog.
 logger = logging.getLogger('root')
-logger.setLevel(logging.DEBUG)
-
-# create console handler (ch) and set level
-# (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-
-# create file handler and set level to debug
-fh = logging.FileHandler('cgrlog.log',mode='a',encoding=None,delay=False)
-fh.setLevel(logging.DEBUG)
-
-color_formatter = ColoredFormatter(
-    '[ %(log_color)s%(levelname)-8s%(reset)s] %(message)s',
-    datefmt=None,
-    reset=True,
-    log_colors={
-        'DEBUG':    'cyan',
-        'INFO':     'green',
-        'WARNING':  'yellow',
-        'ERROR':    'red',
-        'CRITICAL': 'red',
-    }
-)
-
-plain_formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - [ %(levelname)s ] - %(message)s',
-    '%Y-%m-%d %H:%M:%S'
-)
-
-# Colored output goes to the console
-ch.setFormatter(color_formatter)
-logger.addHandler(ch)
-
-# Plain output goes to the file
-fh.setFormatter(plain_formatter)
-logger.addHandler(fh)
 
 # --------------- Done with logging configuration ---------------------
 
-# Now that logging has been set up, bring in the utility functions.
-# These will use the same logger as the root application.
+# Bring in the utility functions.  These will use the same logger
+# as the root application.
 from cgrlib import utils
+from cgrlib import logutils
+from cgrlib import lazy
 
 
 # ------------------ Configure plotting with gnuplot ------------------
 
-# For the Gnuplot module
-from numpy import * # For gnuplot.py
-import Gnuplot, Gnuplot.funcutils # For gnuplot.py
+# numpy and gnuplot.py are only imported when they're first used
+numpy = lazy.LazyModule('numpy')
+Gnuplot = lazy.LazyModule('Gnuplot')
 
-# Set the gnuplot executable
-Gnuplot.GnuplotOpts.gnuplot_command = 'gnuplot'
+def gnuplot_init():
+    """Sets the gnuplot.py options.  Call this before plotting.
+    """
+    # Set the gnuplot executable
+    Gnuplot.GnuplotOpts.gnuplot_command = 'gnuplot'
 
-# Use this option to turn off fifo if you get warnings like:
-# line 0: warning: Skipping unreadable file "/tmp/tmpakexra.gnuplot/fifo"
-Gnuplot.GnuplotOpts.prefer_fifo_data = 0
+    # Use this option to turn off fifo if you get warnings like:
+    # line 0: warning: Skipping unreadable file "/tmp/tmpakexra.gnuplot/fifo"
+    Gnuplot.GnuplotOpts.prefer_fifo_data = 0
 
-# Use temporary files instead of inline data
-Gnuplot.GnuplotOpts.prefer_inline_data = 0
+    # Use temporary files instead of inline data
+    Gnuplot.GnuplotOpts.prefer_inline_data = 0
 
-# Set the default terminal
-Gnuplot.GnuplotOpts.default_term = 'x11'
+    # Set the default terminal
+    Gnuplot.GnuplotOpts.default_term = 'x11'
 
 # ------------------ Done with gnuplot configuration ------------------
 
@@ -98,7 +71,6 @@ cmdterm = '\r\n' # Terminates each command
 
 # ------------- Configure runtime configuration file ------------------
 from configobj import ConfigObj # For writing and reading config file
-configfile = args.rcfile # The configuration file name
 
 # ---------- Done with configuring runtime configuration --------------
 
@@ -314,15 +286,15 @@ def get_offsets(handle, ctrl_reg, gainlist, caldict, config):
         )
         for capturenum in range(int(config['Acquire']['averages'])):
             tracedata = utils.get_uncal_forced_data(handle, ctrl_reg)
-            logger.info('Acquiring trace ' + str(capturenum + 1) +
-                        ' of ' + str(config['Acquire']['averages']))
+            logger.info('Acquiring trace %d of %s', capturenum + 1,
+                        config['Acquire']['averages'])
             if capturenum == 0:
                 sumdata = tracedata
             else:
-                sumdata = add(sumdata,tracedata)
-            avgdata = divide(sumdata,float(capturenum +1))
+                sumdata = numpy.add(sumdata,tracedata)
+            avgdata = numpy.divide(sumdata,float(capturenum +1))
         for channel in range(2):
-            offset_list.append(511 - average(avgdata[channel]))
+            offset_list.append(511 - numpy.average(avgdata[channel]))
         # Measured offsets need to be with offmax of zero, otherwise
         # there's something wrong with the measurement.
         offmax = 20
@@ -431,18 +403,18 @@ def get_slopes(handle, ctrl_reg, gainlist, caldict, config):
         )
         for capturenum in range(int(config['Acquire']['averages'])):
             tracedata = utils.get_uncal_forced_data(handle, ctrl_reg)
-            logger.info('Acquiring trace ' + str(capturenum + 1) +
-                        ' of ' + str(config['Acquire']['averages']))
+            logger.info('Acquiring trace %d of %s', capturenum + 1,
+                        config['Acquire']['averages'])
             if capturenum == 0:
                 sumdata = tracedata
             else:
-                sumdata = add(sumdata,tracedata)
-            avgdata = divide(sumdata,float(capturenum +1))
+                sumdata = numpy.add(sumdata,tracedata)
+            avgdata = numpy.divide(sumdata,float(capturenum +1))
         offcal_data = get_offcal_data(caldict,gainlist,avgdata)
         # Measured slope needs to be within 5 of 45 mV/count
         slopemax = 0.005
         for channel in range(2):
-            slope_list.append(calvolt/(average(offcal_data[channel])))
+            slope_list.append(calvolt/(numpy.average(offcal_data[channel])))
         if gainlist[0] == 0: # Channel A set for 1x gain
             if ((slope_list[0] > (0.045 - slopemax)) and
                 (slope_list[0] < (0.045 + slopemax))):
@@ -532,6 +504,7 @@ def init_logger(config,conhandler,filehandler):
 def plotinit():
     """ Returns the configured gnuplot plot object.
     """
+    gnuplot_init()
     # Set debug=1 to see gnuplot commands during execution.
     plotobj = Gnuplot.Gnuplot(debug=0)
     plotobj('set terminal x11') # Send a gnuplot command
@@ -577,12 +550,11 @@ def plotdata(plotobj, timedata, voltdata, trigdict):
 
 
 # ------------------------- Main procedure ----------------------------
-def main():
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    (ch,fh) = logutils.init_logging('cgrlog.log')
     logger.debug('Utility module number is ' + str(utils.utilnum))
     config = load_config(args.rcfile)
-    global ch,fh # Need to modify console and file logger handlers
-                 # with the config file, from inside main().  They
-                 # thus must be made global.
     (ch,fh) = init_logger(config,ch,fh)
     # Trigger is hard coded to internal (auto trigger) for the
     # calibration code.
@@ -8,20 +8,50 @@ import time     # For making pauses
 import os       # For basic file I/O
 import ConfigParser # For reading and writing the configuration file
 import sys # For sys.exit()
+import signal # For on-demand plot exports
 from itertools import izip
 
 
 # --------------------- Configure argument parsing --------------------
 import argparse
-parser = argparse.ArgumentParser(
-   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-parser.add_argument("-o", "--outfile", help="output filename",
-                    default="last_capture.dat"
-)
-parser.add_argument("-r", "--rcfile" , default="cgr-capture.cfg",
-                    help="Runtime configuration file"
-)
-args = parser.parse_args()
+
+def get_parser():
+    """Returns the command-line argument parser"""
+    parser = argparse.ArgumentParser(
+       formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-o", "--outfile", help="output filename",
+                        default="last_capture.dat"
+    )
+    parser.add_argument("-r", "--rcfile" , default="cgr-capture.cfg",
+                        help="Runtime configuration file"
+    )
+    parser.add_argument("-f", "--format", default="text",
+                        choices=sorted(writers.formats),
+                        help="Output file format"
+    )
+    parser.add_argument("-a", "--archive", default=None,
+                        help="Append raw captures to this archive directory"
+    )
+    parser.add_argument("--headless", action="store_true",
+                        help="Don't plot, and exit without waiting for a " +
+                        "key press"
+    )
+    parser.add_argument("--timing", default=None,
+                        help="Time each phase of the capture and write " +
+                        "the results to this JSON file at exit (or on " +
+                        "SIGUSR2)"
+    )
+    parser.add_argument("--metrics", default=None,
+                        help="Write acquisition metrics to this " +
+                        "Prometheus textfile (name it *.prom)"
+    )
+    parser.add_argument("--status", default=None,
+                        help="Write acquisition metrics to this JSON file"
+    )
+    parser.add_argument("--metrics-interval", type=float, default=10.0,
+                        help="Seconds between metrics updates"
+    )
+    return parser
 
 #---------------- Done with configuring argument parsing --------------
 
@@ -29,75 +59,46 @@ args = parser.parse_args()
 
 #------------------------- Configure logging --------------------------
 import logging
-from colorlog import ColoredFormatter
 
-# create logger
+# create logger.  The console and file handlers are attached by
+# logutils.init_logging() when main() runs, so importing this
+# module doesn't open the log file or load colorlog.
 logger = logging.getLogger('root')
-logger.setLevel(logging.DEBUG)
-
-# create console handler (ch) and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-
-# create file handler and set level to debug
-fh = logging.FileHandler('cgrlog.log',mode='a',encoding=None,delay=False)
-fh.setLevel(logging.DEBUG)
-
-color_formatter = ColoredFormatter(
-    '[ %(log_color)s%(levelname)-8s%(reset)s] %(message)s',
-    datefmt=None,
-    reset=True,
-    log_colors={
-        'DEBUG':    'cyan',
-        'INFO':     'green',
-        'WARNING':  'yellow',
-        'ERROR':    'red',
-        'CRITICAL': 'red',
-    }
-)
-
-plain_formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - [ %(levelname)s ] - %(message)s',
-    '%Y-%m-%d %H:%M:%S'
-)
-
-# Colored output goes to the console
-ch.setFormatter(color_formatter)
-logger.addHandler(ch)
-
-# Plain output goes to the file
-fh.setFormatter(plain_formatter)
-logger.addHandler(fh)
 
 # --------------- Done with logging configuration ---------------------
 
 
 
-# Now that logging has been set up, bring in the utility functions.
-# These will use the same logger as the root application.
+# Bring in the utility functions.  These will use the same logger
+# as the root application.
 from cgrlib import utils
+from cgrlib import logutils
+from cgrlib import lazy
+from cgrlib import render
+from cgrlib import timing
+from cgrlib import metrics
 
+# These need numpy, which is only imported when it's first used
+numpy = lazy.LazyModule('numpy')
+archive = lazy.LazyModule('cgrlib.archive')
+writers = lazy.LazyModule('cgrlib.writers')
 
 
 
-# ------------------ Configure plotting with gnuplot ------------------
-
-# For the Gnuplot module
-from numpy import * # For gnuplot.py
-import Gnuplot, Gnuplot.funcutils # For gnuplot.py
 
-# Set the gnuplot executable
-Gnuplot.GnuplotOpts.gnuplot_command = 'gnuplot'
+# ------------------ Configure plotting with gnuplot ------------------
 
-# Use this option to turn off fifo if you get warnings like:
-# line 0: warning: Skipping unreadable file "/tmp/tmpakexra.gnuplot/fifo"
-Gnuplot.GnuplotOpts.prefer_fifo_data = 0
+# Data is sent to a persistent gnuplot process in binary form
+gplot = lazy.LazyModule('cgrlib.gplot')
 
-# Use temporary files instead of inline data
-Gnuplot.GnuplotOpts.prefer_inline_data = 0
+def gnuplot_init():
+    """Sets the gnuplot options.  Call this before plotting.
+    """
+    # Set the gnuplot executable
+    gplot.gnuplot_command = 'gnuplot'
 
-# Set the default terminal
-Gnuplot.GnuplotOpts.default_term = 'x11'
+    # Set the default terminal
+    gplot.default_term = 'x11'
 
 # ------------------ Done with gnuplot configuration ------------------
 
@@ -311,8 +312,9 @@ def init_logger(config,conhandler,filehandler):
 def plotinit():
     """ Returns the configured gnuplot plot object.
     """
+    gnuplot_init()
     # Set debug=1 to see gnuplot commands during execution.
-    plotobj = Gnuplot.Gnuplot(debug=0)
+    plotobj = gplot.GnuplotPipe(debug=0)
     plotobj('set terminal x11') # Send a gnuplot command
     plotobj('set style data lines')
     plotobj('set key bottom left')
@@ -327,73 +329,75 @@ def plotinit():
 def plotdata(plotobj, timedata, voltdata, trigdict):
     """Plot data from both channels.
 
+    This runs in the render thread.  Use render.export_plot to save
+    the plot to a file.
+
     Arguments:
       plotobj -- The gnuplot plot object
       timedata -- List of sample times
       voltdata -- 1024 x 2 list of voltage samples
       trigdict -- Trigger parameter dictionary
     """
-    gdata_cha_notime = Gnuplot.PlotItems.Data(
-        voltdata[0],title='Channel A')
-    gdata_cha = Gnuplot.PlotItems.Data(
-        timedata,voltdata[0],title='Channel A')
-    gdata_chb = Gnuplot.PlotItems.Data(
-        timedata,voltdata[1],title='Channel B')
-    plotobj.plot(gdata_cha,gdata_chb) # Plot the data
+    # Plot the data
+    plotobj.plot_traces(timedata, voltdata, ['Channel A', 'Channel B'])
     # Freeze the axis limits after the initial autoscale.
     plotobj('unset autoscale y')
     plotobj('set yrange [GPVAL_Y_MIN:GPVAL_Y_MAX]')
-    # Add the trigger crosshair
+    # Add the trigger crosshair.  Numbering the arrows replaces the
+    # crosshair from the last frame instead of adding another one.
     if (trigdict['trigsrc'] < 3):
         trigtime = timedata[1024-trigdict['trigpts']]
-        plotobj('set arrow from ' + str(trigtime) + ',graph 0 to ' +
+        plotobj('set arrow 1 from ' + str(trigtime) + ',graph 0 to ' +
                 str(trigtime) + ',graph 1 nohead linetype 0')
-        plotobj('set arrow from graph 0,first ' + str(trigdict['triglev']) +
+        plotobj('set arrow 2 from graph 0,first ' + str(trigdict['triglev']) +
                 ' to graph 1,first ' + str(trigdict['triglev']) +
                 ' nohead linetype 0')
         plotobj('replot')
-    savefilename = ('trig.eps')
-    plotobj('set terminal postscript eps color')
-    plotobj("set output '" + savefilename + "'")
-    plotobj('replot')
-    plotobj('set terminal x11')
 
 
-def savedata(config, timedata, voltdata):
+def exportplot(plotobj):
+    """Save the plot as trig.eps.
+
+    This runs in the render thread when a run finishes, or when
+    SIGUSR1 asks for an export.
+
+    Arguments:
+      plotobj -- The gnuplot plot object
+    """
+    render.export_plot(plotobj, 'trig.eps', gplot.default_term)
+
+
+def savedata(filename, fmt, timedata, voltdata, rawdata=None,
+             metadata=None):
     """ Write data to a file.
 
     Arguments:
-      config -- The configuration object created from the configuration
-                file.
+      filename -- The output file name.
+      fmt -- Output format.  See writers.formats for the choices.
       timedata -- List of sample times.
       voltdata -- List of voltage samples:
                   voltdata[0] -- Samples from channel A
                   voltdata[1] -- Samples from channel B
+      rawdata -- List of (averaged) uncalibrated samples, or None.
+                 Only saved by formats that hold raw data.
+      metadata -- Dictionary of capture settings saved by formats
+                  that hold them.
     """
-    # Open output file
-    with open(args.outfile, 'w') as outfile:
-        logger.info('Writing data to ' + args.outfile)
-        outfile.write('# Created by cgr-capture' + '\n')
-        outfile.write('{:<20}'.format('# Time (s)'))
-        outfile.write('{:<20}'.format('Channel A (V)'))
-        outfile.write('{:<20}'.format('Channel B (V)') + '\n')
-        for timepoint, avolt, bvolt in zip(timedata, voltdata[0], voltdata[1]):
-            # Write the time coordinate
-            outfile.write('{:<20.5e}'.format(timepoint))
-            # Write the A datapoint
-            outfile.write('{:<20.5e}'.format(avolt))
-            # Write the B datapoint
-            outfile.write('{:<20.5e}'.format(bvolt) + '\n')
+    writers.write_data(filename, fmt, timedata, voltdata, rawdata, metadata)
 
 
 
 # ------------------------- Main procedure ----------------------------
-def main():
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    (ch,fh) = logutils.init_logging('cgrlog.log')
+    if args.timing:
+        timing.dump_at_exit(args.timing)
+        if hasattr(signal, 'SIGUSR2'):
+            signal.signal(signal.SIGUSR2,
+                          lambda signum, frame: timing.dump(args.timing))
     logger.debug('Utility module number is ' + str(utils.utilnum))
     config = load_config(args.rcfile)
-    global ch,fh # Need to modify console and file logger handlers
-                 # with the config file, from inside main().  They
-                 # thus must be made global.
     (ch,fh) = init_logger(config,ch,fh)
     trigdict = utils.get_trig_dict( int(config['Trigger']['source']),
                                      float(config['Trigger']['level']),
@@ -424,8 +428,30 @@ def main():
             )
         )
 
+    if args.archive:
+        archiver = archive.ArchiveWriter(args.archive)
+        calid = archive.get_cal_id(caldict)
     # Wait for trigger, then return uncalibrated data
-    gplot = plotinit() # Create plot object
+    if args.headless:
+        plotobj = None
+        renderer = render.NullRenderer()
+    else:
+        plotobj = plotinit() # Create plot object
+        # Plot in the background so acquisition never waits for gnuplot
+        renderer = render.RenderWorker(plotdata,
+                                       lambda: exportplot(plotobj))
+    renderer.start()
+    if args.metrics or args.status:
+        metrics.register_gauge('cgr_log_queue_depth',
+                               logutils.get_queue_depth)
+        metrics.register_gauge('cgr_plot_queue_depth',
+                               renderer.get_queue_depth)
+        exporter = metrics.MetricsExporter(args.metrics, args.status,
+                                           args.metrics_interval)
+        exporter.start()
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1,
+                      lambda signum, frame: renderer.request_export())
     for capturenum in range(int(config['Acquire']['averages'])):
         if trigdict['trigsrc'] == 3:
             # Internal trigger
@@ -433,27 +459,45 @@ def main():
         elif trigdict['trigsrc'] < 3:
             # Trigger on a voltage present at some input
             tracedata = utils.get_uncal_triggered_data(cgr,trigdict)
-        logger.info('Acquiring trace ' + str(capturenum + 1) + ' of ' +
-                    str(config['Acquire']['averages']))
-        if capturenum == 0:
-            sumdata = tracedata
-        else:
-            sumdata = add(sumdata,tracedata)
-        avgdata = divide(sumdata,float(capturenum +1))
+        logger.info('Acquiring trace %d of %s', capturenum + 1,
+                    config['Acquire']['averages'])
+        if args.archive:
+            with timing.phase('archive'):
+                seq = archiver.append(tracedata, fsamp_act, trigdict,
+                                      gainlist, calid)
+            logger.debug('Archived trace as capture %d', seq)
+        with timing.phase('averaging'):
+            if capturenum == 0:
+                sumdata = tracedata
+            else:
+                sumdata = numpy.add(sumdata,tracedata)
+            avgdata = numpy.divide(sumdata,float(capturenum +1))
         # Apply calibration
         voltdata = utils.get_cal_data(
             caldict,gainlist,[avgdata[0],avgdata[1]]
         )
         timedata = utils.get_timelist(fsamp_act)
         logger.debug(
-            'Plotting average of ' + str(capturenum + 1) + ' traces.'
+            'Plotting average of %d traces.', capturenum + 1
         )
-        plotdata(gplot, timedata, voltdata, trigdict)
-
-
-
-    savedata(config, timedata, voltdata)
-    raw_input('Press any key to close plot and exit...')
+        renderer.submit(plotobj, timedata, voltdata, trigdict)
+
+
+
+    renderer.finish() # Draw and export the final average
+    if args.metrics or args.status:
+        exporter.finish()
+    if args.archive:
+        archiver.close()
+    metadata = {'rate': fsamp_act,
+                'averages': int(config['Acquire']['averages']),
+                'timestamp': time.time(),
+                'gain': gainlist}
+    with timing.phase('write'):
+        savedata(args.outfile, args.format, timedata, voltdata, avgdata,
+                 metadata)
+    if not args.headless:
+        raw_input('Press any key to close plot and exit...')
 
 
 # Execute main() from command line
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+
+# cgr_export.py
+#
+# Exports captures from a capture archive to text, numpy and packed
+# files
+
+import os       # For basic file I/O
+import sys # For sys.exit()
+
+# --------------------- Configure argument parsing --------------------
+import argparse
+
+def get_parser():
+    """Returns the command-line argument parser"""
+    parser = argparse.ArgumentParser(
+       formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("archive", help="Capture archive directory")
+    parser.add_argument("-o", "--outfile", default="export.csv",
+                        help="Output file, or output directory for the " +
+                        "files format"
+    )
+    parser.add_argument("-f", "--format", default="csv",
+                        choices=["csv", "npy", "packed", "files"],
+                        help="csv: one table of every sample.  " +
+                        "npy: N x channels x 1024 stack.  " +
+                        "packed: compressed raw counts for long-term " +
+                        "storage (see cgrlib.codec).  " +
+                        "files: one file per capture"
+    )
+    parser.add_argument("-c", "--capture-format", default="text",
+                        choices=sorted(writers.formats),
+                        help="File format used by the files format"
+    )
+    parser.add_argument("-s", "--start", default=None,
+                        help="Earliest capture time to export " +
+                        "('YYYY-MM-DD HH:MM:SS' or seconds since the epoch)"
+    )
+    parser.add_argument("-e", "--stop", default=None,
+                        help="Export captures taken before this time"
+    )
+    parser.add_argument("--channels", default="AB", choices=["A", "B", "AB"],
+                        help="Channels to export (csv, npy and packed " +
+                        "formats)"
+    )
+    parser.add_argument("--calfile", default="cgrcal.pkl",
+                        help="Calibration file used to convert counts to volts"
+    )
+    parser.add_argument("--raw", action="store_true",
+                        help="Export raw ADC counts instead of volts " +
+                        "(csv and npy formats)"
+    )
+    parser.add_argument("--compression", default="zlib",
+                        choices=["none", "zlib", "lzma"],
+                        help="Compression used by the packed format"
+    )
+    parser.add_argument("-b", "--blocksize", type=int, default=256,
+                        help="Number of captures converted at a time"
+    )
+    return parser
+
+#---------------- Done with configuring argument parsing --------------
+
+
+#------------------------- Configure logging --------------------------
+import logging
+
+# create logger.  The console and file handlers are attached by
+# logutils.init_logging() when main() runs, so importing this
+# module doesn't open the log file or load colorlog.
+logger = logging.getLogger('root')
+
+# --------------- Done with logging configuration ---------------------
+
+# Bring in the utility functions.  These will use the same logger
+# as the root application.
+from cgrlib import utils
+from cgrlib import logutils
+from cgrlib import lazy
+
+# These need numpy, which is only imported when it's first used
+numpy = lazy.LazyModule('numpy')
+archive = lazy.LazyModule('cgrlib.archive')
+writers = lazy.LazyModule('cgrlib.writers')
+codec = lazy.LazyModule('cgrlib.codec')
+
+
+def get_channel_list(channels):
+    """Return the channel indexes selected on the command line
+
+    Arguments:
+      channels -- 'A', 'B' or 'AB'
+    """
+    chanlist = []
+    if 'A' in channels:
+        chanlist.append(0)
+    if 'B' in channels:
+        chanlist.append(1)
+    return chanlist
+
+
+def check_cal_ids(records, caldict, checked):
+    """Warn about captures taken with a different calibration.
+
+    Each calibration checksum is only reported once.  Raw exports
+    don't apply a calibration, so there is nothing to check.
+
+    Arguments:
+      records -- Array of capture records
+      caldict -- The calibration dictionary used for the export, or
+                 None for raw counts
+      checked -- Set of calibration checksums already seen
+    """
+    if caldict is None:
+        return
+    for calid in numpy.unique(records['calid']):
+        if not calid in checked:
+            checked.add(calid)
+            if calid != archive.get_cal_id(caldict):
+                logger.warning(
+                    'Some captures were taken with a different calibration ' +
+                    '(id ' + '{:08x}'.format(int(calid)) + ')'
+                )
+
+
+def get_block_values(records, caldict, chanlist):
+    """Return an N x channels x 1024 array of exported values
+
+    Arguments:
+      records -- Array of capture records
+      caldict -- Calibration dictionary, or None for raw counts
+      chanlist -- List of channel indexes to keep
+    """
+    if caldict is None:
+        values = records['data'].astype(float)
+    else:
+        values = archive.get_cal_volts(records, caldict)
+    return values[:, chanlist, :]
+
+
+def export_csv(reader, first, last, filename, caldict, chanlist, blocksize):
+    """Stream captures into one comma-separated table.
+
+    There is one row per sample, with the capture's sequence number
+    and timestamp repeated on each row.
+
+    Arguments:
+      reader -- archive.ArchiveReader
+      first -- First index position to export
+      last -- One past the last index position
+      filename -- Output file name
+      caldict -- Calibration dictionary, or None for raw counts
+      chanlist -- List of channel indexes to export
+      blocksize -- Maximum captures converted at a time
+    """
+    points = archive.capture_points
+    samplenums = numpy.arange(points)
+    channames = ['channel_a', 'channel_b']
+    if caldict is None:
+        units = '_counts'
+    else:
+        units = '_v'
+    header = 'seq,timestamp,time_s'
+    for channum in chanlist:
+        header += ',' + channames[channum] + units
+    rowformat = '%d,%.6f,%.6e' + ',%.6e' * len(chanlist) + '\n'
+    checked = set()
+    with writers.atomic_open(filename, 'w') as fout:
+        fout.write(header + '\n')
+        for (position, records) in reader.iter_blocks(first, last, blocksize):
+            check_cal_ids(records, caldict, checked)
+            values = get_block_values(records, caldict, chanlist)
+            count = len(records)
+            columns = [
+                numpy.repeat(records['seq'].astype(float), points),
+                numpy.repeat(records['timestamp'], points),
+                (samplenums[numpy.newaxis, :] /
+                 records['rate'][:, numpy.newaxis]).ravel()
+            ]
+            for channel in range(len(chanlist)):
+                columns.append(values[:, channel, :].ravel())
+            table = numpy.column_stack(columns)
+            fout.write((rowformat * (count * points)) % tuple(table.ravel()))
+            logger.debug('Exported captures %d to %d', position,
+                         position + count - 1)
+
+
+def export_npy(reader, first, last, filename, caldict, chanlist, blocksize):
+    """Stream captures into an N x channels x 1024 numpy stack.
+
+    The stack is written through a memory map, so only one block is
+    held in memory.  A second file (with _index added to the name)
+    holds the sequence number, timestamp and sample rate of each
+    capture.
+
+    Arguments:
+      reader -- archive.ArchiveReader
+      first -- First index position to export
+      last -- One past the last index position
+      filename -- Output file name
+      caldict -- Calibration dictionary, or None for raw counts
+      chanlist -- List of channel indexes to export
+      blocksize -- Maximum captures converted at a time
+    """
+    count = last - first
+    index = numpy.zeros(count, dtype=[('seq', '<u8'),
+                                      ('timestamp', '<f8'),
+                                      ('rate', '<f8')])
+    tempname = filename + '.partial'
+    stack = numpy.lib.format.open_memmap(
+        tempname, mode='w+', dtype='<f8',
+        shape=(count, len(chanlist), archive.capture_points)
+    )
+    checked = set()
+    try:
+        for (position, records) in reader.iter_blocks(first, last, blocksize):
+            check_cal_ids(records, caldict, checked)
+            start = position - first
+            stop = start + len(records)
+            stack[start:stop] = get_block_values(records, caldict, chanlist)
+            index['seq'][start:stop] = records['seq']
+            index['timestamp'][start:stop] = records['timestamp']
+            index['rate'][start:stop] = records['rate']
+        stack.flush()
+        del stack
+        os.rename(tempname, filename)
+    except:
+        os.remove(tempname)
+        raise
+    write_index(filename, index)
+
+
+def write_index(filename, index):
+    """Write the per-capture index that goes with a stacked export.
+
+    Arguments:
+      filename -- Export file name.  The index goes next to it, with
+                  _index added to the name.
+      index -- Structured array with one entry per capture
+    """
+    indexname = os.path.splitext(filename)[0] + '_index.npy'
+    with writers.atomic_open(indexname, 'wb') as fout:
+        numpy.save(fout, index)
+    logger.info('Wrote capture index to ' + indexname)
+
+
+def export_packed(reader, first, last, filename, chanlist, compression,
+                  blocksize):
+    """Stream raw counts into a packed file.
+
+    Every block of captures is delta encoded, packed to 10 bits and
+    compressed by codec.write_block(), so codec.read_blocks() gives
+    back N x channels x 1024 arrays of counts.  A second file (with
+    _index added to the name) holds the sequence number, timestamp,
+    sample rate, gains and calibration checksum of each capture, which
+    is what converting the counts to volts needs.
+
+    Arguments:
+      reader -- archive.ArchiveReader
+      first -- First index position to export
+      last -- One past the last index position
+      filename -- Output file name
+      chanlist -- List of channel indexes to export
+      compression -- None, 'zlib' or 'lzma'
+      blocksize -- Maximum captures packed at a time
+    """
+    index = numpy.zeros(last - first, dtype=[('seq', '<u8'),
+                                             ('timestamp', '<f8'),
+                                             ('rate', '<f8'),
+                                             ('gain', '<u1', (2,)),
+                                             ('calid', '<u4')])
+    rawbytes = 0
+    with writers.atomic_open(filename, 'wb') as fout:
+        for (position, records) in reader.iter_blocks(first, last, blocksize):
+            codes = records['data'][:, chanlist, :]
+            codec.write_block(fout, codes, compression=compression)
+            rawbytes += codes.nbytes
+            start = position - first
+            stop = start + len(records)
+            for field in index.dtype.names:
+                index[field][start:stop] = records[field]
+        packedbytes = fout.tell()
+    logger.info('Packed %d bytes of counts into %d bytes', rawbytes,
+                packedbytes)
+    write_index(filename, index)
+
+
+def export_files(reader, first, last, directory, caldict, fmt, blocksize):
+    """Write every capture to its own file.
+
+    Files are named capture_<sequence number> and use the cgr-capture
+    layout, so both channels are always written.  Formats that hold
+    raw data (see writers.formats) store the counts too.
+
+    Arguments:
+      reader -- archive.ArchiveReader
+      first -- First index position to export
+      last -- One past the last index position
+      directory -- Output directory
+      caldict -- Calibration dictionary
+      fmt -- Output file format (see writers.formats)
+      blocksize -- Maximum captures converted at a time
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    checked = set()
+    for (position, records) in reader.iter_blocks(first, last, blocksize):
+        check_cal_ids(records, caldict, checked)
+        values = get_block_values(records, caldict, [0, 1])
+        for record, voltdata in zip(records, values):
+            timedata = numpy.arange(archive.capture_points) / record['rate']
+            metadata = {'rate': float(record['rate']),
+                        'averages': 1,
+                        'timestamp': float(record['timestamp']),
+                        'gain': record['gain']}
+            filename = os.path.join(
+                directory, 'capture_' + '{:08d}'.format(int(record['seq'])) +
+                '.' + writers.extensions[fmt]
+            )
+            writers.write_data(filename, fmt, timedata, voltdata,
+                               record['data'], metadata)
+
+
+# ------------------------- Main procedure ----------------------------
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.raw and args.format == 'files':
+        # The per-file formats label their data as volts.  They keep
+        # the raw counts alongside where the format can hold them.
+        parser.error('--raw only works with the csv and npy formats')
+    if (args.format == 'packed' and args.compression == 'lzma' and
+        codec.lzma is None):
+        parser.error('lzma compression needs the lzma module ' +
+                     '(backports.lzma on Python 2)')
+    (ch,fh) = logutils.init_logging('cgrlog.log')
+    logger.debug('Utility module number is ' + str(utils.utilnum))
+    try:
+        reader = archive.ArchiveReader(args.archive)
+    except IOError:
+        logger.error('Did not find a capture archive in ' + args.archive)
+        sys.exit(1)
+    try:
+        (first, last) = reader.find_time(utils.parse_time(args.start),
+                                         utils.parse_time(args.stop))
+    except ValueError as ex:
+        logger.error(str(ex))
+        sys.exit(1)
+    if first == last:
+        logger.warning('No captures in the requested time range')
+        sys.exit(1)
+    logger.info('Exporting ' + str(last - first) + ' of ' +
+                str(len(reader)) + ' captures')
+    if args.raw or args.format == 'packed':
+        # The packed format always holds raw counts
+        caldict = None
+    else:
+        caldict = utils.load_cal_file(args.calfile)
+    chanlist = get_channel_list(args.channels)
+    if args.format == 'csv':
+        export_csv(reader, first, last, args.outfile, caldict, chanlist,
+                   args.blocksize)
+    elif args.format == 'npy':
+        export_npy(reader, first, last, args.outfile, caldict, chanlist,
+                   args.blocksize)
+    elif args.format == 'packed':
+        compression = args.compression
+        if compression == 'none':
+            compression = None
+        export_packed(reader, first, last, args.outfile, chanlist,
+                      compression, args.blocksize)
+    elif args.format == 'files':
+        if not args.channels == 'AB':
+            logger.warning('The files format always writes both channels')
+        export_files(reader, first, last, args.outfile, caldict,
+                     args.capture_format, args.blocksize)
+    reader.close()
+    logger.info('Export finished')
+
+
+# Execute main() from command line
+if __name__ == '__main__':
+    main()
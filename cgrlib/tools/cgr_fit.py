@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+# cgr_fit.py
+#
+# Fits equivalent circuits to impedance sweeps saved by cgr-imp
+
+import sys # For sys.exit()
+
+# --------------------- Configure argument parsing --------------------
+import argparse
+
+def get_parser():
+    """Returns the command-line argument parser"""
+    parser = argparse.ArgumentParser(
+       formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("results", nargs="+",
+                        help="cgr-imp results files (see cgr-imp --results)"
+    )
+    parser.add_argument("-m", "--model", default="best",
+                        help="Model to fit: series_rc, parallel_rc, " +
+                        "series_rl, parallel_rl, series_rlc, " +
+                        "parallel_rlc, r_cpe, randles, or best to pick " +
+                        "the model with the lowest AIC"
+    )
+    parser.add_argument("-o", "--outfile", default="cgrfit.txt",
+                        help="Tab-separated file of fitted parameters"
+    )
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="Worker processes for the fits.  The " +
+                        "default is one per CPU."
+    )
+    parser.add_argument("--min-snr", type=float, default=20,
+                        help="Leave out multisine points with a lower " +
+                        "signal-to-noise ratio (dB)"
+    )
+    return parser
+
+#---------------- Done with configuring argument parsing --------------
+
+
+#------------------------- Configure logging --------------------------
+import logging
+
+# create logger.  The console and file handlers are attached by
+# logutils.init_logging() when main() runs, so importing this
+# module doesn't open the log file or load colorlog.
+logger = logging.getLogger('root')
+
+# --------------- Done with logging configuration ---------------------
+
+# Bring in the utility functions.  These will use the same logger
+# as the root application.
+from cgrlib import logutils
+from cgrlib import lazy
+from cgrlib import results
+
+# These need numpy, which is only imported when it's first used
+fitting = lazy.LazyModule('cgrlib.fitting')
+
+
+def get_sweep(filename, min_snr):
+    """Returns (frequencies, complex impedances) from a results file,
+    in frequency order
+
+    Arguments:
+      filename -- cgr-imp results file name
+      min_snr -- Lowest signal-to-noise ratio (dB) of multisine points
+                 to use
+    """
+    (confighash, records) = results.read_results(filename)
+    points = sorted((record['frequency'],
+                     complex(record['z_real'], record['z_imag']))
+                    for record in records
+                    if record['method'] == 'sine' or
+                    record['snr'] >= min_snr)
+    return ([point[0] for point in points], [point[1] for point in points])
+
+
+def write_fits(filename, names, fits):
+    """Write fitted parameters to a tab-separated file
+
+    Each line has the results file name, the model, the relative rms
+    error of the fit, then a name, value and relative standard error
+    for every parameter.
+
+    Arguments:
+      filename -- Output file name
+      names -- Results file names
+      fits -- fitting.fit_job() result for each results file
+    """
+    with open(filename, 'w') as fout:
+        fout.write('# file\tmodel\trms\t(parameter\tvalue\terror)...\n')
+        for name, fit in zip(names, fits):
+            fields = [name, fit['model']]
+            if 'error' in fit:
+                fields.append('nan')
+            else:
+                fields.append(repr(fit['rms']))
+                for parameter in fit['parameters']:
+                    fields += [parameter, repr(fit['parameters'][parameter]),
+                               repr(fit['errors'][parameter])]
+            fout.write('\t'.join(fields) + '\n')
+
+
+# ------------------------- Main procedure ----------------------------
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if not (args.model == 'best' or args.model in fitting.models):
+        parser.error('Unknown model ' + args.model)
+    (ch,fh) = logutils.init_logging('cgrfit.log')
+    jobs = []
+    names = []
+    for filename in args.results:
+        try:
+            (frequencies, impedances) = get_sweep(filename, args.min_snr)
+        except IOError:
+            logger.error('Could not read %s', filename)
+            continue
+        if not frequencies:
+            logger.warning('No usable points in %s', filename)
+            continue
+        jobs.append((args.model, frequencies, impedances))
+        names.append(filename)
+    if not jobs:
+        logger.error('No sweeps to fit')
+        sys.exit(1)
+    logger.info('Fitting %d sweeps', len(jobs))
+    fits = fitting.fit_batch(jobs, args.processes)
+    for name, fit in zip(names, fits):
+        if 'error' in fit:
+            logger.warning('%s: %s', name, fit['error'])
+            continue
+        values = ', '.join('{} = {:0.4g}'.format(parameter, value)
+                           for (parameter, value)
+                           in fit['parameters'].items())
+        logger.info('%s: %s, %s (%0.2g %% rms error)', name, fit['model'],
+                    values, fit['rms'] * 100)
+    write_fits(args.outfile, names, fits)
+    logger.info('Wrote the fits to %s', args.outfile)
+    if all('error' in fit for fit in fits):
+        logger.error('None of the sweeps could be fitted')
+        sys.exit(1)
+
+
+# Execute main() from command line
+if __name__ == '__main__':
+    main()
@@ -13,73 +13,42 @@ from math import pi
 
 # --------------------- Configure argument parsing --------------------
 import argparse
-parser = argparse.ArgumentParser(
-   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-parser.add_argument("-r", "--rcfile" , default="cgr-gen.cfg",
-                    help="Runtime configuration file"
-)
-parser.add_argument("-w", "--waveform", default="sine",
-                    help="Waveform.  Known values are: sine"
-)
-parser.add_argument("-f", "--frequency", default=100,
-                    help="Output frequency"
-)
-parser.add_argument("-a", "--amplitude", default=0.1,
-                    help="Output amplitude (Vp)"
-)
 
-args = parser.parse_args()
+def get_parser():
+    """Returns the command-line argument parser"""
+    parser = argparse.ArgumentParser(
+       formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-r", "--rcfile" , default="cgr-gen.cfg",
+                        help="Runtime configuration file"
+    )
+    parser.add_argument("-w", "--waveform", default="sine",
+                        help="Waveform.  Known values are: sine"
+    )
+    parser.add_argument("-f", "--frequency", default=100,
+                        help="Output frequency"
+    )
+    parser.add_argument("-a", "--amplitude", default=0.1,
+                        help="Output amplitude (Vp)"
+    )
+    return parser
 
 #---------------- Done with configuring argument parsing --------------
 
 
 #------------------------- Configure logging --------------------------
 import logging
-from colorlog import ColoredFormatter
 
-# create logger
+# create logger.  The console and file handlers are attached by
+# logutils.init_logging() when main() runs, so importing this
+# module doesn't open the log file or load colorlog.
 logger = logging.getLogger('root')
-logger.setLevel(logging.DEBUG)
-
-# create console handler (ch) and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-
-# create file handler and set level to debug
-fh = logging.FileHandler('cgrlog.log',mode='a',encoding=None,delay=False)
-fh.setLevel(logging.DEBUG)
-
-color_formatter = ColoredFormatter(
-    '[ %(log_color)s%(levelname)-8s%(reset)s] %(message)s',
-    datefmt=None,
-    reset=True,
-    log_colors={
-        'DEBUG':    'cyan',
-        'INFO':     'green',
-        'WARNING':  'yellow',
-        'ERROR':    'red',
-        'CRITICAL': 'red',
-    }
-)
-
-plain_formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - [ %(levelname)s ] - %(message)s',
-    '%Y-%m-%d %H:%M:%S'
-)
-
-# Colored output goes to the console
-ch.setFormatter(color_formatter)
-logger.addHandler(ch)
-
-# Plain output goes to the file
-fh.setFormatter(plain_formatter)
-logger.addHandler(fh)
 
 # --------------- Done with logging configuration ---------------------
 
-# Now that logging has been set up, bring in the utility functions.
-# These will use the same logger as the root application.
+# Bring in the utility functions.  These will use the same logger
+# as the root application.
 from cgrlib import utils
+from cgrlib import logutils
 
 cmdterm = '\r\n' # Terminates each command
 
@@ -210,12 +179,11 @@ def init_logger(config,conhandler,filehandler):
 
 
 # ------------------------- Main procedure ----------------------------
-def main():
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    (ch,fh) = logutils.init_logging('cgrlog.log')
     logger.debug('Utility module number is ' + str(utils.utilnum))
     config = load_config(args.rcfile)
-    global ch,fh # Need to modify console and file logger handlers
-                 # with the config file, from inside main().  They
-                 # thus must be made global.
     (ch,fh) = init_logger(config,ch,fh)
     cgr = utils.get_cgr(config)
     actfreq = utils.set_sine_frequency(cgr, float(args.frequency)) # Return the actual frequency
@@ -224,12 +192,10 @@ def main():
     if args.waveform == 'sine':
         logger.debug('Configuring sine wave output')
         if not (config['Waveform']['shape'] == 'sine'):
+            sinelist = []
             for samplenum in range(256):
-                sampleval = int(round(127 + 127*sin(samplenum * 2*pi/255)))
-                utils.set_arb_value(cgr, samplenum, sampleval)
-            cgr.open()
-            utils.sendcmd(cgr,'W P')
-            cgr.close()   
+                sinelist.append(int(round(127 + 127*sin(samplenum * 2*pi/255))))
+            utils.set_arb_waveform(cgr, sinelist)
             config['Waveform']['shape'] = 'sine'
             config.write()
     if args.waveform == 'square':
@@ -237,15 +203,13 @@ def main():
         if not (config['Waveform']['shape'] == 'square'):
             # Set the output to 0 while we load and activate the waveform
             utils.set_output_amplitude(cgr, 0)
+            squarelist = []
             for samplenum in range(256):
                 if samplenum < 128:
-                    sampleval = 0
+                    squarelist.append(0)
                 else:
-                    sampleval = 255
-                utils.set_arb_value(cgr, samplenum, sampleval)
-            cgr.open()
-            utils.sendcmd(cgr,'W P')
-            cgr.close()
+                    squarelist.append(255)
+            utils.set_arb_waveform(cgr, squarelist)
             config['Waveform']['shape'] = 'square'
             config.write()
     actamp = utils.set_output_amplitude(cgr, float(args.amplitude))
@@ -8,93 +8,136 @@ import time     # For making pauses
 import os       # For basic file I/O
 import ConfigParser # For reading and writing the configuration file
 import sys # For sys.exit()
+import signal # For on-demand plot exports
+import bisect # For keeping refined sweeps in frequency order
 from math import sin # For generating sine waves
 from math import pi
 # from scipy.optimize import minimize # For calculating phase shift
 
 # --------------------- Configure argument parsing --------------------
 import argparse
-parser = argparse.ArgumentParser(
-   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-parser.add_argument("-r", "--rcfile" , default="cgr-imp.cfg",
-                    help="Runtime configuration file"
-)
-args = parser.parse_args()
+
+def get_parser():
+    """Returns the command-line argument parser"""
+    parser = argparse.ArgumentParser(
+       formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-r", "--rcfile" , default="cgr-imp.cfg",
+                        help="Runtime configuration file"
+    )
+    parser.add_argument("--headless", action="store_true",
+                        help="Don't plot, and exit without waiting for a " +
+                        "key press"
+    )
+    parser.add_argument("--timing", default=None,
+                        help="Time each phase of the sweep and write " +
+                        "the results to this JSON file at exit (or on " +
+                        "SIGUSR2)"
+    )
+    parser.add_argument("--metrics", default=None,
+                        help="Write acquisition metrics to this " +
+                        "Prometheus textfile (name it *.prom)"
+    )
+    parser.add_argument("--status", default=None,
+                        help="Write acquisition metrics to this JSON file"
+    )
+    parser.add_argument("--metrics-interval", type=float, default=10.0,
+                        help="Seconds between metrics updates"
+    )
+    parser.add_argument("--pipeline-depth", type=int, default=2,
+                        help="Sweep points acquired ahead of the " +
+                        "analysis.  0 acquires and analyses each point " +
+                        "in turn."
+    )
+    parser.add_argument("--multisine", action="store_true",
+                        help="Measure many frequencies at once with a " +
+                        "multisine, then use sine steps only where the " +
+                        "signal-to-noise ratio is too low"
+    )
+    parser.add_argument("--harmonics", type=int, default=3,
+                        help="Harmonics of the drive frequency to " +
+                        "measure for the distortion report"
+    )
+    parser.add_argument("--results", default="cgrimp.txt",
+                        help="Write each measured point to this file " +
+                        "as soon as it's done"
+    )
+    parser.add_argument("--resume", action="store_true",
+                        help="Load the points already in the results " +
+                        "file and only measure the rest.  This needs " +
+                        "the same settings as the interrupted sweep."
+    )
+    parser.add_argument("--devices", action="store_true",
+                        help="Split the sweep between every CGR-101 " +
+                        "unit that's connected"
+    )
+    parser.add_argument("--fixture-cal", default=None,
+                        choices=['open', 'short', 'load'],
+                        help="Sweep with this standard in the fixture " +
+                        "and save it in the fixture compensation table " +
+                        "(Calibration/fixture)"
+    )
+    return parser
 
 #---------------- Done with configuring argument parsing --------------
 
 
 #------------------------- Configure logging --------------------------
 import logging
-from colorlog import ColoredFormatter
 
-# create logger
+# create logger.  The console and file handlers are attached by
+# logutils.init_logging() when main() runs, so importing this
+# module doesn't open the log file or load colorlog.
 logger = logging.getLogger('root')
-logger.setLevel(logging.DEBUG)
-
-# create console handler (ch) and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-
-# create file handler and set level to debug
-fh = logging.FileHandler('cgrimp.log',mode='a',encoding=None,delay=False)
-fh.setLevel(logging.DEBUG)
-
-color_formatter = ColoredFormatter(
-    '[ %(log_color)s%(levelname)-8s%(reset)s] %(message)s',
-    datefmt=None,
-    reset=True,
-    log_colors={
-        'DEBUG':    'cyan',
-        'INFO':     'green',
-        'WARNING':  'yellow',
-        'ERROR':    'red',
-        'CRITICAL': 'red',
-    }
-)
-
-plain_formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - [ %(levelname)s ] - %(message)s',
-    '%Y-%m-%d %H:%M:%S'
-)
-
-# Colored output goes to the console
-ch.setFormatter(color_formatter)
-logger.addHandler(ch)
-
-# Plain output goes to the file
-fh.setFormatter(plain_formatter)
-logger.addHandler(fh)
 
 # --------------- Done with logging configuration ---------------------
 
-# Now that logging has been set up, bring in the utility functions.
-# These will use the same logger as the root application.
+# Bring in the utility functions.  These will use the same logger
+# as the root application.
 from cgrlib import utils
+from cgrlib import logutils
+from cgrlib import lazy
+from cgrlib import render
+from cgrlib import timing
+from cgrlib import metrics
+from cgrlib import sweep
+from cgrlib import stats
+from cgrlib import results
+
+# numpy is only imported when it's first used
+numpy = lazy.LazyModule('numpy')
+lockin = lazy.LazyModule('cgrlib.lockin')
+multisine = lazy.LazyModule('cgrlib.multisine')
+fixture = lazy.LazyModule('cgrlib.fixture')
 
 # ------------------ Configure plotting with gnuplot ------------------
 
-# For the Gnuplot module
-from numpy import * # For gnuplot.py
-import Gnuplot, Gnuplot.funcutils # For gnuplot.py
-
-# Set the gnuplot executable
-Gnuplot.GnuplotOpts.gnuplot_command = 'gnuplot'
+# Data is sent to a persistent gnuplot process in binary form
+gplot = lazy.LazyModule('cgrlib.gplot')
 
-# Use this option to turn off fifo if you get warnings like:
-# line 0: warning: Skipping unreadable file "/tmp/tmpakexra.gnuplot/fifo"
-Gnuplot.GnuplotOpts.prefer_fifo_data = 0
-
-# Use temporary files instead of inline data
-Gnuplot.GnuplotOpts.prefer_inline_data = 0
+def gnuplot_init():
+    """Sets the gnuplot options.  Call this before plotting.
+    """
+    # Set the gnuplot executable
+    gplot.gnuplot_command = 'gnuplot'
 
-# Set the default terminal
-Gnuplot.GnuplotOpts.default_term = 'x11'
+    # Set the default terminal
+    gplot.default_term = 'x11'
 
 # ------------------ Done with gnuplot configuration ------------------
 
 cmdterm = '\r\n' # Terminates each command
 
+# Sweep settings that configuration files from older versions may not
+# have.  Read them with get_sweep_setting().
+sweep_defaults = {'tolerance': 0, 'maxaverages': 32, 'settle': 0,
+                  'refine': 0, 'refine_db': 1, 'refine_degrees': 5,
+                  'tones': 16, 'forced': 0}
+# Calibration settings that older configuration files may not have.
+# Read them with get_cal_setting().
+calibration_defaults = {'fixture': 'cgrfixture.pkl', 'Rload': 100}
+max_settle_captures = 10 # Acquisitions discarded at most while settling
+min_snr = 20 # Warn when the fundamental's SNR is below this (dB)
+
 
 # ------------- Configure runtime configuration file ------------------
 from configobj import ConfigObj # For writing and reading config file
@@ -176,12 +219,27 @@ def init_config(configFileName):
     ]
     config['Calibration']['calfile'] = 'cgrcal.pkl'
     config['Calibration'].comments['calfile'] = [
-        "The calibration file in Python's pickle format"
+        "The calibration file in Python's pickle format.  With",
+        "cgr-imp --devices, each unit's calibration is read from this",
+        "name with the port added (cgrcal_ttyUSB0.pkl), or from the",
+        "unit's eeprom if there's no such file."
         ]
     config['Calibration']['Rshort'] = 0
     config['Calibration'].comments['Rshort'] = [
         ' ',
-        'Resistance measured with inputs A and B connected to the output (ohms)'
+        'Resistance measured with inputs A and B connected to the output (ohms)',
+        'This is only used when the fixture has no compensation table.'
+    ]
+    config['Calibration']['fixture'] = calibration_defaults['fixture']
+    config['Calibration'].comments['fixture'] = [
+        ' ',
+        'Open/short/load compensation table for the fixture, in pickle',
+        'format.  Measure each standard with cgr-imp --fixture-cal',
+        'open, short or load.  Keep a table for each fixture.'
+    ]
+    config['Calibration']['Rload'] = calibration_defaults['Rload']
+    config['Calibration'].comments['Rload'] = [
+        'Resistance of the load standard (ohms)'
     ]
 
     #------------------------ Input section ---------------------------
@@ -234,6 +292,48 @@ def init_config(configFileName):
     config['Sweep'].comments['amplitude'] = [
         'Amplitude of the driving frequency (Volts peak)'
     ]
+    config['Sweep']['tolerance'] = sweep_defaults['tolerance']
+    config['Sweep'].comments['tolerance'] = [
+        'Keep averaging each frequency step until the standard error of',
+        'the impedance is below this fraction of its magnitude.  The',
+        'averages setting is then the minimum number of acquisitions.',
+        '0 always averages the set number of acquisitions.'
+    ]
+    config['Sweep']['maxaverages'] = sweep_defaults['maxaverages']
+    config['Sweep'].comments['maxaverages'] = [
+        'Most acquisitions to average when the tolerance is set'
+    ]
+    config['Sweep']['settle'] = sweep_defaults['settle']
+    config['Sweep'].comments['settle'] = [
+        'After changing the frequency, discard acquisitions until the',
+        'phase between the channels changes by less than this many',
+        'degrees between two acquisitions.  0 keeps every acquisition.'
+    ]
+    config['Sweep']['refine'] = sweep_defaults['refine']
+    config['Sweep'].comments['refine'] = [
+        'Extra points to add after the sweep where the impedance changes',
+        'quickly.  Points are added between neighbours whose |Z| or',
+        'phase differ by more than refine_db or refine_degrees, until',
+        'this many have been measured.  0 doesn\'t refine the sweep.'
+    ]
+    config['Sweep']['refine_db'] = sweep_defaults['refine_db']
+    config['Sweep'].comments['refine_db'] = [
+        'Largest |Z| change between neighbouring points (dB)'
+    ]
+    config['Sweep']['refine_degrees'] = sweep_defaults['refine_degrees']
+    config['Sweep'].comments['refine_degrees'] = [
+        'Largest phase change between neighbouring points (degrees)'
+    ]
+    config['Sweep']['forced'] = sweep_defaults['forced']
+    config['Sweep'].comments['forced'] = [
+        'Set to 1 to capture without waiting for a trigger.  Captures are',
+        'averaged relative to channel A\'s phase, so they don\'t need to',
+        'be aligned.'
+    ]
+    config['Sweep']['tones'] = sweep_defaults['tones']
+    config['Sweep'].comments['tones'] = [
+        'Number of tones in the multisine used by cgr-imp --multisine'
+    ]
 
     #------------------ Impedance calculation section -----------------
     config['Impedance'] = {}
@@ -271,6 +371,38 @@ def init_logger(config,conhandler,filehandler):
         conhandler.setLevel(logging.WARNING)
     return (conhandler,filehandler)
 
+def get_sweep_setting(config, name):
+    """Returns a setting from the Sweep section as a float.  Settings
+    missing from the file come from sweep_defaults.
+
+    Arguments:
+      config -- The configuration file object
+      name -- Setting name
+    """
+    return float(config['Sweep'].get(name, sweep_defaults[name]))
+
+def get_cal_setting(config, name):
+    """Returns a setting from the Calibration section.  Settings
+    missing from the file come from calibration_defaults.
+
+    Arguments:
+      config -- The configuration file object
+      name -- Setting name
+    """
+    return config['Calibration'].get(name, calibration_defaults[name])
+
+def get_fixture(config):
+    """Returns the fixture compensation table, or None if the fixture
+    has no table
+
+    Arguments:
+      config -- The configuration file object
+    """
+    filename = get_cal_setting(config, 'fixture')
+    if not filename:
+        return None
+    return fixture.load_table(filename)
+
 def get_sweep_list(config):
     """ Returns the frequencies in the sweep
 
@@ -281,29 +413,42 @@ def get_sweep_list(config):
     points = int(config['Sweep']['points'])
     startfreq = float(config['Sweep']['start'])
     stopfreq = float(config['Sweep']['stop'])
-    freqlist = logspace(log10(startfreq),log10(stopfreq),points,True)
+    freqlist = numpy.logspace(numpy.log10(startfreq),numpy.log10(stopfreq),
+                              points,True)
     return freqlist
         
-def set_sample_rate(handle, config, drive_frequency, trigger_dictionary):
-    """Returns the sample rate set to acquire multiple periods of the drive frequency
-
-    We need to send the trigger dictionary along with the drive
-    frequency because the two settings share the same register.
+def get_sweep_plan(config, frequencies, ratebits):
+    """Returns the planned steps for measuring a list of frequencies,
+    and logs how long they should take.
 
     Arguments:
-      handle -- Serial object for the CGR scope
       config -- The configuration file object
-      drive_frequency -- The drive frequency (Hz)
-      trigger_dictionary -- Trigger settings
+      frequencies -- List of requested frequencies (Hz)
+      ratebits -- Sample rate setting already in the control register,
+                  or None if it isn't known
+    """
+    plan = sweep.get_plan(frequencies, int(config['Sweep']['cycles']),
+                          ratebits)
+    averages = int(config['Sweep']['averages'])
+    seconds = sweep.get_plan_time(plan, averages)
+    ratechanges = len([step for step in plan if step['set_rate']])
+    logger.info('Measuring %d points with %d sample rate changes will ' +
+                'take about %0.0f seconds', len(plan), ratechanges, seconds)
+    if get_sweep_setting(config, 'tolerance') > 0 or \
+       get_sweep_setting(config, 'settle') > 0:
+        logger.info('Adaptive averaging can make this take up to %0.0f ' +
+                    'seconds', sweep.get_plan_time(
+                        plan, int(get_sweep_setting(config, 'maxaverages')) +
+                        max_settle_captures))
+    return plan
+
+def get_timelist_rate(timedata):
+    """Returns the sample rate of a list of sample times
 
+    Arguments:
+      timedata -- List of evenly spaced sample times
     """
-    capture_points = 1024 # Points acquired after a trigger
-    seconds_needed = int(config['Sweep']['cycles'])/drive_frequency
-    target_rate = capture_points/seconds_needed
-    [control_register_value, actual_samplerate] = utils.set_ctrl_reg(
-        handle, target_rate, trigger_dictionary
-    )
-    return actual_samplerate
+    return 1.0/(timedata[1] - timedata[0])
 
 def get_volts_rms(voltdata):
     """Returns the calculated Vrms for both channels
@@ -311,54 +456,28 @@ def get_volts_rms(voltdata):
     Arguments:
       voltdata -- 1024 x 2 list of voltage samples
     """
-    offsets = []
-    offsets.append(mean(voltdata[0]))
-    offsets.append(mean(voltdata[1]))
-    sum = [0,0]
-    for point in range(len(voltdata[0])):
-        sum[0] += (voltdata[0][point] - offsets[0])**2
-        sum[1] += (voltdata[1][point] - offsets[1])**2
-    vrms = [sqrt(sum[0]/1024),sqrt(sum[1]/1024)]
+    voltarray = numpy.asarray(voltdata, dtype=float)
+    centered = voltarray - numpy.mean(voltarray, axis=1)[:, numpy.newaxis]
+    vrms = numpy.sqrt(numpy.mean(centered**2, axis=1))
     return(vrms[0],vrms[1])
 
 def get_sine_vectors(frequency,timedata,voltdata):
     """Returns the amplitudes for both channels using a homodyne technique
 
-    Amplitude values are peak volts (Vp)
+    Each vector is half the peak amplitude (Vp/2).  The reference
+    tables come from the lock-in cache, so repeated calls at the same
+    frequency and sample rate don't rebuild them.
 
     Arguments:
       frequency -- the frequency to lock in on
       timedata -- List of sample times
       voltdata -- 1024 x 2 list of voltage samples
     """
-    offsets = []
-    offsets.append(mean(voltdata[0]))
-    offsets.append(mean(voltdata[1]))
-    refsin = []
-    refcos = []
-    for time in timedata:
-        refsin.append(sin(2*pi*frequency*time))
-        refcos.append(cos(2*pi*frequency*time))
-    sineprod = []
-    cosprod = []
+    phasors = lockin.demodulate(frequency, get_timelist_rate(timedata),
+                                voltdata)
     vectors = [] # [real part, imaginary part]
-    for channelnum in range(2):
-        sineprod.append(multiply(voltdata[channelnum]-offsets[channelnum],refsin))
-        cosprod.append(multiply(voltdata[channelnum]-offsets[channelnum],refcos))
-        vectors.append([mean(sineprod[channelnum]),mean(cosprod[channelnum])])
-    inphase_amplitudes = [mean(sineprod[0]), mean(sineprod[1])]
-    quadrature_amplitudes = [mean(cosprod[0]), mean(cosprod[1])]
-    amplitudes = []
-    phases = []
-    for channelnum in range(2):
-        amplitudes.append(2*sqrt(inphase_amplitudes[channelnum]**2 +
-                                 quadrature_amplitudes[channelnum]**2)
-        )
-        # Use arctan2 to allow angle to run from 0 --> 2pi
-        phases.append(arctan2(quadrature_amplitudes[channelnum],
-                              inphase_amplitudes[channelnum])
-        )        
-    # return [amplitudes, phases]
+    for phasor in phasors:
+        vectors.append([phasor.real, phasor.imag])
     return vectors
 
 def vector_length(vector):
@@ -367,7 +486,7 @@ def vector_length(vector):
     Arguments:
       vector -- [real part, imaginary part] two-member list
     """
-    length = sqrt(vector[0]**2 + vector[1]**2)
+    length = numpy.sqrt(vector[0]**2 + vector[1]**2)
     return length
 
 def vector_angle(vector):
@@ -376,10 +495,11 @@ def vector_angle(vector):
     Arguments:
       vector -- [real part, imaginary part] two-member list
     """
-    angle = arctan2(vector[1],vector[0])
+    angle = numpy.arctan2(vector[1],vector[0])
     return angle
 
-def get_z_vector(config, frequency, timedata, voltdata):
+def get_z_vector(config, frequency, timedata, voltdata, vectors=None,
+                 compensate=True):
     """Returns the magnitude and phase of the measured impedance
 
     Arguments:
@@ -387,17 +507,139 @@ def get_z_vector(config, frequency, timedata, voltdata):
       frequency -- The frequency to lock in on
       timedata -- List of sample times
       voltdata -- 1024 x 2 list of voltage samples
+      vectors -- Sine vectors already calculated from voltdata by
+                 get_sine_vectors, or None to calculate them
+      compensate -- False to skip the fixture compensation
     """
-    resistor = float(config['Impedance']['resistor'])
-    vectors = get_sine_vectors(frequency, timedata, voltdata)
+    if vectors is None:
+        vectors = get_sine_vectors(frequency, timedata, voltdata)
     ratio_mag = vector_length(vectors[0])/vector_length(vectors[1])
     ratio_phi = vector_angle(vectors[0]) - vector_angle(vectors[1])
-    ratio_real = ratio_mag * cos(ratio_phi)
+    ratio_real = ratio_mag * numpy.cos(ratio_phi)
     ratio_imag = ratio_mag * sin(ratio_phi)
-    impedance_uncal = [resistor * (ratio_real - 1),resistor * (ratio_imag)]
-    impedance = [impedance_uncal[0] - float(config['Calibration']['Rshort']),
-                 impedance_uncal[1]]
-    return impedance
+    return get_z_from_ratio(config, complex(ratio_real, ratio_imag),
+                            frequency, compensate)
+
+def get_z_from_ratio(config, ratio, frequency, compensate=True):
+    """Returns the [real, imaginary] impedance from the channel A /
+    channel B voltage ratio
+
+    The fixture's open/short/load table compensates the impedance if
+    there is one.  Otherwise Calibration/Rshort is subtracted.  ratio
+    and frequency can be numpy arrays, which return arrays of real and
+    imaginary parts.
+
+    Arguments:
+      config -- The configuration file object
+      ratio -- Complex ratio of the channel A and B phasors
+      frequency -- The frequency of the ratio (Hz)
+      compensate -- False to return the uncompensated impedance
+    """
+    resistor = float(config['Impedance']['resistor'])
+    impedance = resistor * (numpy.asarray(ratio, dtype=complex) - 1)
+    if compensate:
+        table = get_fixture(config)
+        if table is None:
+            impedance = impedance - float(config['Calibration']['Rshort'])
+        else:
+            impedance = fixture.correct(table, frequency, impedance)
+    if numpy.ndim(impedance) == 0:
+        return [float(impedance.real), float(impedance.imag)]
+    return [impedance.real, impedance.imag]
+
+def get_z_uncertainty(analysis):
+    """Returns the relative uncertainty of the impedance magnitude
+
+    The impedance comes from the ratio of the two channels' phasors,
+    so the relative noise of both channels adds.
+
+    Arguments:
+      analysis -- Dictionary returned by lockin.analyze()
+    """
+    snr = numpy.power(10, analysis['snr'][:, 0] / 20.0)
+    return numpy.sqrt(numpy.sum(1 / snr**2))
+
+def log_distortion(frequency, analysis):
+    """Log the distortion and signal-to-noise ratio of both channels
+
+    Arguments:
+      frequency -- The drive frequency
+      analysis -- Dictionary returned by lockin.analyze()
+    """
+    for channelnum, name in enumerate(['A', 'B']):
+        logger.debug('Channel %s THD is %0.3f %%, fundamental SNR is ' +
+                     '%0.1f dB', name, analysis['thd'][channelnum] * 100,
+                     analysis['snr'][channelnum][0])
+        for number in range(1, len(analysis['frequencies'])):
+            logger.debug('Channel %s harmonic %d is %0.3g Vp at ' +
+                         '%0.1f dB SNR', name, number + 1,
+                         analysis['amplitudes'][channelnum][number],
+                         analysis['snr'][channelnum][number])
+        if analysis['snr'][channelnum][0] < min_snr:
+            logger.warning('Channel %s SNR is only %0.1f dB at %0.2f Hz',
+                           name, analysis['snr'][channelnum][0], frequency)
+    logger.debug('Impedance uncertainty is about %0.2f %%',
+                 get_z_uncertainty(analysis) * 100)
+
+def get_unit_calfile(config, handle, units):
+    """Returns the calibration file name for a unit
+
+    Arguments:
+      config -- The configuration file object
+      handle -- Serial object for the CGR-101
+      units -- Number of units in use
+    """
+    calfile = config['Calibration']['calfile']
+    if units == 1:
+        return calfile
+    (root, extension) = os.path.splitext(calfile)
+    return root + '_' + os.path.basename(handle.port) + extension
+
+def init_unit(handle, config, calfile):
+    """Returns a dictionary for a configured CGR-101 unit.
+
+    The inputs are set to the configured gain, and the trigger to
+    channel A's rising edge at its mean voltage.  The dictionary has:
+      handle -- Serial object for the CGR-101
+      caldict -- The unit's calibration factors
+      gainlist -- Gain configuration
+      trigdict -- Trigger parameter dictionary
+      ratebits -- Sample rate setting last written by the sweep, or
+                  None
+      amplitude_set -- True once the sweep has set the drive amplitude
+
+    Arguments:
+      handle -- Serial object for the CGR-101
+      config -- The configuration file object
+      calfile -- Calibration file name
+    """
+    caldict = utils.load_cal(handle, calfile)
+    eeprom_list = utils.get_eeprom_offlist(handle)
+    # Configure the inputs for 10x gain
+    if (int(config['Inputs']['gain']) == 10):
+        gainlist = utils.set_hw_gain(handle,[1,1])
+    else:
+        gainlist = utils.set_hw_gain(handle,[0,0])
+    meanvolts = get_input_means(handle, gainlist, caldict)
+    logger.debug('Channel A mean is ' + '{:0.3f}'.format(meanvolts[0]) + ' V')
+    logger.debug('Channel B mean is ' + '{:0.3f}'.format(meanvolts[1]) + ' V')
+    # Configure the trigger:
+    #   Trigger on channel A
+    #   Trigger at channel A's mean voltage
+    #   Trigger on the rising edge
+    #   Capture 512 points after trigger
+    trigdict = utils.get_trig_dict(0,
+                                   meanvolts[0],
+                                   0,
+                                   512
+    )
+    if get_sweep_setting(config, 'forced'):
+        # Force a trigger for every capture instead
+        trigdict['trigsrc'] = 3
+    utils.set_trig_level(handle, caldict, gainlist, trigdict)
+    utils.set_trig_samples(handle,trigdict)
+    return {'handle': handle, 'caldict': caldict, 'gainlist': gainlist,
+            'trigdict': trigdict, 'ratebits': None, 'amplitude_set': False}
 
 def get_input_means(handle, gainlist, caldict):
     """Returns the mean voltages [chA mean, chB mean]
@@ -412,8 +654,8 @@ def get_input_means(handle, gainlist, caldict):
     [ctrl_reg, fsamp_act] = utils.set_ctrl_reg(handle, 1e5, trigdict)
     tracedata = utils.get_uncal_forced_data(handle,ctrl_reg)
     voltdata = utils.get_cal_data(caldict,gainlist,tracedata)
-    offsets.append(mean(voltdata[0]))
-    offsets.append(mean(voltdata[1]))
+    offsets.append(numpy.mean(voltdata[0]))
+    offsets.append(numpy.mean(voltdata[1]))
     return(offsets)
     
 
@@ -422,7 +664,7 @@ def wave_plot_init():
 
     """
     # Set debug=1 to see gnuplot commands during execution.
-    plotobj = Gnuplot.Gnuplot(debug=0)
+    plotobj = gplot.GnuplotPipe(debug=0)
     plotobj('set terminal x11') # Send a gnuplot command
     plotobj('set style data lines')
     plotobj('set key bottom left')
@@ -439,7 +681,7 @@ def magnitude_plot_init():
 
     """
     # Set debug=1 to see gnuplot commands during execution.
-    plotobj = Gnuplot.Gnuplot(debug=0)
+    plotobj = gplot.GnuplotPipe(debug=0)
     plotobj('set terminal x11') # Send a gnuplot command
     plotobj('set style data lines')
     plotobj('set key bottom left')
@@ -455,7 +697,7 @@ def real_plot_init():
     """Returns the configured gnuplot plot object for Real(impedance)
     """
     # Set debug=1 to see gnuplot commands during execution.
-    plotobj = Gnuplot.Gnuplot(debug=0)
+    plotobj = gplot.GnuplotPipe(debug=0)
     plotobj('set terminal x11') # Send a gnuplot command
     plotobj('set style data lines')
     plotobj('set key bottom left')
@@ -471,7 +713,7 @@ def capacitance_plot_init():
     """Returns the configured gnuplot plot object for capacitance
     """
     # Set debug=1 to see gnuplot commands during execution.
-    plotobj = Gnuplot.Gnuplot(debug=0)
+    plotobj = gplot.GnuplotPipe(debug=0)
     plotobj('set terminal x11') # Send a gnuplot command
     plotobj('set style data lines')
     plotobj('set key bottom left')
@@ -494,42 +736,27 @@ def plot_wave_data(plotobj, timedata, voltdata, trigdict, frequency, sine_vector
       frequency -- The frequency of the synthesized fit
       sine_vectors -- List of [real part, imaginary part] vectors
     """
-    fitdata = [[],[]]
-    for time in timedata:
-        for channelnum in range(2):
-            fitdata[channelnum].append(
-                2 * vector_length(sine_vectors[channelnum]) *
-                sin(2*pi*frequency*time + vector_angle(sine_vectors[channelnum])) +
-                mean(voltdata[channelnum])
-            )
-    plotitem_cha_raw = Gnuplot.PlotItems.Data(
-        timedata,voltdata[0],title='Channel A raw')
-    plotitem_chb_raw = Gnuplot.PlotItems.Data(
-        timedata,voltdata[1],title='Channel B raw')
-    plotitem_cha_recovered = Gnuplot.PlotItems.Data(
-        timedata,fitdata[0],title='Channel A recovered')
-    plotitem_chb_recovered = Gnuplot.PlotItems.Data(
-        timedata,fitdata[1],title='Channel B recovered')
-    plotobj.plot(plotitem_cha_raw,plotitem_chb_raw,
-                 plotitem_cha_recovered, plotitem_chb_recovered)
+    phasors = [complex(vector[0], vector[1]) for vector in sine_vectors]
+    fitdata = lockin.reconstruct(frequency, get_timelist_rate(timedata),
+                                 phasors, len(timedata),
+                                 numpy.mean(voltdata, axis=1))
+    plotobj.plot_traces(timedata,
+                        [voltdata[0], voltdata[1], fitdata[0], fitdata[1]],
+                        ['Channel A raw', 'Channel B raw',
+                         'Channel A recovered', 'Channel B recovered'])
     # Freeze the axis limits after the initial autoscale.
     plotobj('unset autoscale y')
     plotobj('set yrange [GPVAL_Y_MIN:GPVAL_Y_MAX]')
-    # Add the trigger crosshair
+    # Add the trigger crosshair.  Numbering the arrows replaces the
+    # crosshair from the last frame instead of adding another one.
     if (trigdict['trigsrc'] < 3):
         trigtime = timedata[1024-trigdict['trigpts']]
-        plotobj('set arrow from ' + str(trigtime) + ',graph 0 to ' +
+        plotobj('set arrow 1 from ' + str(trigtime) + ',graph 0 to ' +
                 str(trigtime) + ',graph 1 nohead linetype 0')
-        plotobj('set arrow from graph 0,first ' + str(trigdict['triglev']) +
+        plotobj('set arrow 2 from graph 0,first ' + str(trigdict['triglev']) +
                 ' to graph 1,first ' + str(trigdict['triglev']) +
                 ' nohead linetype 0')
         plotobj('replot')
-    savefilename = ('trig.eps')
-    plotobj('set terminal postscript eps color')
-    plotobj("set output '" + savefilename + "'")
-    plotobj('replot')
-    plotobj('set terminal x11')
-
 
 def plot_magnitude_data(plotobj, frequencies, impedances):
     """Plot impedance magnitude data.
@@ -543,14 +770,7 @@ def plot_magnitude_data(plotobj, frequencies, impedances):
     magnitudes = []
     for z in impedances:
         magnitudes.append(vector_length(z))
-    plotitem_zmag = Gnuplot.PlotItems.Data(
-        frequencies,magnitudes,title='Impedance magnitude')
-    plotobj.plot(plotitem_zmag)
-    savefilename = ('zmag.eps')
-    plotobj('set terminal postscript eps color')
-    plotobj("set output '" + savefilename + "'")
-    plotobj('replot')
-    plotobj('set terminal x11')
+    plotobj.plot_traces(frequencies, [magnitudes], ['Impedance magnitude'])
 
 def plot_real_data(plotobj, frequencies, impedances):
     """Plot Real(Z) data
@@ -564,14 +784,7 @@ def plot_real_data(plotobj, frequencies, impedances):
     resistances = []
     for z in impedances:
         resistances.append(z[0])
-    plotitem_zreal = Gnuplot.PlotItems.Data(
-        frequencies,resistances,title='Resistance')
-    plotobj.plot(plotitem_zreal)
-    savefilename = ('zreal.eps')
-    plotobj('set terminal postscript eps color')
-    plotobj("set output '" + savefilename + "'")
-    plotobj('replot')
-    plotobj('set terminal x11')
+    plotobj.plot_traces(frequencies, [resistances], ['Resistance'])
 
 def plot_capacitance_data(plotobj, frequencies, impedances):
     """Plot capacitances calculated from impedances
@@ -585,126 +798,561 @@ def plot_capacitance_data(plotobj, frequencies, impedances):
     capacitances = []
     for frequency, impedance in zip(frequencies, impedances):
         capacitances.append(-1/(2 * pi * frequency * impedance[1]))
-    plotitem_zcap = Gnuplot.PlotItems.Data(
-        frequencies, capacitances, title='Capacitance')
-    plotobj.plot(plotitem_zcap)
-    savefilename = ('zcap.eps')
-    plotobj('set terminal postscript eps color')
-    plotobj("set output '" + savefilename + "'")
-    plotobj('replot')
-    plotobj('set terminal x11')
+    plotobj.plot_traces(frequencies, [capacitances], ['Capacitance'])
+
+def plot_sweep_frame(plots, timedata, voltdata, trigdict, frequency,
+                     sine_vectors, frequencies, impedances):
+    """Draw all the plots for one sweep point.
+
+    This runs in the render thread.
+
+    Arguments:
+      plots -- [wave plot, magnitude plot, real plot, capacitance plot]
+      timedata -- List of sample times
+      voltdata -- 1024 x 2 list of voltage samples
+      trigdict -- Trigger parameter dictionary
+      frequency -- The drive frequency
+      sine_vectors -- List of [real part, imaginary part] vectors
+      frequencies -- List of drive frequencies measured so far
+      impedances -- List of [real, imaginary] impedances measured so far
+    """
+    plot_wave_data(plots[0], timedata, voltdata, trigdict, frequency,
+                   sine_vectors)
+    if (len(frequencies) > 1):
+        plot_magnitude_data(plots[1], frequencies, impedances)
+        plot_real_data(plots[2], frequencies, impedances)
+        plot_capacitance_data(plots[3], frequencies, impedances)
+
+def export_sweep_plots(plots, frequencies):
+    """Save the sweep plots as eps files.
+
+    This runs in the render thread when the sweep finishes, or when
+    SIGUSR1 asks for an export.
+
+    Arguments:
+      plots -- [wave plot, magnitude plot, real plot, capacitance plot]
+      frequencies -- List of drive frequencies measured so far.  The
+                     impedance plots are only drawn once there are two.
+    """
+    render.export_plot(plots[0], 'trig.eps', gplot.default_term)
+    if (len(frequencies) > 1):
+        for plotobj, filename in zip(plots[1:], ['zmag.eps', 'zreal.eps',
+                                                 'zcap.eps']):
+            render.export_plot(plotobj, filename, gplot.default_term)
+
+def get_volt_scale(config, caldict, gainlist):
+    """Returns a numpy array of the volts per ADC count of each channel
+
+    Calibrated voltages are (511 - (count + offset)) * slope, so
+    anything that ignores the offsets, like demodulation, can scale
+    counts by this instead.
+
+    Arguments:
+      config -- The configuration file object
+      caldict -- A dictionary of (calibration factor names) : values
+      gainlist -- Gain configuration
+    """
+    scale = []
+    for (channel, gain) in zip(['chA', 'chB'], gainlist):
+        if gain == 0:
+            scale.append(-caldict[channel + '_1x_slope'])
+        else:
+            scale.append(-caldict[channel + '_10x_slope'])
+    scale = numpy.array(scale, dtype=float)
+    if (int(config['Inputs']['gain']) == 10):
+        # Divide by 10 for 10x hardware gain with no probe
+        scale /= 10
+    return scale
+
+def get_volt_data(config, caldict, gainlist, tracedata):
+    """Returns calibrated voltages from a capture or an average of them
+
+    Arguments:
+      config -- The configuration file object
+      caldict -- A dictionary of (calibration factor names) : values
+      gainlist -- Gain configuration
+      tracedata -- 1024 x 2 list of ADC counts
+    """
+    voltdata = utils.get_cal_data(caldict,gainlist,tracedata)
+    if (int(config['Inputs']['gain']) == 10):
+        # Divide by 10 for 10x hardware gain with no probe
+        voltdata = numpy.divide(voltdata,10)
+    return voltdata
+
+def acquire_point(handle, config, caldict, gainlist, trigdict, step,
+                  setamp, harmonics=3):
+    """Returns the averaged phasors at one sweep frequency.
+
+    Each capture is demodulated as soon as it arrives, and its phasors
+    are averaged after shifting them so channel A's fundamental has
+    zero phase.  Only the last capture is kept, so averaging works
+    without a trigger and takes the same memory for any number of
+    captures.
+
+    This runs in the acquisition thread during a pipelined sweep.  The
+    return value is a dictionary of:
+      frequency -- The drive frequency set by the hardware (Hz)
+      rate -- The sample rate (Hz)
+      timedata -- List of sample times
+      voltdata -- 1024 x 2 list of voltage samples from the last
+                  capture
+      phasors -- Averaged complex amplitude of each channel's
+                 fundamental (see lockin.demodulate), in the last
+                 capture's phase
+      bins -- Averaged lockin.demodulate_bins() phasors at the
+              lockin.get_bins() tones and noise frequencies, in the last
+              capture's phase
+      averages -- Number of acquisitions averaged
+      discarded -- Number of acquisitions discarded while settling
+      stderr -- Relative standard error of the impedance, or None
+                after one acquisition.  This is the impedance before
+                fixture compensation, which is what the captures'
+                noise affects.
+
+    Arguments:
+      handle -- Serial object for the CGR-101
+      config -- The configuration file object
+      caldict -- A dictionary of (calibration factor names) : values
+      gainlist -- Gain configuration
+      trigdict -- Trigger parameter dictionary
+      step -- Planned step from get_sweep_plan()
+      setamp -- True to also set the drive amplitude
+      harmonics -- Number of harmonics to measure
+    """
+    # The actual frequency will be determined by the hardware
+    actfreq = utils.set_sine_frequency(handle, float(step['frequency']))
+    logger.debug('Requested %0.2f Hz, set %0.2f Hz',
+                 float(step['frequency']), actfreq)
+    if setamp:
+        # Only set amplitude once
+        actamp = utils.set_output_amplitude(handle, float(config['Sweep']['amplitude']))
+        logger.debug('Requested %0.2f Vp, set %0.2f Vp',
+                     float(config['Sweep']['amplitude']), actamp)
+    if step['set_rate']:
+        # The trigger settings share the control register
+        utils.set_ctrl_reg(handle, step['rate'], trigdict)
+    actrate = step['rate']
+    logger.debug('Sample rate set to %0.2f Hz, for an acquisition time ' +
+                 'of %0.2f milliseconds', actrate, 1024/actrate * 1000)
+    timedata = utils.get_timelist(actrate)
+    (tones, noisebins) = lockin.get_bins(actfreq, actrate, harmonics)
+    binfreqs = tones + noisebins
+    scale = get_volt_scale(config, caldict, gainlist)[:, numpy.newaxis]
+    ctrl_reg = utils.get_ctrl_reg(actrate, trigdict)[0]
+    averages = int(config['Sweep']['averages'])
+    tolerance = get_sweep_setting(config, 'tolerance')
+    maxaverages = max(int(get_sweep_setting(config, 'maxaverages')), averages)
+    settle = get_sweep_setting(config, 'settle') * pi/180
+    if tolerance > 0:
+        lastaverage = maxaverages
+    else:
+        lastaverage = averages
+    phasorstats = stats.RunningStats() # Fundamental of each channel
+    binstats = stats.RunningStats() # Harmonics and noise bins
+    zstats = stats.RunningStats()
+    settled = (settle <= 0)
+    lastphase = None # Phase between the channels in the last acquisition
+    discarded = 0
+    capturenum = 0
+    while True:
+        if trigdict['trigsrc'] == 3:
+            # Internal trigger
+            tracedata = utils.get_uncal_forced_data(handle,ctrl_reg)
+        elif trigdict['trigsrc'] < 3:
+            # Trigger on a voltage present at some input
+            tracedata = utils.get_uncal_triggered_data(handle,trigdict)
+        with timing.phase('averaging'):
+            # Demodulation removes the offsets, so the phasors of the
+            # ADC counts only need scaling to volts.
+            codes = numpy.asarray(tracedata, dtype=float)
+            phasors = lockin.demodulate(actfreq, actrate, codes) * scale[:, 0]
+        phase = numpy.angle(phasors[0]) - numpy.angle(phasors[1])
+        if not settled:
+            if lastphase is not None:
+                # Wrap the change to +/- pi
+                change = abs(numpy.angle(numpy.exp(1j*(phase - lastphase))))
+                settled = (change <= settle)
+            if not settled and discarded == max_settle_captures:
+                logger.warning('Phase did not settle at %0.2f Hz', actfreq)
+                settled = True
+            if not settled:
+                lastphase = phase
+                discarded += 1
+                logger.debug('Discarding acquisition %d while the phase ' +
+                             'settles', discarded)
+                continue
+        with timing.phase('averaging'):
+            # Refer every capture to channel A's phase, so captures
+            # starting anywhere in the waveform average coherently
+            reference = numpy.angle(phasors[0])
+            phasorstats.add(phasors * numpy.exp(-1j * reference))
+            bins = lockin.demodulate_bins(binfreqs, actrate, codes) * scale
+            binstats.add(lockin.shift_phasors(actfreq, binfreqs, bins,
+                                              -reference))
+            impedance = get_z_from_ratio(config, phasors[0] / phasors[1],
+                                         actfreq, compensate=False)
+            zstats.add(complex(impedance[0], impedance[1]))
+        capturenum += 1
+        logger.info('Acquiring trace %d of %d', capturenum, lastaverage)
+        if capturenum >= lastaverage:
+            break
+        if tolerance > 0 and capturenum >= averages:
+            stderr = zstats.get_relative_stderr()
+            if stderr is not None and stderr <= tolerance:
+                break
+    # Keep the last capture to plot, with the averages shifted to its
+    # phase
+    voltdata = get_volt_data(config, caldict, gainlist, tracedata)
+    logger.debug('Averaged %d acquisitions, impedance standard ' +
+                 'error is %0.3g %%', capturenum,
+                 (zstats.get_relative_stderr() or 0) * 100)
+    return {'frequency': actfreq, 'rate': actrate, 'timedata': timedata,
+            'voltdata': voltdata,
+            'phasors': phasorstats.mean * numpy.exp(1j * reference),
+            'bins': lockin.shift_phasors(actfreq, binfreqs, binstats.mean,
+                                         reference),
+            'averages': capturenum, 'discarded': discarded,
+            'stderr': zstats.get_relative_stderr()}
+
+def analyze_point(config, harmonics, point, compensate=True):
+    """Returns the lock-in results for one sweep point.
+
+    The return value is a dictionary of:
+      sine_vectors -- List of [real part, imaginary part] vectors
+      impedance -- [real, imaginary] impedance
+      analysis -- Harmonic and noise dictionary from
+                  lockin.analyze_phasors()
+
+    Arguments:
+      config -- The configuration file object
+      harmonics -- Number of harmonics acquire_point() measured
+      point -- Dictionary returned by acquire_point()
+      compensate -- False to skip the fixture compensation
+    """
+    actfreq = point['frequency']
+    timedata = point['timedata']
+    voltdata = point['voltdata']
+    with timing.phase('demodulation'):
+        sine_vectors = [[phasor.real, phasor.imag]
+                        for phasor in point['phasors']]
+        analysis = lockin.analyze_phasors(actfreq, point['rate'],
+                                          point['bins'], harmonics)
+    logger.debug('Channel A amplitude is %0.3f Vp',
+                 2*vector_length(sine_vectors[0]))
+    logger.debug('Channel B amplitude is %0.3f Vp',
+                 2*vector_length(sine_vectors[1]))
+    logger.debug('Channel A phase shift is %0.3f degrees',
+                 vector_angle(sine_vectors[0]) * 180/pi)
+    logger.debug('Channel B phase shift is %0.3f degrees',
+                 vector_angle(sine_vectors[1]) * 180/pi)
+    with timing.phase('impedance'):
+        impedance = get_z_vector(config, actfreq, timedata, voltdata,
+                                 sine_vectors, compensate)
+    logger.debug('Impedance magnitude is %0.3f Ohms',
+                 vector_length(impedance))
+    logger.debug('Impedance angle is %0.3f degrees',
+                 vector_angle(impedance) * 180/pi)
+    log_distortion(actfreq, analysis)
+    return {'sine_vectors': sine_vectors, 'impedance': impedance,
+            'analysis': analysis}
+
+def get_multisine_bands(config):
+    """Returns the multisine bands covering the sweep range.  See
+    multisine.get_bands for the band dictionaries.
+
+    Arguments:
+      config -- The configuration file object
+    """
+    tones = multisine.get_tones(int(get_sweep_setting(config, 'tones')))
+    return multisine.get_bands(float(config['Sweep']['start']),
+                               float(config['Sweep']['stop']), tones)
+
+def measure_multisine(handle, config, caldict, gainlist, trigdict, submit,
+                      skip=()):
+    """Measures the sweep range with a multisine.  Returns the
+    frequencies whose signal-to-noise ratio was below min_snr.
+
+    The multisine is loaded into the arbitrary waveform buffer, and
+    the sine wave is loaded back when the measurement is done.  Every
+    band of frequencies is averaged over Sweep/averages captures by
+    averaging the channel ratio, so captures don't have to be aligned.
+
+    Arguments:
+      handle -- Serial object for the CGR-101
+      config -- The configuration file object
+      caldict -- A dictionary of (calibration factor names) : values
+      gainlist -- Gain configuration
+      trigdict -- Trigger parameter dictionary
+      submit -- Called with each band's (frequencies, impedances, snrs
+                in dB, point) as it's measured, where point is a
+                dictionary like acquire_point() returns, without
+                discarded and stderr, plus the band's fundamental
+      skip -- Fundamentals (Hz) of bands that are already measured
+    """
+    tones = multisine.get_tones(int(get_sweep_setting(config, 'tones')))
+    bands = [band for band in get_multisine_bands(config)
+             if band['fundamental'] not in skip]
+    if not bands:
+        return []
+    averages = int(config['Sweep']['averages'])
+    (table, crest) = multisine.get_table(tones)
+    logger.info('Measuring %d tones in %d bands with a multisine (crest ' +
+                'factor %0.2f)', sum(len(band['tones']) for band in bands),
+                len(bands), crest)
+    logger.info('Loading the waveform buffer takes about %0.0f seconds',
+                2 * multisine.table_length * utils.cmddelay)
+    lowsnr = []
+    utils.set_output_amplitude(handle, 0)
+    utils.set_arb_waveform(handle, table)
+    try:
+        utils.set_output_amplitude(handle, float(config['Sweep']['amplitude']))
+        for band in bands:
+            # Half the generator resolution makes the hardware round
+            # to the nearest setting instead of rounding down.
+            utils.set_sine_frequency(handle, band['fundamental'] +
+                                     utils.fresolution/2)
+            ctrl_reg = utils.set_ctrl_reg(handle, band['rate'], trigdict)[0]
+            timedata = utils.get_timelist(band['rate'])
+            ratiostats = stats.RunningStats()
+            snrsum = 0
+            for capturenum in range(averages):
+                logger.info('Acquiring trace %d of %d at %0.2f Hz',
+                            capturenum + 1, averages, band['fundamental'])
+                if trigdict['trigsrc'] == 3:
+                    # Internal trigger
+                    tracedata = utils.get_uncal_forced_data(handle, ctrl_reg)
+                else:
+                    # Trigger on a voltage present at some input
+                    tracedata = utils.get_uncal_triggered_data(handle,
+                                                               trigdict)
+                voltdata = get_volt_data(config, caldict, gainlist, tracedata)
+                (ratios, snr) = multisine.analyze(voltdata, band['tones'])
+                ratiostats.add(ratios)
+                snrsum = snrsum + snr
+            # Averaging the ratio improves the SNR by the number of
+            # captures
+            snrdb = 10 * numpy.log10(numpy.min(snrsum, axis=0))
+            frequencies = [tone * band['fundamental'] for tone in band['tones']]
+            impedances = zip(*get_z_from_ratio(config, ratiostats.mean,
+                                               frequencies))
+            for frequency, tonesnr in zip(frequencies, snrdb):
+                if tonesnr < min_snr:
+                    logger.debug('SNR is only %0.1f dB at %0.2f Hz',
+                                 tonesnr, frequency)
+                    lowsnr.append(frequency)
+            submit(frequencies, impedances, snrdb,
+                   {'frequency': frequencies[0], 'rate': band['rate'],
+                    'fundamental': band['fundamental'],
+                    'timedata': timedata, 'voltdata': voltdata,
+                    'averages': averages, 'trigdict': trigdict})
+    finally:
+        utils.set_output_amplitude(handle, 0)
+        utils.set_arb_waveform(handle, multisine.get_sine_table())
+    return lowsnr
 
 
 # ------------------------- Main procedure ----------------------------
-def main():
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.fixture_cal and args.multisine:
+        parser.error('--fixture-cal measures standards with sine steps, ' +
+                     'not --multisine')
+    (ch,fh) = logutils.init_logging('cgrimp.log')
+    if args.timing:
+        timing.dump_at_exit(args.timing)
+        if hasattr(signal, 'SIGUSR2'):
+            signal.signal(signal.SIGUSR2,
+                          lambda signum, frame: timing.dump(args.timing))
     logger.debug('Utility module number is ' + str(utils.utilnum))
     config = load_config(args.rcfile)
-    global ch,fh # Need to modify console and file logger handlers
-                 # with the config file, from inside main().  They
-                 # thus must be made global.
     (ch,fh) = init_logger(config,ch,fh)
-    cgr = utils.get_cgr(config)
-    caldict = utils.load_cal(cgr, config['Calibration']['calfile'])
-    eeprom_list = utils.get_eeprom_offlist(cgr)
-    # Configure the inputs for 10x gain
-    if (int(config['Inputs']['gain']) == 10):
-        gainlist = utils.set_hw_gain(cgr,[1,1])
+    if args.devices:
+        handles = utils.get_cgr_list(config)
+        logger.info('Sweeping with %d units', len(handles))
     else:
-        gainlist = utils.set_hw_gain(cgr,[0,0])
-    meanvolts = get_input_means(cgr, gainlist, caldict)
-    logger.debug('Channel A mean is ' + '{:0.3f}'.format(meanvolts[0]) + ' V')
-    logger.debug('Channel B mean is ' + '{:0.3f}'.format(meanvolts[1]) + ' V')
-    # Configure the trigger:
-    #   Trigger on channel A
-    #   Trigger at channel A's mean voltage
-    #   Trigger on the rising edge
-    #   Capture 512 points after trigger
-    trigdict = utils.get_trig_dict(0,
-                                   meanvolts[0],
-                                   0,
-                                   512
-    )
-    utils.set_trig_level(cgr, caldict, gainlist, trigdict)
-    utils.set_trig_samples(cgr,trigdict)
-    waveplot = wave_plot_init()
-    magplot = magnitude_plot_init()
-    realplot = real_plot_init()
-    capplot = capacitance_plot_init()
+        handles = [utils.get_cgr(config)]
+    units = [init_unit(handle, config,
+                       get_unit_calfile(config, handle, len(handles)))
+             for handle in handles]
     freqlist = get_sweep_list(config)
+    if args.multisine:
+        mode = 'multisine'
+    else:
+        mode = 'sine'
+    if args.fixture_cal:
+        if not get_cal_setting(config, 'fixture'):
+            parser.error('Set Calibration/fixture to save the standard')
+        logger.info('Measuring the %s standard', args.fixture_cal)
+        mode += ' fixture-cal ' + args.fixture_cal
+    elif get_fixture(config) is not None:
+        description = fixture.get_description(get_fixture(config))
+        logger.info('Fixture compensation uses %s', description)
+        mode += ' fixture ' + description
+    resultsfile = results.ResultsFile(
+        args.results,
+        results.get_config_hash(config,
+                                [sweepunit['caldict'] for sweepunit in units],
+                                mode),
+        args.resume)
     drive_frequency_list = []
     impedance_list = []
-    for progfreq in freqlist:
-        # The actual frequency will be determined by the hardware
-        actfreq = utils.set_sine_frequency(cgr, float(progfreq))
-        drive_frequency_list.append(actfreq)
-        logger.debug('Requested ' + '{:0.2f}'.format(float(progfreq)) +
-                     ' Hz, set ' + '{:0.2f}'.format(actfreq) + ' Hz')
-        if (progfreq == freqlist[0]):
-            # Only set amplitude once
-            actamp = utils.set_output_amplitude(cgr, float(config['Sweep']['amplitude']))
-            logger.debug('Requested ' + '{:0.2f}'.format(float(config['Sweep']['amplitude'])) +
-                         ' Vp, set ' + '{:0.2f}'.format(actamp) + ' Vp')
-        actrate = set_sample_rate(cgr, config, actfreq, trigdict)
-        logger.debug('Sample rate set to ' + '{:0.2f}'.format(actrate) +
-                     ' Hz, for an acquisition time of ' + '{:0.2f}'.format(1024/actrate * 1000) +
-                     ' milliseconds'
-                     )
-        for capturenum in range(int(config['Sweep']['averages'])):
-            if trigdict['trigsrc'] == 3:
-                # Internal trigger
-                tracedata = utils.get_uncal_forced_data(cgr,ctrl_reg)
-            elif trigdict['trigsrc'] < 3:
-                # Trigger on a voltage present at some input
-                tracedata = utils.get_uncal_triggered_data(cgr,trigdict)
-            logger.info('Acquiring trace ' + str(capturenum + 1) + ' of ' +
-                        str(int(config['Sweep']['averages']))     
-            )
-            if capturenum == 0:
-                sumdata = tracedata
-            else:
-                sumdata = add(sumdata,tracedata)
-            avgdata = divide(sumdata,float(capturenum +1))
-            # Apply calibration
-            voltdata = utils.get_cal_data(caldict,gainlist,avgdata)
-            if (int(config['Inputs']['gain']) == 10):
-                # Divide by 10 for 10x hardware gain with no probe
-                voltdata = divide(voltdata,10)
-            timedata = utils.get_timelist(actrate)
-        sine_vectors = get_sine_vectors(actfreq, timedata, voltdata)
-        logger.debug('Channel A amplitude is ' +
-                     '{:0.3f}'.format(2*vector_length(sine_vectors[0])) +
-                     ' Vp'
-        )
-        logger.debug('Channel B amplitude is ' +
-                     '{:0.3f}'.format(2*vector_length(sine_vectors[1])) +
-                     ' Vp'
-        )     
-        logger.debug('Channel A phase shift is ' +
-                     '{:0.3f}'.format(vector_angle(sine_vectors[0]) * 180/pi) +
-                     ' degrees'
-        )
-        logger.debug('Channel B phase shift is ' +
-                     '{:0.3f}'.format(vector_angle(sine_vectors[1]) * 180/pi) +
-                     ' degrees'
-        )
-        plot_wave_data(waveplot, timedata, voltdata, trigdict, actfreq, sine_vectors)        
-        impedance = get_z_vector(config, actfreq, timedata, voltdata)
-        logger.debug('Impedance magnitude is ' +
-                     '{:0.3f}'.format(vector_length(impedance)) +
-                     ' Ohms'
-        )
-        logger.debug('Impedance angle is ' +
-                     '{:0.3f}'.format(vector_angle(impedance) * 180/pi) +
-                     ' degrees'
+    if args.headless:
+        plots = None
+        renderer = render.NullRenderer()
+    else:
+        gnuplot_init()
+        plots = [wave_plot_init(), magnitude_plot_init(), real_plot_init(),
+                 capacitance_plot_init()]
+        # Plot in the background so the sweep never waits for gnuplot
+        renderer = render.RenderWorker(
+            plot_sweep_frame,
+            lambda: export_sweep_plots(plots, drive_frequency_list)
         )
-        impedance_list.append(impedance)
-        if (len(drive_frequency_list) > 1):
-            plot_magnitude_data(magplot, drive_frequency_list, impedance_list)
-            plot_real_data(realplot, drive_frequency_list, impedance_list)
-            plot_capacitance_data(capplot, drive_frequency_list, impedance_list)
+    renderer.start()
+    if args.metrics or args.status:
+        metrics.register_gauge('cgr_log_queue_depth',
+                               logutils.get_queue_depth)
+        metrics.register_gauge('cgr_plot_queue_depth',
+                               renderer.get_queue_depth)
+        exporter = metrics.MetricsExporter(args.metrics, args.status,
+                                           args.metrics_interval)
+        exporter.start()
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1,
+                      lambda signum, frame: renderer.request_export())
+    def store(frequency, impedance):
+        # Keep the results in frequency order for plotting
+        index = bisect.bisect(drive_frequency_list, frequency)
+        drive_frequency_list.insert(index, frequency)
+        impedance_list.insert(index, impedance)
+    def submit_multisine(frequencies, impedances, snrs, point):
+        # Every tone records its band's fundamental as the requested
+        # frequency, so a resumed sweep knows which bands are done
+        for frequency, impedance, snr in zip(frequencies, impedances, snrs):
+            resultsfile.append({'requested': point['fundamental'],
+                                'frequency': frequency,
+                                'z_real': impedance[0],
+                                'z_imag': impedance[1],
+                                'averages': point['averages'],
+                                'snr': snr, 'method': 'multisine'})
+            if snr >= min_snr:
+                store(frequency, impedance)
+        sine_vectors = get_sine_vectors(point['frequency'],
+                                        point['timedata'], point['voltdata'])
+        renderer.submit(plots, point['timedata'], point['voltdata'],
+                        point['trigdict'], point['frequency'], sine_vectors,
+                        list(drive_frequency_list), list(impedance_list))
+    # Load the points an interrupted sweep already measured
+    measured = set()
+    bandrecords = {} # {band fundamental : [multisine records]}
+    for record in resultsfile.records:
+        if record['method'] == 'sine':
+            measured.add(record['requested'])
+            store(record['frequency'], [record['z_real'], record['z_imag']])
+        else:
+            bandrecords.setdefault(record['requested'], []).append(record)
+    if args.multisine:
+        lowsnr = []
+        bandsdone = set()
+        for band in get_multisine_bands(config):
+            records = bandrecords.get(band['fundamental'], [])
+            if len(records) < len(band['tones']):
+                # The sweep was interrupted before this band was
+                # written.  Measure it again.
+                continue
+            bandsdone.add(band['fundamental'])
+            # A band measured again follows its partial records
+            for record in records[len(records) - len(band['tones']):]:
+                if record['snr'] >= min_snr:
+                    store(record['frequency'],
+                          [record['z_real'], record['z_imag']])
+                else:
+                    lowsnr.append(record['frequency'])
+        if bandsdone:
+            logger.info('Skipping %d multisine bands already in %s',
+                        len(bandsdone), args.results)
+        # The multisine only needs one unit
+        unit = units[0]
+        lowsnr += measure_multisine(unit['handle'], config,
+                                    unit['caldict'], unit['gainlist'],
+                                    unit['trigdict'], submit_multisine,
+                                    bandsdone)
+        # Only use sine steps where the multisine wasn't good enough
+        freqlist = sorted(lowsnr)
+    # Points measured beyond the planned ones were refinements
+    refined = len(measured.difference(freqlist))
+    freqlist = [frequency for frequency in freqlist
+                if frequency not in measured]
+    if measured:
+        logger.info('Skipping %d points already in %s', len(measured),
+                    args.results)
+    # Plan every point's settings before starting
+    sweepplan = get_sweep_plan(config, freqlist, None)
+    def get_acquire(unit):
+        def acquire(step):
+            # Each unit's control register holds its own sample rate
+            step = dict(step, set_rate=(step['ratebits'] != unit['ratebits']))
+            point = acquire_point(unit['handle'], config, unit['caldict'],
+                                  unit['gainlist'], unit['trigdict'], step,
+                                  not unit['amplitude_set'], args.harmonics)
+            unit['ratebits'] = step['ratebits']
+            unit['amplitude_set'] = True
+            point['trigdict'] = unit['trigdict']
+            return point
+        return acquire
+    acquires = [get_acquire(sweepunit) for sweepunit in units]
+    def analyze(step, point):
+        result = analyze_point(config, args.harmonics, point,
+                               not args.fixture_cal)
+        store(point['frequency'], result['impedance'])
+        resultsfile.append({
+            'requested': step['frequency'],
+            'frequency': point['frequency'],
+            'z_real': result['impedance'][0],
+            'z_imag': result['impedance'][1],
+            'amplitude_a': 2 * vector_length(result['sine_vectors'][0]),
+            'amplitude_b': 2 * vector_length(result['sine_vectors'][1]),
+            'averages': point['averages'], 'stderr': point['stderr'],
+            'snr': numpy.min(result['analysis']['snr'][:, 0]),
+            'method': 'sine'})
+        renderer.submit(plots, point['timedata'], point['voltdata'],
+                        point['trigdict'], point['frequency'],
+                        result['sine_vectors'],
+                        list(drive_frequency_list), list(impedance_list))
+    # Retune and capture the next point while this one is analysed
+    sweep.run_distributed(acquires, analyze, sweepplan, args.pipeline_depth)
+    # Add points where the impedance changes quickly
+    budget = int(get_sweep_setting(config, 'refine')) - refined
+    while budget > 0:
+        newfreqs = sweep.get_refinements(
+            drive_frequency_list, impedance_list,
+            get_sweep_setting(config, 'refine_db'),
+            get_sweep_setting(config, 'refine_degrees'), budget)
+        if not newfreqs:
+            break
+        logger.info('Refining the sweep with %d more points', len(newfreqs))
+        budget -= len(newfreqs)
+        refineplan = get_sweep_plan(config, newfreqs, units[0]['ratebits'])
+        if not refineplan:
+            break
+        sweep.run_distributed(acquires, analyze, refineplan,
+                              args.pipeline_depth)
     # Set amplitude to zero to end the sweep
-    utils.set_output_amplitude(cgr, 0.01)
-    raw_input('Press any key to close plot and exit...')
+    for unit in units:
+        utils.set_output_amplitude(unit['handle'], 0.01)
+    resultsfile.close()
+    if args.fixture_cal:
+        table = get_fixture(config) or fixture.new_table()
+        fixture.set_standard(table, args.fixture_cal, drive_frequency_list,
+                             impedance_list,
+                             float(get_cal_setting(config, 'Rload')))
+        fixture.save_table(get_cal_setting(config, 'fixture'), table)
+    renderer.finish() # Draw and export the final plots
+    if args.metrics or args.status:
+        exporter.finish()
+    if not args.headless:
+        raw_input('Press any key to close plot and exit...')
 
 
 
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+# cgr_query.py
+#
+# Queries the captures stored in a capture archive
+
+import time     # For formatting times
+import sys # For sys.exit()
+
+# --------------------- Configure argument parsing --------------------
+import argparse
+
+def get_parser():
+    """Returns the command-line argument parser"""
+    parser = argparse.ArgumentParser(
+       formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+       description="Examples: 'cgr-query archive -s vpp -c B -b 3600 -g max' " +
+       "gives the largest peak to peak voltage on channel B in every hour. " +
+       "'cgr-query archive -s max -c A --above 5' lists the captures where " +
+       "channel A exceeded 5V."
+    )
+    parser.add_argument("archive", help="Capture archive directory")
+    parser.add_argument("-s", "--stat", default="max",
+                        choices=["min", "max", "mean", "rms", "vpp", "crossings"],
+                        help="Statistic computed for every capture"
+    )
+    parser.add_argument("-c", "--channel", default="A", choices=["A", "B"],
+                        help="Channel to examine"
+    )
+    parser.add_argument("-b", "--bucket", type=float, default=None,
+                        help="Group captures into buckets this many seconds wide"
+    )
+    parser.add_argument("-g", "--aggregate", default="max",
+                        choices=["count", "sum", "mean", "min", "max"],
+                        help="How the statistics in each bucket are combined"
+    )
+    parser.add_argument("--above", type=float, default=None,
+                        help="List captures whose statistic is above this value"
+    )
+    parser.add_argument("-t", "--threshold", type=float, default=0.0,
+                        help="Level counted by the crossings statistic"
+    )
+    parser.add_argument("--start", default=None,
+                        help="Earliest capture time to examine " +
+                        "('YYYY-MM-DD HH:MM:SS' or seconds since the epoch)"
+    )
+    parser.add_argument("--stop", default=None,
+                        help="Examine captures taken before this time"
+    )
+    parser.add_argument("--calfile", default="cgrcal.pkl",
+                        help="Calibration file used to convert counts to volts"
+    )
+    parser.add_argument("--raw", action="store_true",
+                        help="Examine raw ADC counts instead of volts"
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of worker processes (default: one per CPU)"
+    )
+    parser.add_argument("-o", "--outfile", default=None,
+                        help="Write results to this CSV file instead of the " +
+                        "terminal"
+    )
+    return parser
+
+#---------------- Done with configuring argument parsing --------------
+
+
+#------------------------- Configure logging --------------------------
+import logging
+
+# create logger.  The console and file handlers are attached by
+# logutils.init_logging() when main() runs, so importing this
+# module doesn't open the log file or load colorlog.
+logger = logging.getLogger('root')
+
+# --------------- Done with logging configuration ---------------------
+
+# Bring in the utility functions.  These will use the same logger
+# as the root application.
+from cgrlib import utils
+from cgrlib import logutils
+from cgrlib import lazy
+
+# These need numpy, which is only imported when it's first used
+query = lazy.LazyModule('cgrlib.query')
+writers = lazy.LazyModule('cgrlib.writers')
+
+
+def format_time(timestamp):
+    """Return a capture time as 'YYYY-MM-DD HH:MM:SS'
+
+    Arguments:
+      timestamp -- Seconds since the epoch
+    """
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+
+def get_result_lines(results, aggregate, stat):
+    """Return the CSV lines reporting a query's results
+
+    Arguments:
+      results -- Dictionary returned by query.run_query
+      aggregate -- How buckets are reported (see query.aggregates)
+      stat -- The per-capture statistic
+    """
+    lines = []
+    if results['buckets']:
+        lines.append('bucket_start,captures,' + aggregate + '_' + stat)
+        for (start, bucket) in results['buckets']:
+            lines.append(format_time(start) + ',' + str(bucket[0]) + ',' +
+                         '{:0.6e}'.format(
+                             query.get_aggregate(bucket, aggregate)))
+    if results['matches']:
+        lines.append('seq,timestamp,' + stat)
+        for (seq, timestamp, value) in results['matches']:
+            lines.append(str(seq) + ',' + format_time(timestamp) + ',' +
+                         '{:0.6e}'.format(value))
+    return lines
+
+
+# ------------------------- Main procedure ----------------------------
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    (ch,fh) = logutils.init_logging('cgrlog.log')
+    logger.debug('Utility module number is ' + str(utils.utilnum))
+    if args.bucket is None and args.above is None:
+        logger.error('Choose time buckets (--bucket) and/or a threshold ' +
+                     '(--above)')
+        sys.exit(1)
+    if args.raw:
+        caldict = None
+    else:
+        caldict = utils.load_cal_file(args.calfile)
+    try:
+        start = utils.parse_time(args.start)
+        stop = utils.parse_time(args.stop)
+    except ValueError as ex:
+        logger.error(str(ex))
+        sys.exit(1)
+    try:
+        results = query.run_query(
+            args.archive, args.stat, ['A', 'B'].index(args.channel),
+            caldict, start, stop, args.bucket, args.above, args.threshold,
+            args.jobs
+        )
+    except IOError:
+        logger.error('Did not find a capture archive in ' + args.archive)
+        sys.exit(1)
+    logger.info('Examined ' + str(results['captures']) + ' captures')
+    lines = get_result_lines(results, args.aggregate, args.stat)
+    if args.outfile:
+        with writers.atomic_open(args.outfile, 'w') as fout:
+            fout.write('\n'.join(lines) + '\n')
+        logger.info('Wrote results to ' + args.outfile)
+    else:
+        for line in lines:
+            print(line)
+
+
+# Execute main() from command line
+if __name__ == '__main__':
+    main()
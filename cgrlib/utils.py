@@ -27,10 +27,21 @@ module_logger.setLevel(logging.DEBUG)
 # comports() returns a list of comports available in the system
 from serial.tools.list_ports import comports 
 
+from cgrlib import timing # For timing each phase of a capture
+from cgrlib import metrics # For acquisition counters
+
 
 # Global variables
 cmdterm = '\r\n' # Terminates each command
+cmddelay = 0.1 # Seconds to wait after each command
 fresolution = 0.09313225746 # Frequency resolution (Hz)
+frame_retries = 2 # Captures repeated after a short 'S B' reply
+
+
+class FrameError(IOError):
+    """A capture reply from the unit was incomplete."""
+    pass
+
 
 def int8_to_dec(signed):
     """Return a signed decimal number given a signed 8-bit integer
@@ -95,6 +106,23 @@ def set_arb_value(handle, address, value):
     handle.close()
     return
 
+def set_arb_waveform(handle, values):
+    """ Load and play a waveform in the arbitrary waveform output buffer
+
+    Each value takes one command, so loading a full buffer takes 256
+    times the command delay.
+
+    Arguments:
+      handle -- Serial object for the CGR-101
+      values -- List of up to 256 values (0-255)
+    """
+    for address, value in enumerate(values):
+        set_arb_value(handle, address, value)
+    handle.open()
+    sendcmd(handle,'W P')
+    handle.close()
+    return
+
 def set_output_amplitude(handle, amplitude):
     """ Return the actual output amplitude set on the hardware
 
@@ -104,7 +132,7 @@ def set_output_amplitude(handle, amplitude):
     """
     handle.open()
     if amplitude > 3:
-        module_logger.error('Requested amplitude ' + str(amplitude) + ' Vp. Maximum 3Vp')
+        module_logger.error('Requested amplitude %s Vp. Maximum 3Vp', amplitude)
         amplitude = 3
     azero = int(round(255 * float(amplitude)/3.0))
     actamp = azero * 3.0/255
@@ -135,28 +163,28 @@ def write_cal(handle, calfile, caldict):
             for key in caldict:
                 if (caldict[key] != caldict_old[key]):
                     calchanged = True
-                    module_logger.debug('Cal factor ' + key + ' has changed')
-                    module_logger.debug(str(caldict_old[key]) + ' --> ' +
-                                        str(caldict[key]))
+                    module_logger.debug('Cal factor %s has changed', key)
+                    module_logger.debug('%s --> %s', caldict_old[key],
+                                        caldict[key])
             if calchanged:
                 # The calibration has changed.  Back up the old
                 # calibration file and write a new one.
                 calfile_old = (calfile.split('.')[0] + '_old.' + 
                                calfile.split('.')[1])
                 module_logger.info(
-                    'Backing up calibration file ' + calfile + 
-                    ' to ' + calfile_old
+                    'Backing up calibration file %s to %s',
+                    calfile, calfile_old
                 )
                 shutil.copyfile(calfile,(
                     calfile.split('.')[0] + '_old.' + calfile.split('.')[1]
                 ))
-                module_logger.info('Writing calibration to ' + calfile)
+                module_logger.info('Writing calibration to %s', calfile)
                 with open(calfile,'w') as fout:
                     pickle.dump(caldict,fout)
                     fout.close()
     except IOError:
         # The calfile doesn't exist, so write one.
-        module_logger.info('Writing calibration to ' + calfile)
+        module_logger.info('Writing calibration to %s', calfile)
         with open(calfile,'w') as fout:
             pickle.dump(caldict,fout)
             fout.close()
@@ -213,14 +241,14 @@ def load_cal(handle, calfile):
     """
     try:
         # Try loading the calibration file
-        module_logger.info('Loading calibration file ' + calfile)
+        module_logger.info('Loading calibration file %s', calfile)
         fin = open(calfile,'rb')
         caldict = pickle.load(fin)
         # Make sure all needed calibration factors are in the dictionary
         for key in caldict_default:
             if not key in caldict:
-                module_logger.info('Adding calibration value ' +
-                                   str(key) + ' to dictionary.'
+                module_logger.info('Adding calibration value %s to dictionary.',
+                                   key
                 )
                 caldict[key] = caldict_default[key]
         fin.close()
@@ -247,8 +275,58 @@ def load_cal(handle, calfile):
     return caldict
 
 
-def get_cgr(config):
-    """ Return a serial object for the cgr scope
+def load_cal_file(calfile):
+    """Load and return calibration constants without a CGR unit.
+
+    This is load_cal for offline tools.  If the calibration file
+    doesn't exist, the caldict_default values are returned.
+
+    Arguments:
+      calfile -- Filename for calibration constants saved in Python's
+                 pickle format.
+
+    """
+    caldict = dict(caldict_default)
+    try:
+        module_logger.info('Loading calibration file %s', calfile)
+        with open(calfile,'rb') as fin:
+            caldict.update(pickle.load(fin))
+    except IOError:
+        module_logger.warning(
+            'Failed to open calibration file...using defaults'
+        )
+    return caldict
+
+
+def parse_time(timestr):
+    """Return seconds since the epoch from a time string.
+
+    Raises ValueError if the string can't be understood.
+
+    Arguments:
+      timestr -- 'YYYY-MM-DD HH:MM:SS', 'YYYY-MM-DDTHH:MM:SS',
+                 'YYYY-MM-DD', seconds since the epoch, or None
+    """
+    if timestr is None:
+        return None
+    try:
+        return float(timestr)
+    except ValueError:
+        pass
+    for timeformat in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d']:
+        try:
+            parsed = datetime.strptime(timestr, timeformat)
+            return time.mktime(parsed.timetuple())
+        except ValueError:
+            pass
+    raise ValueError('Could not understand the time ' + timestr)
+
+
+def get_portlist(config):
+    """ Return the serial ports that might have a CGR-101 connected
+
+    The list holds (port name, description, hardware ID) tuples, with
+    the port from the configuration first.
 
     Arguments:
       config -- Configuration object read from configuration file.
@@ -269,62 +347,102 @@ def get_cgr(config):
     # Add the port specified in the configuration to the front of the
     # list.  We have to convert the set object to a list because set
     # objects do not support indexing.
-    portlist = [(config['Connection']['port'],'','')] + list(portset)
+    return [(config['Connection']['port'],'','')] + list(portset)
 
-    for serport in portlist:
-        rawstr = ''
-        try:
-            cgr = serial.Serial()
-            cgr.baudrate = 230400
-            cgr.timeout = 0.1 # Set timeout to 100ms
-            cgr.port = serport[0]
-            module_logger.debug('Trying to connect to CGR-101 at ' + serport[0])
-            cgr.open()
-            # If the port can be configured, it might be a CGR.  Check
-            # to make sure.
-            retnum = cgr.write("i\r\n") # Request the identity string
-            rawstr = cgr.read(10) # Read a small number of bytes
-            cgr.close()
-            if rawstr.count('Syscomp') == 1:
-                # Success!  We found a CGR-101 unit!
-                module_logger.info('Connecting to CGR-101 at ' +
-                                    str(serport[0]))
-                # Write the successful connection port to the configuration
-                config['Connection']['port'] = str(serport[0])
-                config.write()
-                return cgr
-            else:
-                module_logger.info('Could not open ' + serport[0])
-                if serport == portlist[-1]: # This is the last port
-                    module_logger.error(
-                        'Did not find any CGR-101 units.  Exiting.'
-                    )
-                    sys.exit()
-        # Catch exceptions caused by problems opening a filesystem node as
-        # a serial port, by problems caused by the node not existing, and
-        # general tty problems.
-        except (serial.serialutil.SerialException, 
-                OSError, termios.error):
-            module_logger.debug('Could not open ' + serport[0])
-            if serport == portlist[-1]: # This is the last port
-                module_logger.error(
-                    'Did not find any CGR-101 units.  Exiting.'
-                )
-                sys.exit()
-        # This exception should never get handled.  It's just for debugging.
-        except Exception as ex:
-            template = "An exception of type: {0} occured. Arguments:\n{1!r}"
-            message = template.format((type(ex).__module__ + '.' + 
-                                       type(ex).__name__), ex.args)
-            module_logger.error(message)
-            sys.exit()
+def probe_cgr(port):
+    """ Return a serial object for a CGR-101 at a port, or None if
+    there isn't one
+
+    Arguments:
+      port -- Serial port name
+    """
+    rawstr = ''
+    try:
+        cgr = serial.Serial()
+        cgr.baudrate = 230400
+        cgr.timeout = 0.1 # Set timeout to 100ms
+        cgr.port = port
+        module_logger.debug('Trying to connect to CGR-101 at %s', port)
+        cgr.open()
+        # If the port can be configured, it might be a CGR.  Check
+        # to make sure.
+        retnum = cgr.write("i\r\n") # Request the identity string
+        rawstr = cgr.read(10) # Read a small number of bytes
+        cgr.close()
+        if rawstr.count('Syscomp') == 1:
+            # Success!  We found a CGR-101 unit!
+            return cgr
+        else:
+            module_logger.info('Could not open %s', port)
+    # Catch exceptions caused by problems opening a filesystem node as
+    # a serial port, by problems caused by the node not existing, and
+    # general tty problems.
+    except (serial.serialutil.SerialException, 
+            OSError, termios.error):
+        module_logger.debug('Could not open %s', port)
+    # This exception should never get handled.  It's just for debugging.
+    except Exception as ex:
+        template = "An exception of type: {0} occured. Arguments:\n{1!r}"
+        message = template.format((type(ex).__module__ + '.' + 
+                                   type(ex).__name__), ex.args)
+        module_logger.error(message)
+        sys.exit()
+    return None
+
+def get_cgr(config):
+    """ Return a serial object for the cgr scope
+
+    Arguments:
+      config -- Configuration object read from configuration file.
+    """
+    for serport in get_portlist(config):
+        cgr = probe_cgr(serport[0])
+        if cgr is not None:
+            module_logger.info('Connecting to CGR-101 at %s', serport[0])
+            # Write the successful connection port to the configuration
+            config['Connection']['port'] = str(serport[0])
+            config.write()
+            return cgr
+    module_logger.error(
+        'Did not find any CGR-101 units.  Exiting.'
+    )
+    sys.exit()
+
+def get_cgr_list(config):
+    """ Return serial objects for every CGR-101 that's connected
+
+    The unit at the configured port comes first if there is one.
+
+    Arguments:
+      config -- Configuration object read from configuration file.
+    """
+    cgrlist = []
+    devices = set() # Ports already tried, with links resolved
+    for serport in get_portlist(config):
+        device = os.path.realpath(serport[0])
+        if device in devices:
+            continue
+        devices.add(device)
+        cgr = probe_cgr(serport[0])
+        if cgr is not None:
+            module_logger.info('Connecting to CGR-101 at %s', serport[0])
+            cgrlist.append(cgr)
+    if not cgrlist:
+        module_logger.error(
+            'Did not find any CGR-101 units.  Exiting.'
+        )
+        sys.exit()
+    # Write the first connection port to the configuration
+    config['Connection']['port'] = str(cgrlist[0].port)
+    config.write()
+    return cgrlist
 
 
 def flush_cgr(handle):
     readstr = 'junk'
     while (len(readstr) > 0):
         readstr = handle.read(100)
-        module_logger.info('Flushed ' + str(len(readstr)) + ' characters')
+        module_logger.info('Flushed %d characters', len(readstr))
 
 
 def sendcmd(handle,cmd):
@@ -335,9 +453,12 @@ def sendcmd(handle,cmd):
       cmd -- Command string
 
     """
-    handle.write(cmd + cmdterm)
-    module_logger.debug('Sent command ' + cmd)
-    time.sleep(0.1) # Can't run at full speed.
+    with timing.phase('command'):
+        handle.write(cmd + cmdterm)
+    metrics.increment('cgr_serial_bytes_out_total', len(cmd + cmdterm))
+    module_logger.debug('Sent command %s', cmd)
+    with timing.phase('pacing'):
+        time.sleep(cmddelay) # Can't run at full speed.
 
 
 def get_samplebits(fsamp_req):
@@ -470,14 +591,14 @@ def set_eeprom_offlist(handle,offlist):
         else:
             unsigned_list.append(offset)
     handle.open()
-    module_logger.debug('Writing chA 10x offset of ' + str(unsigned_list[0]) +
-                        ' to eeprom')
-    module_logger.debug('Writing chA 1x offset of ' + str(unsigned_list[1]) +
-                        ' to eeprom')
-    module_logger.debug('Writing chB 10x offset of ' + str(unsigned_list[2]) +
-                        ' to eeprom')
-    module_logger.debug('Writing chB 1x offset of ' + str(unsigned_list[3]) +
-                        ' to eeprom')
+    module_logger.debug('Writing chA 10x offset of %d to eeprom',
+                        unsigned_list[0])
+    module_logger.debug('Writing chA 1x offset of %d to eeprom',
+                        unsigned_list[1])
+    module_logger.debug('Writing chB 10x offset of %d to eeprom',
+                        unsigned_list[2])
+    module_logger.debug('Writing chB 1x offset of %d to eeprom',
+                        unsigned_list[3])
     sendcmd(handle,('S F ' + 
                     str(unsigned_list[0]) + ' ' +
                     str(unsigned_list[1]) + ' ' +
@@ -513,11 +634,10 @@ def set_trig_samples(handle,trigdict):
     handle.close()
     
 
-def set_ctrl_reg(handle,fsamp_req,trigdict):
-    """ Sets the CGR-101's conrol register.
+def get_ctrl_reg(fsamp_req,trigdict):
+    """ Returns [control register value, actual sample rate]
 
     Arguments:
-      handle -- Serial object for the CGR-101
       fsamp_req -- Requested sample rate in Hz.  The actual rate will
                    be determined using those allowed for the unit.
       trigdict -- Dictionary of trigger settings.  See get_trig_dict
@@ -538,6 +658,21 @@ def set_ctrl_reg(handle,fsamp_req,trigdict):
         reg_value += (0 << 5)
     elif trigdict['trigpol'] == 1: # Falling edge
         reg_value += (1 << 5)
+    return [reg_value,fsamp_act]
+
+
+def set_ctrl_reg(handle,fsamp_req,trigdict):
+    """ Sets the CGR-101's conrol register.
+
+    Arguments:
+      handle -- Serial object for the CGR-101
+      fsamp_req -- Requested sample rate in Hz.  The actual rate will
+                   be determined using those allowed for the unit.
+      trigdict -- Dictionary of trigger settings.  See get_trig_dict
+                  for more details.
+
+    """
+    [reg_value,fsamp_act] = get_ctrl_reg(fsamp_req,trigdict)
     handle.open()
     sendcmd(handle,('S R ' + str(reg_value)))
     handle.close()
@@ -627,6 +762,93 @@ def set_trig_level(handle, caldict, gainlist, trigdict):
     handle.close()
 
 
+def get_unit_name(handle):
+    """Return the name a unit's metrics are labelled with: its serial
+    port, or None if the handle doesn't have one
+
+    Arguments:
+      handle -- Serial object for the CGR-101
+    """
+    return getattr(handle, 'port', None)
+
+
+def count_frame(retdata, hexdata, unit=None):
+    """Update the capture metrics for data returned by 'S B'.
+
+    A good reply is one header byte followed by 4096 data bytes (1024
+    16-bit samples from each channel), which is 8192 hex characters.
+
+    Arguments:
+      retdata -- Bytes read from the unit
+      hexdata -- Hex string of the data bytes
+      unit -- Unit name for the metrics (see get_unit_name)
+    """
+    metrics.increment('cgr_serial_bytes_in_total', len(retdata))
+    metrics.capture_done(unit)
+    if len(hexdata) < 8192:
+        metrics.increment('cgr_short_frames_total')
+        module_logger.warning('Short capture: got %d of 4096 bytes',
+                              len(hexdata)/2)
+
+
+def get_frame_data(hexdata, lastpoint):
+    """Returns uncalibrated data decoded from an 'S B' reply.
+
+    Returned data is:
+      [ list of channel A integers, list of channel B integers ]
+
+    Arguments:
+      hexdata -- Hex string of the capture data, without the reply's
+                 first byte
+      lastpoint -- Address of the last captured sample.  The unit
+                   captures into a ring buffer, so the data is rotated
+                   to put the oldest sample first.
+
+    Raises FrameError if the reply is too short to hold a capture, or
+    has samples that don't fit in 10 bits.
+    """
+    if len(hexdata) < 8192:
+        raise FrameError('Capture reply has ' + str(len(hexdata)//2) +
+                         ' of 4096 data bytes')
+    with timing.phase('decode'):
+        bothdata = [] # Alternating data from both channels
+        adecdata = [] # A channel data
+        bdecdata = [] # B channel data 
+        # Data returned from the unit has alternating words of channel A
+        # and channel B data.  Each word is 16 bits (four hex characters)
+        for samplenum in range(2048):
+            sampleval = int(hexdata[(samplenum*4):(samplenum*4 + 4)],16)
+            bothdata.append(sampleval)
+        if max(bothdata) > 1023:
+            # Samples are only 10 bits
+            metrics.increment('cgr_corrupt_frames_total')
+            raise FrameError('Capture has out-of-range samples')
+        adecdata = collections.deque(bothdata[0::2])
+        adecdata.rotate(1024-lastpoint)
+        bdecdata = collections.deque(bothdata[1::2])
+        bdecdata.rotate(1024-lastpoint)
+    return [list(adecdata),list(bdecdata)]
+
+
+def get_frame_retried(capture, *args):
+    """Return the data from a capture function, repeating the capture
+    if the unit's reply was incomplete.
+
+    Raises the last FrameError if every attempt fails.
+
+    Arguments:
+      capture -- Capture function, like capture_triggered
+      args -- Arguments for the capture function
+    """
+    for attempt in range(frame_retries + 1):
+        try:
+            return capture(*args)
+        except FrameError as ex:
+            if attempt == frame_retries:
+                raise
+            module_logger.warning('%s.  Capturing again.', ex)
+
+
 def get_uncal_triggered_data(handle, trigdict):
     """Return uncalibrated integer data.
 
@@ -638,12 +860,30 @@ def get_uncal_triggered_data(handle, trigdict):
     Returned data is:
       [ list of channel A integers, list of channel B integers ] 
 
+    Arguments:
+      handle -- Serial object for the CGR-101.
+      trigdict -- Dictionary of trigger settings (see get_trig_dict
+                  for more details.
+
+    A capture with an incomplete reply is repeated up to frame_retries
+    times before FrameError is raised.
+    """
+    return get_frame_retried(capture_triggered, handle, trigdict)
+
+
+def capture_triggered(handle, trigdict):
+    """Return uncalibrated integer data from one triggered capture.
+
+    See get_uncal_triggered_data.  Raises FrameError if the reply is
+    incomplete.
+
     Arguments:
       handle -- Serial object for the CGR-101.
       trigdict -- Dictionary of trigger settings (see get_trig_dict
                   for more details.
     """
     handle.open()
+    metrics.capture_armed(get_unit_name(handle))
     sendcmd(handle,'S G') # Start the capture
     sys.stdout.write('Waiting for ' + 
                      '{:0.2f}'.format(trigdict['triglev']) +
@@ -658,28 +898,23 @@ def get_uncal_triggered_data(handle, trigdict):
     # The unit will reply with 3 bytes when it's done capturing data:
     # "A", high byte of last capture location, low byte
     # Wait on those three bytes.
-    while (len(retstr) < 3):
-        retstr = handle.read(10)
+    with timing.phase('trigger'):
+        while (len(retstr) < 3):
+            retstr = handle.read(10)
+            if len(retstr) == 0:
+                # The serial read timed out before the trigger
+                metrics.increment('cgr_trigger_timeouts_total')
+    metrics.increment('cgr_serial_bytes_in_total', len(retstr))
     lastpoint = int(binascii.hexlify(retstr)[2:],16)
-    module_logger.debug('Capture ended at address ' + str(lastpoint))
-    sendcmd(handle,'S B') # Query the data
-    retdata = handle.read(5000) # Read until timeout
+    module_logger.debug('Capture ended at address %d', lastpoint)
+    with timing.phase('transfer'):
+        sendcmd(handle,'S B') # Query the data
+        retdata = handle.read(5000) # Read until timeout
     hexdata = binascii.hexlify(retdata)[2:]
-    module_logger.debug('Got ' + str(len(hexdata)/2) + ' bytes')
+    module_logger.debug('Got %d bytes', len(hexdata)/2)
     handle.close()
-    bothdata = [] # Alternating data from both channels
-    adecdata = [] # A channel data
-    bdecdata = [] # B channel data 
-    # Data returned from the unit has alternating words of channel A
-    # and channel B data.  Each word is 16 bits (four hex characters)
-    for samplenum in range(2048):
-        sampleval = int(hexdata[(samplenum*4):(samplenum*4 + 4)],16)
-        bothdata.append(sampleval)
-    adecdata = collections.deque(bothdata[0::2])
-    adecdata.rotate(1024-lastpoint)
-    bdecdata = collections.deque(bothdata[1::2])
-    bdecdata.rotate(1024-lastpoint)
-    return [list(adecdata),list(bdecdata)]
+    count_frame(retdata, hexdata, get_unit_name(handle))
+    return get_frame_data(hexdata, lastpoint)
 
 
 def reset(handle):
@@ -706,6 +941,7 @@ def force_trigger(handle, ctrl_reg):
     old_reg = ctrl_reg
     new_reg = ctrl_reg | (1 << 6)
     handle.open()
+    metrics.capture_armed(get_unit_name(handle))
     sendcmd(handle,'S G') # Start the capture
     sendcmd(handle,('S R ' + str(new_reg))) # Ready for forced trigger
     module_logger.info('Forcing trigger')
@@ -726,30 +962,35 @@ def get_uncal_forced_data(handle,ctrl_reg):
       handle -- Serial object for the CGR-101.
       ctrl_reg -- Value of the control register.
 
+    A capture with an incomplete reply is repeated up to frame_retries
+    times before FrameError is raised.
     """
-    force_trigger(handle, ctrl_reg)
+    return get_frame_retried(capture_forced, handle, ctrl_reg)
+
+
+def capture_forced(handle, ctrl_reg):
+    """Return uncalibrated integer data from one forced capture.
+
+    See get_uncal_forced_data.  Raises FrameError if the reply is
+    incomplete.
+
+    Arguments:
+      handle -- Serial object for the CGR-101.
+      ctrl_reg -- Value of the control register.
+    """
+    with timing.phase('trigger'):
+        force_trigger(handle, ctrl_reg)
     handle.open()
-    sendcmd(handle,'S B') # Query the data
-    retdata = handle.read(5000)
+    with timing.phase('transfer'):
+        sendcmd(handle,'S B') # Query the data
+        retdata = handle.read(5000)
     hexdata = binascii.hexlify(retdata)[2:]
-    module_logger.debug('Got ' + str(len(hexdata)/2) + ' bytes')
+    module_logger.debug('Got %d bytes', len(hexdata)/2)
     handle.close()
+    count_frame(retdata, hexdata, get_unit_name(handle))
     # There is no last capture location for forced triggers. Setting
     # lastpoint to zero doesn't rotate the data.
-    lastpoint = 0
-    bothdata = [] # Alternating data from both channels
-    adecdata = [] # A channel data
-    bdecdata = [] # B channel data 
-    # Data returned from the unit has alternating words of channel A
-    # and channel B data.  Each word is 16 bits (four hex characters)
-    for samplenum in range(2048):
-        sampleval = int(hexdata[(samplenum*4):(samplenum*4 + 4)],16)
-        bothdata.append(sampleval)
-    adecdata = collections.deque(bothdata[0::2])
-    adecdata.rotate(1024-lastpoint)
-    bdecdata = collections.deque(bothdata[1::2])
-    bdecdata.rotate(1024-lastpoint)
-    return [list(adecdata),list(bdecdata)]
+    return get_frame_data(hexdata, 0)
 
         
 def get_cal_data(caldict,gainlist,rawdata):
@@ -779,12 +1020,13 @@ def get_cal_data(caldict,gainlist,rawdata):
         # Channel B has 10x gain
         chB_slope = caldict['chB_10x_slope']
         chB_offset = caldict['chB_10x_offset']
-    # Process channel A data
-    cha_voltdata = []
-    for sample in rawdata[0]:
-        cha_voltdata.append((511 - (sample + chA_offset))*chA_slope)
-    # Process channel B data
-    chb_voltdata = []
-    for sample in rawdata[1]:
-        chb_voltdata.append((511 - (sample + chB_offset))*chB_slope)
+    with timing.phase('calibration'):
+        # Process channel A data
+        cha_voltdata = []
+        for sample in rawdata[0]:
+            cha_voltdata.append((511 - (sample + chA_offset))*chA_slope)
+        # Process channel B data
+        chb_voltdata = []
+        for sample in rawdata[1]:
+            chb_voltdata.append((511 - (sample + chB_offset))*chB_slope)
     return [cha_voltdata,chb_voltdata]
@@ -0,0 +1,286 @@
+# writers.py
+#
+# Data file writers for the CGR-101 USB oscilloscope
+#
+# Every writer builds its whole output with array operations and
+# writes it through atomic_open, so a reader never sees a partially
+# written file.
+
+import logging  # The python logging module
+import os # For renaming temporary files
+import struct # For binary headers
+import tempfile # For temporary files next to the output
+import time # For timestamps
+from contextlib import contextmanager
+
+from cgrlib import lazy
+
+# numpy is only imported when a writer first runs, so the tools can
+# list the formats for --help without it
+numpy = lazy.LazyModule('numpy')
+
+# create logger
+module_logger = logging.getLogger('root.writers')
+module_logger.setLevel(logging.DEBUG)
+
+# Global variables
+binary_magic = 'CGRB'.encode('ascii')
+binary_version = 1
+
+"""Specify the binary file header.
+
+  magic (4 bytes)       'CGRB'
+  version (uint16)
+  flags (uint16)        bit 0 set if raw counts follow the voltages
+  points (uint32)       Samples per channel
+  averages (uint32)     Number of captures averaged
+  rate (float64)        Sample rate (Hz)
+  timestamp (float64)   Capture time (seconds since the epoch)
+
+The header is followed by channel A and channel B voltages, then
+(optionally) channel A and channel B raw counts.  All values are
+little-endian float64.
+
+"""
+binary_header_format = '<4sHHIIdd'
+binary_raw_flag = 1
+
+
+@contextmanager
+def atomic_open(filename, mode='wb'):
+    """Open a temporary file that replaces filename when closed.
+
+    The temporary file is created in the same directory as filename
+    and renamed over it only if the with block finishes without an
+    exception.  Otherwise it's removed and filename is left alone.
+
+    Arguments:
+      filename -- The file to write
+      mode -- File mode ('w' or 'wb')
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    (handle, tempname) = tempfile.mkstemp(
+        dir=directory, prefix='.' + os.path.basename(filename) + '.'
+    )
+    try:
+        with os.fdopen(handle, mode) as fout:
+            yield fout
+            fout.flush()
+            os.fsync(fout.fileno())
+        # mkstemp files are private.  Give the output the usual
+        # permissions instead.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tempname, 0o666 & ~umask)
+        os.rename(tempname, filename)
+    except:
+        os.remove(tempname)
+        raise
+
+
+def get_rate(timedata):
+    """Return the sample rate implied by a list of sample times
+
+    Arguments:
+      timedata -- List of sample times
+    """
+    if len(timedata) < 2:
+        return 0.0
+    return 1.0/(timedata[1] - timedata[0])
+
+
+def format_text(timedata, voltdata):
+    """Return the fixed-width text table written by cgr-capture.
+
+    The whole table is produced by a single formatting operation
+    instead of three writes per row.
+
+    Arguments:
+      timedata -- List of sample times
+      voltdata -- [Channel A voltages, Channel B voltages]
+    """
+    table = numpy.column_stack((timedata, voltdata[0], voltdata[1]))
+    header = ('# Created by cgr-capture' + '\n' +
+              '{:<20}'.format('# Time (s)') +
+              '{:<20}'.format('Channel A (V)') +
+              '{:<20}'.format('Channel B (V)') + '\n')
+    rowformat = '%-20.5e%-20.5e%-20.5e\n'
+    return header + (rowformat * len(table)) % tuple(table.ravel())
+
+
+def format_csv(timedata, voltdata):
+    """Return a comma-separated table with a header row.
+
+    Arguments:
+      timedata -- List of sample times
+      voltdata -- [Channel A voltages, Channel B voltages]
+    """
+    table = numpy.column_stack((timedata, voltdata[0], voltdata[1]))
+    header = 'time_s,channel_a_v,channel_b_v\n'
+    rowformat = '%.6e,%.6e,%.6e\n'
+    return header + (rowformat * len(table)) % tuple(table.ravel())
+
+
+def write_text(filename, timedata, voltdata, rawdata=None, metadata=None):
+    """Write the fixed-width text format.
+
+    Arguments:
+      filename -- Output file name
+      timedata -- List of sample times
+      voltdata -- [Channel A voltages, Channel B voltages]
+      rawdata -- Ignored.  Text files only hold voltages.
+      metadata -- Ignored.
+    """
+    with atomic_open(filename, 'w') as fout:
+        fout.write(format_text(timedata, voltdata))
+
+
+def write_csv(filename, timedata, voltdata, rawdata=None, metadata=None):
+    """Write comma-separated values.
+
+    Arguments:
+      filename -- Output file name
+      timedata -- List of sample times
+      voltdata -- [Channel A voltages, Channel B voltages]
+      rawdata -- Ignored.  CSV files only hold voltages.
+      metadata -- Ignored.
+    """
+    with atomic_open(filename, 'w') as fout:
+        fout.write(format_csv(timedata, voltdata))
+
+
+def write_npy(filename, timedata, voltdata, rawdata=None, metadata=None):
+    """Write a 3 x N numpy array of [times, channel A, channel B].
+
+    Arguments:
+      filename -- Output file name
+      timedata -- List of sample times
+      voltdata -- [Channel A voltages, Channel B voltages]
+      rawdata -- Ignored.  Use the npz format to keep raw counts.
+      metadata -- Ignored.
+    """
+    table = numpy.vstack((timedata, voltdata[0], voltdata[1]))
+    with atomic_open(filename, 'wb') as fout:
+        numpy.save(fout, table)
+
+
+def write_npz(filename, timedata, voltdata, rawdata=None, metadata=None):
+    """Write a numpy archive of times, voltages, raw counts and metadata.
+
+    The archive holds the arrays 'time' (N), 'volts' (2 x N) and, if
+    given, 'raw' (2 x N).  Each metadata item is stored as its own
+    array.
+
+    Arguments:
+      filename -- Output file name
+      timedata -- List of sample times
+      voltdata -- [Channel A voltages, Channel B voltages]
+      rawdata -- [Channel A counts, Channel B counts] or None
+      metadata -- Dictionary of scalar values (rate, averages, ...)
+    """
+    arrays = {}
+    if metadata:
+        for key in metadata:
+            arrays[key] = numpy.asarray(metadata[key])
+    arrays['time'] = numpy.asarray(timedata, dtype=float)
+    arrays['volts'] = numpy.asarray(voltdata, dtype=float)
+    if rawdata is not None:
+        arrays['raw'] = numpy.asarray(rawdata, dtype=float)
+    with atomic_open(filename, 'wb') as fout:
+        numpy.savez(fout, **arrays)
+
+
+def write_binary(filename, timedata, voltdata, rawdata=None, metadata=None):
+    """Write the headered binary format (see binary_header_format).
+
+    Arguments:
+      filename -- Output file name
+      timedata -- List of sample times
+      voltdata -- [Channel A voltages, Channel B voltages]
+      rawdata -- [Channel A counts, Channel B counts] or None
+      metadata -- Dictionary that may set 'averages', 'rate' and
+                  'timestamp'
+    """
+    if metadata is None:
+        metadata = {}
+    flags = 0
+    payload = [numpy.asarray(voltdata, dtype='<f8')]
+    if rawdata is not None:
+        flags |= binary_raw_flag
+        payload.append(numpy.asarray(rawdata, dtype='<f8'))
+    header = struct.pack(binary_header_format, binary_magic,
+                         binary_version, flags, len(timedata),
+                         int(metadata.get('averages', 1)),
+                         float(metadata.get('rate', get_rate(timedata))),
+                         float(metadata.get('timestamp', time.time())))
+    with atomic_open(filename, 'wb') as fout:
+        fout.write(header)
+        for block in payload:
+            fout.write(block.tostring())
+
+
+def read_binary(filename):
+    """Return (header dictionary, voltdata, rawdata) from a binary file.
+
+    rawdata is None if the file doesn't hold raw counts.
+
+    Arguments:
+      filename -- File written by write_binary
+    """
+    headsize = struct.calcsize(binary_header_format)
+    with open(filename, 'rb') as fin:
+        (magic, version, flags, points, averages, rate,
+         timestamp) = struct.unpack(binary_header_format, fin.read(headsize))
+        if magic != binary_magic or version != binary_version:
+            raise IOError(filename + ' is not a version ' +
+                          str(binary_version) + ' cgrlib binary file')
+        data = numpy.fromfile(fin, dtype='<f8')
+    header = {'points': points, 'averages': averages, 'rate': rate,
+              'timestamp': timestamp}
+    voltdata = data[:2 * points].reshape(2, points)
+    rawdata = None
+    if flags & binary_raw_flag:
+        rawdata = data[2 * points:4 * points].reshape(2, points)
+    return (header, voltdata, rawdata)
+
+
+"""Specify the available output formats.
+
+This dictionary is where the format names used on the command line
+are defined.  If you add a writer, register it here.
+
+"""
+formats = {
+    'text': write_text,
+    'csv': write_csv,
+    'npy': write_npy,
+    'npz': write_npz,
+    'binary': write_binary
+}
+
+# Conventional file name extensions for the formats
+extensions = {
+    'text': 'dat',
+    'csv': 'csv',
+    'npy': 'npy',
+    'npz': 'npz',
+    'binary': 'bin'
+}
+
+
+def write_data(filename, fmt, timedata, voltdata, rawdata=None,
+               metadata=None):
+    """Write capture data using one of the registered formats.
+
+    Arguments:
+      filename -- Output file name
+      fmt -- Format name (a key of formats)
+      timedata -- List of sample times
+      voltdata -- [Channel A voltages, Channel B voltages]
+      rawdata -- [Channel A counts, Channel B counts] or None
+      metadata -- Dictionary of scalar values (rate, averages, ...)
+    """
+    if not fmt in formats:
+        raise ValueError('Unknown data format ' + str(fmt))
+    module_logger.info('Writing ' + fmt + ' data to ' + filename)
+    formats[fmt](filename, timedata, voltdata, rawdata, metadata)
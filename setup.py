@@ -6,7 +6,10 @@ entry_points = {
         'cgr-capture = cgrlib.tools.cgr_capture:main',
         'cgr-cal = cgrlib.tools.cgr_cal:main',
         'cgr-gen = cgrlib.tools.cgr_gen:main',
-        'cgr-imp = cgrlib.tools.cgr_imp:main'
+        'cgr-imp = cgrlib.tools.cgr_imp:main',
+        'cgr-export = cgrlib.tools.cgr_export:main',
+        'cgr-query = cgrlib.tools.cgr_query:main',
+        'cgr-fit = cgrlib.tools.cgr_fit:main'
     ]
 }
 